@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""Time-to-first-device and peak memory of reading devices/all
+
+    python3 bench/devices.py [sizes...]
+
+Serves a devices/all response of 100, 1,000 and 10,000 devices by default,
+each with a full set of attributes, from a local server. For each size, a
+fresh process runs the device refresh of `hb update` against it, and so does
+a process that reads the whole body and decodes it with json.loads first, as
+hb update used to. Prints the response size, when the first device was
+decoded, the total time, and how much the peak RSS grew while reading.
+"""
+
+import http.server
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SIZES = [100, 1000, 10000]
+
+
+def make_device(i):
+    attributes = {'switch': 'on', 'level': str(i % 100), 'hue': '50', 'saturation': '80', 'colorTemperature': '2700',
+                  'colorName': 'Warm White', 'colorMode': 'CT', 'power': '%0.1f' % (i * 0.3), 'energy': '12.5',
+                  'voltage': '120.2', 'amperage': '0.1', 'temperature': '71.5', 'humidity': '40', 'battery': '95',
+                  'lastActivity': '2024-01-01T12:00:00+0000', 'healthStatus': 'online', 'RGB': '#FFEEDD',
+                  'effectName': 'None', 'lightEffects': '{"1":"Fade","2":"Flash","3":"Strobe","4":"Random"}',
+                  'supportedThermostatModes': '[auto, cool, heat, off]' if 0 == i % 10 else None}
+    return {'id': str(i), 'name': 'Device %d' % i, 'label': 'Living Room Lamp %d' % i,
+            'type': 'Generic Zigbee RGBW Light', 'room': 'Living Room', 'date': '2024-01-01T12:00:00+0000',
+            'model': 'RGBW-1', 'manufacturer': 'Acme', 'capabilities': ['Switch', 'SwitchLevel', 'ColorControl',
+            'ColorTemperature', 'Light', 'Refresh', 'Actuator', 'Sensor', 'PowerMeter', 'Configuration'],
+            'attributes': attributes,
+            'commands': ['on', 'off', 'setLevel', 'setColor', 'setHue', 'setSaturation', 'setColorTemperature',
+                         'refresh', 'configure', 'startLevelChange', 'stopLevelChange', 'flash']}
+
+
+def serve(body):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def max_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return rss / (1 << 20) if 'darwin' == sys.platform else rss / 1024
+
+
+def child(how, hub_ip):
+    """Refresh the devices from the hub at `hub_ip` and print the measurements as JSON"""
+    import command
+    from workflow import Workflow
+    wf = Workflow()
+    wf.settings
+    first = []
+    fetch = command.get_devices
+
+    def whole(wf, api_key, hub_id, hub_ip):
+        from workflow import web
+        r = web.get('http://'+hub_ip+'/apps/api/5/devices/all', {'access_token': api_key})
+        return iter(json.loads(r.content))
+
+    def timed(*args):
+        for device in (whole if 'json.loads' == how else fetch)(*args):
+            if not first:
+                first.append(time.perf_counter())
+            yield device
+
+    command.get_devices = timed
+    before = max_rss()
+    start = time.perf_counter()
+    added, removed, changed = command.refresh_devices(wf, 'KEY', '', hub_ip)
+    end = time.perf_counter()
+    print(json.dumps({'devices': len(added), 'first': first[0] - start, 'total': end - start,
+                      'rss': max_rss() - before}))
+
+
+def measure(how, hub_ip):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, alfred_workflow_bundleid='net.schwark.hubitat', alfred_workflow_name='Hubitat',
+                   alfred_workflow_version='1.0', alfred_workflow_data=os.path.join(tmp, 'data'),
+                   alfred_workflow_cache=os.path.join(tmp, 'cache'))
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', how, hub_ip], cwd=ROOT,
+                                env=env, check=True, capture_output=True, text=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main(sizes):
+    print('%7s %9s %-10s %10s %10s %12s' % ('devices', 'body MB', 'read', 'first ms', 'total ms', 'peak RSS +MB'))
+    for size in sizes:
+        body = json.dumps([make_device(i) for i in range(1, size + 1)]).encode('utf-8')
+        server = serve(body)
+        hub_ip = '127.0.0.1:%d' % server.server_address[1]
+        for how in ['streamed', 'json.loads']:
+            result = measure(how, hub_ip)
+            assert result['devices'] == size
+            print('%7d %9.1f %-10s %10.1f %10.1f %12.1f' % (size, len(body) / (1 << 20), how, result['first'] * 1000,
+                                                            result['total'] * 1000, result['rss']))
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    if ['--child'] == sys.argv[1:2]:
+        child(*sys.argv[2:4])
+    else:
+        main([int(size) for size in sys.argv[1:]] or SIZES)
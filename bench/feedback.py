@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""Time building and encoding script filter feedback
+
+    python3 bench/feedback.py [sizes...]
+
+For 10, 100 and 1,000 device items by default, prints the time to add the
+items, then to encode them the way send_feedback does (Workflow._json)
+against json.dumps(wf.obj), which it replaced.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+
+from test_feedback import add_device_items  # noqa: E402
+
+SIZES = [10, 100, 1000]
+
+
+def best(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main(sizes):
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault('alfred_workflow_bundleid', 'net.schwark.hubitat')
+    os.environ.setdefault('alfred_workflow_data', os.path.join(tmp, 'data'))
+    os.environ.setdefault('alfred_workflow_cache', os.path.join(tmp, 'cache'))
+    from workflow import Workflow
+    wf = Workflow()
+    print('%6s %12s %14s %14s %8s' % ('items', 'add_item ms', 'json.dumps ms', '_json ms', 'speedup'))
+    for size in sizes:
+        number = max(1, 10000 // size)
+
+        def add():
+            wf._items = []
+            add_device_items(wf, size)
+
+        added = best(add, number)
+        assert wf._json() == json.dumps(wf.obj)
+        dumps = best(lambda: json.dumps(wf.obj), number)
+        direct = best(wf._json, number)
+        print('%6d %12.3f %14.3f %14.3f %7.1fx' % (size, added * 1000, dumps * 1000, direct * 1000, dumps / direct))
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or SIZES)
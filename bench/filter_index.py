@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""Time Workflow.filter over plain items against a prebuilt FilterIndex
+
+    python3 bench/filter_index.py [sizes...]
+
+Prints, for 100, 1,000 and 10,000 items by default, how long building the
+index takes and the mean time per query filtering the items and the index.
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+
+from test_filter_index import make_items, make_queries  # noqa: E402
+from workflow import MATCH_ATOM, MATCH_STARTSWITH, MATCH_SUBSTRING  # noqa: E402
+
+SIZES = [100, 1000, 10000]
+# the rules filter.py searches devices with
+MATCH_ON = MATCH_STARTSWITH | MATCH_ATOM | MATCH_SUBSTRING
+
+
+def key(item):
+    return item['label']
+
+
+def main(sizes):
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault('alfred_workflow_bundleid', 'net.schwark.hubitat')
+    os.environ.setdefault('alfred_workflow_data', os.path.join(tmp, 'data'))
+    os.environ.setdefault('alfred_workflow_cache', os.path.join(tmp, 'cache'))
+    from workflow import Workflow
+    wf = Workflow()
+    print('%8s %10s %14s %14s %8s' % ('items', 'build ms', 'plain ms/q', 'index ms/q', 'speedup'))
+    for size in sizes:
+        items = make_items(size)
+        queries = make_queries(items)
+        build = min(timeit.repeat(lambda: wf.filter_index(items, key), number=1, repeat=3))
+        index = wf.filter_index(items, key)
+
+        def run(source, **kwargs):
+            for query in queries:
+                wf.filter(query, source, min_score=80, match_on=MATCH_ON, **kwargs)
+
+        # the first pass builds the postings the queries need
+        run(index)
+        plain = min(timeit.repeat(lambda: run(items, key=key), number=1, repeat=3)) / len(queries)
+        indexed = min(timeit.repeat(lambda: run(index), number=1, repeat=3)) / len(queries)
+        print('%8d %10.2f %14.3f %14.3f %7.1fx' % (size, build * 1000, plain * 1000, indexed * 1000, plain / indexed))
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or SIZES)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""Show where the cold start of filter.py goes when it serves saved results
+
+    python3 bench/import_time.py [count]
+
+Runs the same cached query tests/test_import_budget.py checks, under
+``python -X importtime``, and prints the total against the budget in
+tests/import_budget.json followed by the `count` slowest top-level imports.
+Exits with status 1 if the total is over the budget - run it on an idle
+machine, as the test suite leaves the timing out.
+"""
+
+import os
+import pathlib
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+
+from test_import_budget import cached_query_imports, load_budget  # noqa: E402
+
+
+def main(count):
+    with tempfile.TemporaryDirectory() as tmp:
+        rows, first, cached = cached_query_imports(pathlib.Path(tmp))
+    top = [(name, cumulative) for name, cumulative, nested in rows if not nested]
+    total = sum(cumulative for name, cumulative in top) / 1000
+    budget = load_budget()['cached_query_ms']
+    print('%d modules, %0.1f ms of imports, budget %d ms' % (len(rows), total, budget))
+    for name, cumulative in sorted(top, key=lambda row: -row[1])[:count]:
+        print('%8.2f ms  %s' % (cumulative / 1000, name))
+    return 0 if total <= budget else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 15))
@@ -0,0 +1,206 @@
+# encoding: utf-8
+
+"""Named colors, and conversions between the ways devices report color.
+
+The color names downloaded on update are stored as the 'colors' vocabulary
+(see vocabulary.py), so a single name can be found by bisecting the lines of
+the memory-mapped file without reading the rest of it. A ColorTable is cheap
+to create; nothing is read until a color is looked up, so queries that never
+touch a color never pay for the table.
+
+To name a color a device reports, a second vocabulary is built along with
+it. It maps the hex value of every named color back to its name, and every
+cell of a 16x16x16 grid over RGB to the named color nearest the middle of
+the cell in CIE Lab, where distances follow perceived difference. The cells
+are matched to colors through a k-d tree over the palette, so building the
+grid takes a fraction of a second and naming a color is one or two bisects.
+"""
+
+import os
+from colorsys import hsv_to_rgb, rgb_to_hsv
+from math import log
+from vocabulary import Vocabulary, store_vocabulary, vocabulary_path
+from workflow.util import atomic_writer
+
+COLORS_URL = 'https://raw.githubusercontent.com/jonathantneal/color-names/master/color-names.json'
+# ETag of the color names last downloaded
+ETAG_FILE = 'colors.etag'
+COLORS = 'colors'
+# hex value and grid cell to color name
+COLOR_NAMES = 'color_names'
+# datastore the colors were pickled to by earlier versions
+COLORS_STORE = 'colors'
+# bits of each RGB channel that select a grid cell
+CELL_BITS = 4
+
+def clamp(value, low=0, high=255):
+    return int(min(max(value, low), high))
+
+def hex_to_rgb(hex):
+    hex = hex.lstrip('#')
+    return tuple(int(hex[i:i+2], 16) for i in (0, 2, 4))
+
+def rgb_to_hex(r, g, b):
+    return '%02X%02X%02X' % (clamp(r), clamp(g), clamp(b))
+
+# From http://www.tannerhelland.com/4435/convert-temperature-rgb-algorithm-code/
+def temperature_to_rgb(kelvin):
+    """RGB of white light at a colour temperature in kelvin"""
+    temp = float(kelvin) / 100
+    if temp <= 66:
+        red = 255
+        green = 99.4708025861 * log(max(temp, 1)) - 161.1195681661
+        blue = 0 if temp <= 19 else 138.5177312231 * log(temp - 10) - 305.0447927307
+    else:
+        red = 329.698727446 * pow(temp - 60, -0.1332047592)
+        green = 288.1221695283 * pow(temp - 60, -0.0755148492)
+        blue = 255
+    return clamp(red), clamp(green), clamp(blue)
+
+def device_to_rgb(hue, saturation, level):
+    """RGB of a color given as a hub reports it - hue, saturation and level from 0 to 100"""
+    r, g, b = hsv_to_rgb(float(hue) / 100, float(saturation) / 100, float(level) / 100)
+    return clamp(r * 255), clamp(g * 255), clamp(b * 255)
+
+def rgb_to_device(r, g, b):
+    """Hue, saturation and level from 0 to 100 of an RGB color, as a hub takes them"""
+    hue, saturation, level = rgb_to_hsv(r / 255, g / 255, b / 255)
+    return {'hue': round(hue * 100), 'saturation': round(saturation * 100), 'level': round(level * 100)}
+
+def rgb_to_lab(r, g, b):
+    """CIE Lab (D65) coordinates of an sRGB color"""
+    def linear(c):
+        c = c / 255
+        return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+    def f(t):
+        return t ** (1 / 3) if t > 0.008856 else 7.787 * t + 16 / 116
+    r, g, b = linear(r), linear(g), linear(b)
+    x = f((0.4124 * r + 0.3576 * g + 0.1805 * b) / 0.95047)
+    y = f(0.2126 * r + 0.7152 * g + 0.0722 * b)
+    z = f((0.0193 * r + 0.1192 * g + 0.9505 * b) / 1.08883)
+    return 116 * y - 16, 500 * (x - y), 200 * (y - z)
+
+def cell_key(r, g, b):
+    shift = 8 - CELL_BITS
+    return '%X.%X.%X' % (clamp(r) >> shift, clamp(g) >> shift, clamp(b) >> shift)
+
+def build_tree(points, depth=0):
+    """k-d tree over (lab, name) points, as (point, left, right) nodes"""
+    if not points:
+        return None
+    axis = depth % 3
+    points.sort(key=lambda point: point[0][axis])
+    middle = len(points) // 2
+    return (points[middle], build_tree(points[:middle], depth + 1), build_tree(points[middle + 1:], depth + 1))
+
+def nearest(tree, lab):
+    """Name of the point in `tree` nearest to `lab`"""
+    best = [None, float('inf')]
+    def search(node, depth):
+        if node is None:
+            return
+        (point, name), left, right = node
+        distance = sum((a - b) ** 2 for a, b in zip(point, lab))
+        if distance < best[1]:
+            best[:] = [name, distance]
+        offset = lab[depth % 3] - point[depth % 3]
+        near, far = (left, right) if offset < 0 else (right, left)
+        search(near, depth + 1)
+        if offset * offset < best[1]:
+            search(far, depth + 1)
+    search(tree, 0)
+    return best[0]
+
+def store_colors(wf, colors):
+    """Store `colors`, a dict of name to '#hex', and the index naming any color from them"""
+    store_vocabulary(wf, COLORS, colors)
+    names = {}
+    for name in sorted(colors):
+        names.setdefault(colors[name].lstrip('#').upper(), name)
+    tree = build_tree([(rgb_to_lab(*hex_to_rgb(hex)), name) for hex, name in names.items()])
+    if tree:
+        half = 1 << (7 - CELL_BITS)
+        steps = range(half, 256, 2 * half)
+        for r in steps:
+            for g in steps:
+                for b in steps:
+                    names[cell_key(r, g, b)] = nearest(tree, rgb_to_lab(r, g, b))
+    store_vocabulary(wf, COLOR_NAMES, names)
+
+def update_colors(wf):
+    """Download and store the color names, unless they have not changed since
+    the last download. Returns whether they were stored."""
+    from workflow import web
+    headers = {}
+    etag_path = wf.datafile(ETAG_FILE)
+    if os.path.exists(vocabulary_path(wf, COLORS)) and os.path.exists(etag_path):
+        with open(etag_path, 'r', encoding='utf-8') as f:
+            headers['If-None-Match'] = f.read().strip()
+    r = web.get(COLORS_URL, headers=headers)
+    if 304 == r.status_code:
+        wf.logger.debug('color names unchanged')
+        return False
+    r.raise_for_status()
+    store_colors(wf, {v.lower().replace(' ',''): k for k, v in r.json().items()})
+    if r.headers.get('etag'):
+        with atomic_writer(etag_path, 'w') as f:
+            f.write(r.headers['etag'])
+    elif os.path.exists(etag_path):
+        os.unlink(etag_path)
+    return True
+
+def migrate_colors(wf):
+    """Move colors stored by earlier versions into the colors vocabulary, if there are any"""
+    colors = wf.stored_data(COLORS_STORE)
+    if colors is None:
+        return False
+    wf.logger.debug('moving '+str(len(colors))+' colors into the '+COLORS+' vocabulary')
+    store_colors(wf, colors)
+    wf.store_data(COLORS_STORE, None)
+    return True
+
+class ColorTable(Vocabulary):
+    """Read-only mapping of color name to '#hex'"""
+
+    def __init__(self, wf):
+        super().__init__(wf, COLORS)
+        self.names = ColorNames(wf, self)
+
+    def create(self):
+        return migrate_colors(self.wf)
+
+    def name_of(self, r, g, b):
+        """Name of the color nearest to an RGB color, or its hex value if there are no colors"""
+        hex = rgb_to_hex(r, g, b)
+        if hex in self.names:
+            return self.names[hex]
+        return self.names.get(cell_key(r, g, b), hex)
+
+class ColorNames(Vocabulary):
+    """Read-only mapping of hex value and grid cell to color name"""
+
+    def __init__(self, wf, colors):
+        super().__init__(wf, COLOR_NAMES)
+        self.colors = colors
+
+    def create(self):
+        # colors stored before the index was
+        if not len(self.colors):
+            return False
+        store_colors(self.wf, dict(self.colors.items()))
+        return True
+
+def device_color(attributes, colors):
+    """Name of the color a device reports, from its RGB, colorName, colorTemperature or hue attributes"""
+    try:
+        if attributes.get('RGB'):
+            return colors.name_of(*hex_to_rgb(attributes['RGB']))
+        if attributes.get('colorName'):
+            return attributes['colorName']
+        if attributes.get('colorTemperature'):
+            return colors.name_of(*temperature_to_rgb(attributes['colorTemperature']))
+        if all(attributes.get(name) not in (None, '') for name in ('hue', 'saturation', 'level')):
+            return colors.name_of(*device_to_rgb(attributes['hue'], attributes['saturation'], attributes['level']))
+    except ValueError:
+        pass
+    return None
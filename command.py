@@ -1,34 +1,30 @@
 # encoding: utf-8
 
 import sys
+
 import re
 import argparse
 from workflow.workflow import MATCH_ATOM, MATCH_STARTSWITH, MATCH_SUBSTRING, MATCH_ALL, MATCH_INITIALS, MATCH_CAPITALS, MATCH_INITIALS_STARTSWITH, MATCH_INITIALS_CONTAIN
-from workflow import Workflow, ICON_WEB, ICON_NOTE, ICON_BURN, ICON_SWITCH, ICON_HOME, ICON_COLOR, ICON_INFO, ICON_SYNC, web, PasswordNotFound
-from common import qnotify, error, hubitat_api, get_device, get_stored_data, discover_hub, get_device_capabilities, get_attributes, device_status
-from time import sleep
-from colorsys import rgb_to_hls, hls_to_rgb
+from workflow import Workflow, ICON_WEB, ICON_NOTE, ICON_BURN, ICON_SWITCH, ICON_HOME, ICON_COLOR, ICON_INFO, ICON_SYNC, PasswordNotFound
+import daemon
+from colors import ColorTable, update_colors, hex_to_rgb, rgb_to_device
+from vocabulary import store_modes
+from results import clear_results
+from common import qnotify, error, hubitat_api, hubitat_devices, get_device, load_devices, update_devices, read_devices, read_inventory, write_inventory, discover_hub, get_device_capabilities, get_attributes, device_status, confirm_attribute, confirm_deadline, get_mode, invalidate_mode, register_events, unregister_events, get_stored_data
+from states import EVENTS_PORT, write_state, drop_state, listener_since
+from credentials import get_credential, save_credential, clear_credentials
+from search import update_device_index
+from time import time
 
 log = None
 
 def get_devices(wf, api_key, hub_id, hub_ip):
     """Retrieve all devices
 
-    Returns a has of devices.
+    Returns an iterator of devices, decoded one at a time as they arrive from the hub.
 
     """
-    items = []
-    result = hubitat_api(wf, api_key, hub_id, hub_ip, 'devices/all')
-    if result and len(result) > 0:
-        items.extend(result)
-
-    return items
-
-def get_colors():
-    r = web.get('https://raw.githubusercontent.com/jonathantneal/color-names/master/color-names.json')
-    flip_colors = r.json()
-    colors = {v.lower().replace(' ',''): k for k, v in flip_colors.items()}
-    return colors
+    return hubitat_devices(wf, api_key, hub_id, hub_ip)
 
 def get_color(name, colors):
     name = name.lower().replace(' ','')
@@ -39,12 +35,7 @@ def get_color(name, colors):
     return ''
 
 def get_color_hls(name, colors):
-    hex = get_color(name, colors)
-    r = int(hex[0:1], 16)
-    g = int(hex[2:3], 16)
-    b = int(hex[4:5], 16)
-    (hue, level, saturation) = rgb_to_hls(r, g, b)
-    return {"hue": hue, "saturation": saturation, "level": level}
+    return rgb_to_device(*hex_to_rgb(get_color(name, colors)))
 
 def get_device_commands(device, commands):
     result = []
@@ -55,66 +46,87 @@ def get_device_commands(device, commands):
                 result.append(command) 
     return result
 
-def preprocess_device_command(wf, api_key, hub_id, hub_ip, args):
-    if 'toggle' == args.device_command:
-        status = device_status(wf, api_key, hub_id, hub_ip, args.device_uid)
+# most devices a group command is sent to at the same time
+COMMAND_WORKERS = 8
+
+class UnsupportedCommand(Exception):
+    pass
+
+def preprocess_device_command(wf, api_key, hub_id, hub_ip, device_uid, device_command):
+    # a stored state is only current enough to toggle from while events keep it so
+    max_age = None if listener_since(wf) else 0
+    if 'toggle' == device_command:
+        status = device_status(wf, api_key, hub_id, hub_ip, device_uid, max_age)
         if status and 'switch' in status:
             state = status['switch']
             log.debug("Toggle Switch state is "+state)
             if 'on' == state:
-                args.device_command = 'off'
+                device_command = 'off'
             else:
-                args.device_command = 'on'
-    if 'togglock' == args.device_command:
-        status = device_status(wf, api_key, hub_id, hub_ip, args.device_uid)
+                device_command = 'on'
+    if 'togglock' == device_command:
+        status = device_status(wf, api_key, hub_id, hub_ip, device_uid, max_age)
         if status and 'lock' in status:
             state = status['lock']
             log.debug("Toggle Lock state is "+state)
             if 'locked' == state:
-                args.device_command = 'unlock'
+                device_command = 'unlock'
             else:
-                args.device_command = 'lock'
-    return args.device_command
-
-def handle_device_commands(wf, api_key, hub_id, hub_ip, args, commands):
-    if not args.device_uid or args.device_command not in commands.keys():
-        return 
-    args.device_command = preprocess_device_command(wf, api_key, hub_id, hub_ip, args)
-    command = commands[args.device_command]
+                device_command = 'lock'
+    return device_command
+
+def command_arguments(command):
+    """Evaluate the lambdas in a command's arguments, leaving the command table as it is"""
+    arguments = []
+    for arg in command['arguments'] if 'arguments' in command and command['arguments'] else []:
+        if callable(arg):
+            arg = arg()
+        elif isinstance(arg, dict):
+            arg = {key: value() if callable(value) else value for key, value in arg.items()}
+        arguments.append(arg)
+    return arguments
+
+def run_device_command(wf, api_key, hub_id, hub_ip, device_uid, device_command, commands):
+    """Send a command to one device and check that it took
+
+    Returns the device name, the command actually sent, whether it succeeded and the last attributes seen.
+    Raises UnsupportedCommand if the device does not support the command.
+    """
+    device_command = preprocess_device_command(wf, api_key, hub_id, hub_ip, device_uid, device_command)
+    command = commands[device_command]
 
-    device = get_device(wf, args.device_uid)
+    device = get_device(wf, device_uid)
     device_name = device['label']
     capabilities = get_device_capabilities(device)
     if command['capability'] not in capabilities:
-        error('Unsupported command for device')
-        
-    # eval all lambdas in arguments
-    if 'arguments' in command and command['arguments']:
-        for i, arg in enumerate(command['arguments']):
-            if callable(arg):
-                command['arguments'][i] = arg()
-            elif isinstance(arg, dict):
-                for key, value in arg.items():
-                    if callable(value):
-                        arg[key] = value()                
-
-    data = command['arguments'] if 'arguments' in command else None
-    log.debug("Executing Switch Command: "+device_name+" "+args.device_command)
-    url = 'devices/'+args.device_uid+'/'+command['command']
-    result = hubitat_api(wf, api_key, hub_id, hub_ip, url, data)
-    success = False
-    i = 0
-    while(i < 2):
-        if result:
-            attributes = result
-            if command['attribute'] in attributes:
-                success = str(attributes[command['attribute']]) == str(command['arguments'][0] if 'arguments' in command and command['arguments'] else command['command'])
-        if not success:
-            sleep(1)
-            i = i + 1
-            result = device_status(wf, api_key, hub_id, hub_ip,args.device_uid)
+        raise UnsupportedCommand('Unsupported command for device')
+
+    arguments = command_arguments(command)
+    log.debug("Executing Switch Command: "+device_name+" "+device_command)
+    url = 'devices/'+device_uid+'/'+command['command']
+    expected = str(arguments[0] if arguments else command['command'])
+    success, result = False, None
+    try:
+        result = hubitat_api(wf, api_key, hub_id, hub_ip, url, arguments)
+        success, result = confirm_attribute(wf, api_key, hub_id, hub_ip, device_uid, command['attribute'], expected,
+            confirm_deadline(wf, command['capability']), result)
+    finally:
+        # status and toggles read the state store, which must not keep the state from before the command
+        if success:
+            write_state(wf, device_uid, result)
         else:
-            break
+            drop_state(wf, device_uid)
+    return device_name, device_command, success, result
+
+def handle_device_commands(wf, api_key, hub_id, hub_ip, args, commands):
+    if not args.device_uid or args.device_command not in commands.keys():
+        return 
+    try:
+        device_name, args.device_command, success, result = run_device_command(wf, api_key, hub_id, hub_ip, args.device_uid, args.device_command, commands)
+    except UnsupportedCommand as e:
+        error(str(e))
+    # device listings must not show the state from before the command
+    wf.cache_data('status_snapshot', None)
             
     if success:
         qnotify("Hubitat", device_name+" turned "+args.device_command+' '+(args.device_params[0] if args.device_params else ''))
@@ -124,10 +136,62 @@ def handle_device_commands(wf, api_key, hub_id, hub_ip, args, commands):
     wf.logger.debug("Switch Command "+device_name+" "+args.device_command+" "+(args.device_params[0]+' ' if args.device_params else '')+("succeeded" if success else "failed"))
     return result
 
+def handle_group_commands(wf, api_key, hub_id, hub_ip, args, commands):
+    """Send one command to several devices at once, checking each of them in parallel"""
+    device_uids = [uid for uid in args.device_uids.split(',') if uid] if args.device_uids else []
+    if not device_uids or args.device_command not in commands.keys():
+        return
+    from concurrent.futures import ThreadPoolExecutor
+    # decide between local and cloud once, rather than in every worker
+    get_mode(wf, hub_ip)
+    start = time()
+    workers = wf.settings.get('command_workers', COMMAND_WORKERS)
+    with ThreadPoolExecutor(max_workers=min(workers, len(device_uids))) as executor:
+        futures = [executor.submit(run_device_command, wf, api_key, hub_id, hub_ip, uid, args.device_command, commands) for uid in device_uids]
+    results = []
+    for uid, future in zip(device_uids, futures):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            wf.logger.debug("Switch Command on device "+uid+" raised "+str(e))
+            device = get_device(wf, uid)
+            results.append((device['label'] if device else uid, args.device_command, False, None))
+    wf.cache_data('status_snapshot', None)
+
+    failed = [name for name, command, success, result in results if not success]
+    params = ' '+args.device_params[0] if args.device_params else ''
+    wf.logger.debug("Group Command "+args.device_command+params+" on "+str(len(results))+" devices in "+("%0.3f" % (time() - start))+"s, failed: "+str(failed))
+    if not failed:
+        qnotify("Hubitat", str(len(results))+" devices turned "+args.device_command+params)
+    else:
+        qnotify("Hubitat", str(len(results) - len(failed))+" of "+str(len(results))+" devices turned "+args.device_command+params+", failed: "+', '.join(failed))
+    return results
+
+def refresh_devices(wf, api_key, hub_id, hub_ip):
+    """Fetch the devices and store what changed since they were last fetched
+
+    Returns the ids of the devices added, removed and changed.
+    """
+    devices, details, digest = read_devices(get_devices(wf, api_key, hub_id, hub_ip))
+    added, removed, changed = [], [], []
+    if digest != read_inventory(wf).get('hash') or not load_devices(wf):
+        added, removed, changed = update_devices(wf, devices, details)
+        update_device_index(wf, devices, set(changed))
+        store_modes(wf, get_stored_data(wf, 'device_details') or {})
+        clear_results(wf)
+    write_inventory(wf, updated=time(), hash=digest)
+    return added, removed, changed
+
+def update_report(added, removed, changed, colors):
+    counts = [str(len(ids))+' '+what for ids, what in [(added, 'added'), (removed, 'removed'), (changed, 'changed')] if ids]
+    report = 'Devices and Scenes '+('updated: '+', '.join(counts) if counts else 'unchanged')
+    if colors:
+        report += ', color names updated'
+    return report
+
 def main(wf):
-    # retrieve cached devices and scenes
-    devices = get_stored_data(wf ,'devices')
-    colors = get_stored_data(wf, 'colors')
+    # colors and devices are only read from disk as commands need them
+    colors = ColorTable(wf)
 
     # build argument parser to parse script args and collect their
     # values
@@ -140,14 +204,20 @@ def main(wf):
     parser.add_argument('--hubip', dest='hubip', nargs='?', default=None)
     parser.add_argument('--mode', dest='mode', nargs='?', default=None)
     parser.add_argument('--showstatus', dest='showstatus', nargs='?', default=None)
+    parser.add_argument('--daemon', dest='daemon', nargs='?', default=None)
+    parser.add_argument('--events', dest='events', nargs='?', default=None)
     # add an optional (nargs='?') --update argument and save its
     # value to 'apikey' (dest). This will be called from a separate "Run Script"
     # action with the API key
     parser.add_argument('--update', dest='update', action='store_true', default=False)
+    # update devices without notifying, when run in the background
+    parser.add_argument('--refresh', dest='refresh', action='store_true', default=False)
     # reinitialize 
     parser.add_argument('--reinit', dest='reinit', action='store_true', default=False)
     # device name, uid, command and any command params
     parser.add_argument('--device-uid', dest='device_uid', default=None)
+    # several devices to send the same command to, comma separated
+    parser.add_argument('--device-uids', dest='device_uids', default=None)
     parser.add_argument('--device-command', dest='device_command', default='')
     parser.add_argument('--device-params', dest='device_params', nargs='*', default=[])
     # scene name, uid, command and any command params
@@ -275,20 +345,30 @@ def main(wf):
 
     # Reinitialize if necessary
     if args.reinit:
+        daemon.stop(wf)
         wf.reset()
-        wf.delete_password('hubitat_api_key')
-        wf.delete_password('hubitat_hub_id')
-        wf.delete_password('hubitat_hub_ip')
+        clear_credentials(wf)
         qnotify('Hubitat', 'Workflow reinitialized')
         return 0
 
     if args.showstatus:
         if args.showstatus in ['on', 'off']:
-            wf.settings['showstatus'] = args.showstatus
-            wf.settings.save()
+            with wf.settings.transaction() as settings:
+                settings['showstatus'] = args.showstatus
             qnotify('Hubitat', 'Show Status '+args.showstatus)
         return 0
 
+    if args.daemon:
+        if args.daemon in ['on', 'off']:
+            with wf.settings.transaction() as settings:
+                settings['daemon'] = args.daemon
+            if 'on' == args.daemon:
+                daemon.start(wf)
+            else:
+                daemon.stop(wf)
+            qnotify('Hubitat', 'Background Helper '+args.daemon)
+        return 0
+
     ####################################################################
     # Save the provided API key
     ####################################################################
@@ -297,7 +377,7 @@ def main(wf):
     if args.mode:  # Script was passed a mode
         log.debug("saving mode "+args.mode)
         # save the mode
-        wf.save_password('hubitat_mode', args.mode)
+        save_credential(wf, 'hubitat_mode', args.mode)
         qnotify('Hubitat', 'Mode '+args.mode+' Saved')
         return 0  # 0 means script exited cleanly
 
@@ -305,7 +385,9 @@ def main(wf):
     if args.apikey:  # Script was passed an API key
         log.debug("saving api key "+args.apikey)
         # save the key
-        wf.save_password('hubitat_api_key', args.apikey)
+        save_credential(wf, 'hubitat_api_key', args.apikey)
+        # results saved by earlier versions may hold what was typed after 'apikey'
+        clear_results(wf)
         qnotify('Hubitat', 'API Key Saved')
         return 0  # 0 means script exited cleanly
 
@@ -313,7 +395,8 @@ def main(wf):
     if args.hubid:  # Script was passed an Hub ID
         log.debug("saving hub id "+args.hubid)
         # save the key
-        wf.save_password('hubitat_hub_id', args.hubid)
+        save_credential(wf, 'hubitat_hub_id', args.hubid)
+        clear_results(wf)
         qnotify('Hubitat', 'Hub ID Saved')
         return 0  # 0 means script exited cleanly
 
@@ -321,7 +404,9 @@ def main(wf):
     if args.hubip:  # Script was passed an Hub IP
         log.debug("saving hub IP "+args.hubip)
         # save the key
-        wf.save_password('hubitat_hub_ip', args.hubip)
+        save_credential(wf, 'hubitat_hub_ip', args.hubip)
+        clear_results(wf)
+        invalidate_mode(wf)
         qnotify('Hubitat', 'Hub IP Saved')
         return 0  # 0 means script exited cleanly
 
@@ -330,13 +415,13 @@ def main(wf):
     ####################################################################
 
     try:
-        api_key = wf.get_password('hubitat_api_key')
+        api_key = get_credential(wf, 'hubitat_api_key')
     except PasswordNotFound:  # API key has not yet been set
         error('API Key not found')
         return 0
 
     try:
-        mode = wf.get_password('hubitat_mode')
+        mode = get_credential(wf, 'hubitat_mode')
     except PasswordNotFound:  # Mode has not yet been set
         mode = 'auto'
     
@@ -345,31 +430,77 @@ def main(wf):
         
     if 'cloud' == mode:
         try:
-            hub_id = wf.get_password('hubitat_hub_id')
+            hub_id = get_credential(wf, 'hubitat_hub_id')
         except PasswordNotFound:  # Hub ID has not yet been set
             error('Hub ID not found')
             return 0
     elif 'local' == mode:
         try:
-            hub_ip = wf.get_password('hubitat_hub_ip')
+            hub_ip = get_credential(wf, 'hubitat_hub_ip')
         except PasswordNotFound:  # Hub IP has not yet been set
             hub_ip = discover_hub()
             if not hub_ip:
                 error('Hub IP not found')
                 return 0
+    else:
+        # auto - through the hub when it can be reached, the cloud otherwise
+        try:
+            hub_ip = get_credential(wf, 'hubitat_hub_ip')
+        except PasswordNotFound:
+            pass
+        try:
+            hub_id = get_credential(wf, 'hubitat_hub_id')
+        except PasswordNotFound:
+            pass
+        if not hub_ip and not hub_id:
+            error('Hub IP not found')
+            return 0
         
+    # turn event push from the hub on or off
+    if args.events:
+        if args.events in ['on', 'off']:
+            if 'on' == args.events:
+                if not hub_ip:
+                    try:
+                        hub_ip = get_credential(wf, 'hubitat_hub_ip')
+                    except PasswordNotFound:
+                        error('Hub IP not found')
+                        return 0
+                register_events(wf, api_key, hub_id, hub_ip, wf.settings.get('events_port', EVENTS_PORT))
+            elif hub_ip or hub_id:
+                try:
+                    unregister_events(wf, api_key, hub_id, hub_ip)
+                except OSError as e:
+                    # turn events off here regardless - the hub's posts go unanswered
+                    log.debug("could not clear the event url: "+str(e))
+            with wf.settings.transaction() as settings:
+                if 'on' == args.events:
+                    # events are received by the background helper
+                    settings['daemon'] = 'on'
+                settings['events'] = args.events
+            # restart the helper so it picks up the change - unless it is turned off
+            daemon.stop(wf)
+            if 'on' == wf.settings.get('daemon'):
+                daemon.start(wf)
+            qnotify('Hubitat', 'Event Push '+args.events)
+        return 0
+
     # Update devices if that is passed in
     if args.update:  
         # update devices and scenes
-        devices = get_devices(wf, api_key, hub_id, hub_ip)
-        colors = get_colors()
-        wf.store_data('devices', devices)
-        wf.store_data('colors', colors)
-        qnotify('Hubitat', 'Devices and Scenes updated')
+        added, removed, changed = refresh_devices(wf, api_key, hub_id, hub_ip)
+        colors = update_colors(wf)
+        qnotify('Hubitat', update_report(added, removed, changed, colors))
         return 0  # 0 means script exited cleanly
 
+    # refresh devices quietly, as started by filter.py when they get old
+    if args.refresh:
+        refresh_devices(wf, api_key, hub_id, hub_ip)
+        return 0
+
    # handle any device or scene commands there may be
     handle_device_commands(wf, api_key, hub_id, hub_ip, args, commands)
+    handle_group_commands(wf, api_key, hub_id, hub_ip, args, commands)
 
 
 if __name__ == u"__main__":
@@ -1,17 +1,147 @@
-from workflow import web
+import codecs
+import hashlib
 import json
-import subprocess
-from urllib.parse import quote_plus
-from math import log, pow
-from colorsys import rgb_to_hls, hls_to_rgb
-import subprocess
+import os
+import socket
+import threading
+import time
+from urllib.parse import quote, quote_plus
+from states import read_state, write_state, listener_since, state_path, local_ip_for
+from workflow.util import atomic_writer
+import records
+
+# how long a local/cloud reachability decision is reused, in seconds
+REACHABILITY_TTL = 300
+# how long to wait for the hub to accept a TCP connection, in seconds
+REACHABILITY_TIMEOUT = 0.5
+# how long a status snapshot of all devices is reused for device listings, in seconds
+SNAPSHOT_MAX_AGE = 5
+# how long to wait for a device to report the result of a command, in seconds - by capability, with a default
+CONFIRM_DEADLINES = {'Lock': 10, 'WindowShade': 30, 'WindowShadeLevel': 30}
+CONFIRM_DEADLINE = 2
+# first wait before checking a command took, doubled after every check up to the maximum, in seconds
+CONFIRM_FIRST_DELAY = 0.05
+CONFIRM_MAX_DELAY = 1
+
+# wait before a status call is also sent through the other endpoint in auto mode, until response times are known, in seconds
+HEDGE_DELAY = 0.25
+# bounds of that wait once it follows the response times, in seconds
+HEDGE_MIN_DELAY = 0.05
+HEDGE_MAX_DELAY = 1
+
+# bytes read from the hub at a time when a response is decoded as it arrives
+STREAM_CHUNK_SIZE = 65536
+
+# serializes this process's writes of the mode and latency caches - the temporary file the cache is written through
+# is named after the process, so two threads writing at once would trip over each other
+cache_lock = threading.RLock()
+
+def save_cache(wf, name, data):
+    # the mode and latency caches only save work later, so a failed write must never fail the call that made it
+    with cache_lock:
+        try:
+            wf.cache_data(name, data)
+        except OSError as e:
+            wf.logger.debug("could not save "+name+": "+str(e))
+
+# keep-alive connections to the local hub and the cloud relay, shared by all calls in this process
+hub_pool = None
+
+def get_hub_pool():
+    # created on first use, so that runs which never call the hub don't load the HTTP stack
+    global hub_pool
+    if hub_pool is None:
+        from workflow import web
+        hub_pool = web.ConnectionPool()
+    return hub_pool
+
+# keep-alive connections for coroutines, by the event loop they belong to
+async_hub_pools = None
+# event loop of each thread that runs coroutines for plain function calls, kept so its connections are reused
+hub_loops = threading.local()
+
+def get_async_hub_pool():
+    # connections can't outlive their event loop, so each loop gets a pool of its own
+    global async_hub_pools
+    import asyncio
+    import weakref
+    from workflow import web
+    if async_hub_pools is None:
+        async_hub_pools = weakref.WeakKeyDictionary()
+    loop = asyncio.get_running_loop()
+    if loop not in async_hub_pools:
+        pool = web.AsyncConnectionPool()
+        # the loop only keeps a weak reference to its tasks
+        async_hub_pools[loop] = (pool, loop.create_task(close_with_loop(pool)))
+    return async_hub_pools[loop][0]
+
+async def close_with_loop(pool):
+    # runs until the loop's tasks are cancelled as it finishes, as asyncio.run does, and closes the pool's
+    # connections while the loop can still run their clean-up
+    import asyncio
+    try:
+        await asyncio.get_running_loop().create_future()
+    finally:
+        pool.clear()
+
+def run_async(coroutine):
+    """Run a coroutine to the end from a plain function, on this thread's event loop"""
+    import asyncio
+    import atexit
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        # called from a coroutine, whose loop can't run another until it returns - run it on a thread of its own
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coroutine).result()
+    loop = getattr(hub_loops, 'loop', None)
+    if loop is None:
+        loop = hub_loops.loop = asyncio.new_event_loop()
+        atexit.register(close_loop, loop)
+    return loop.run_until_complete(coroutine)
+
+def close_loop(loop):
+    # finish the loop's tasks the way asyncio.run does, so the connections kept open for later calls are closed
+    import asyncio
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        loop.run_until_complete(asyncio.wait(tasks))
+    loop.run_until_complete(asyncio.sleep(0))
+    loop.close()
+
+def probe_hub(ip, timeout=REACHABILITY_TIMEOUT):
+    host, _, port = ip.partition(':')
+    try:
+        with socket.create_connection((host, int(port) if port else 80), timeout=timeout):
+            return True
+    except (OSError, ValueError):
+        return False
 
 def get_mode(wf, ip):
     if not ip: return 'cloud'
     ip = ip.strip()
-    output = (subprocess.check_output("ping -o -c 3 -W 3000 "+ip, shell=True)).decode('utf-8')
-    wf.logger.debug(output)
-    return 'local' if (output and "bytes from "+ip in output) else 'cloud'
+    ttl = wf.settings.get('reachability_ttl', REACHABILITY_TTL)
+    # a max_age of 0 means forever to cached_data, but a ttl of 0 means probe every time
+    reachability = wf.cached_data('reachability', max_age=ttl) if ttl > 0 else None
+    if reachability and ip == reachability['ip']:
+        return reachability['mode']
+    start = time.time()
+    mode = 'local' if probe_hub(ip) else 'cloud'
+    wf.logger.debug("probed hub at "+ip+" in "+("%0.3f" % (time.time() - start))+"s, using "+mode)
+    set_mode(wf, ip, mode)
+    return mode
+
+def set_mode(wf, ip, mode):
+    if ip:
+        save_cache(wf, 'reachability', {'ip': ip.strip(), 'mode': mode, 'time': time.time()})
+
+def invalidate_mode(wf):
+    save_cache(wf, 'reachability', None)
 
 '''
 import socket
@@ -51,6 +181,7 @@ def mdns_query(name):
 '''
 
 def mdns_query_shell(name):
+    import subprocess
     return subprocess.check_output(['dig','-p','5353', '+answer', '@224.0.0.251', name+'.local', '+short']).decode('utf-8')
  
 def discover_hub():
@@ -64,104 +195,486 @@ def error(text):
     exit(0)
 
 def get_device(wf, device_uid):
-    devices = wf.stored_data('devices')
+    devices = load_devices(wf)
     return next((x for x in devices if device_uid == x['id']), None)
 
-def hubitat_api(wf, api_key, hub_id, hub_ip, url, data=None):
+def hubitat_urls(wf, hub_id, hub_ip, url, data=None):
+    """Full URLs of a Maker API call by access mode, through the hub and the cloud relay - the one to try first first
+
+    Only in auto mode, with both the hub IP and the hub ID known, are there two.
+    """
     mode = get_mode(wf, hub_ip)
     wf.logger.debug("using mode "+mode)
-    base_url = 'https://cloud.hubitat.com/api/'+hub_id+'/apps/5/' if ('cloud' == mode and hub_id) else 'http://'+hub_ip+'/apps/api/5/'
-    url = base_url+url
+    local = 'http://'+hub_ip+'/apps/api/5/' if hub_ip else None
+    cloud = 'https://cloud.hubitat.com/api/'+hub_id+'/apps/5/' if hub_id else None
+    bases = [('cloud', cloud), ('local', local)] if 'cloud' == mode else [('local', local), ('cloud', cloud)]
+    args = ','.join(map(lambda x: quote_plus(json.dumps(x) if isinstance(x, dict) else str(x)), data)) if data else ''
+    urls = [(mode, base+url+('/' if args else '')+args) for mode, base in bases if base]
+    if not urls:
+        raise ValueError('Neither the hub IP nor the hub ID is set')
+    return urls
+
+def hedge_delay(wf, mode):
+    """How long to wait for an answer through `mode` before asking the other endpoint too - a little longer than it
+    usually takes, going by the response times seen so far"""
+    latency = (wf.cached_data('hub_latency', max_age=0) or {}).get(mode)
+    if latency is None:
+        return wf.settings.get('hedge_delay', HEDGE_DELAY)
+    mean, deviation = latency
+    return min(max(mean + 4 * deviation, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+def record_latency(wf, mode, seconds):
+    # smoothed mean and deviation, estimated the way TCP estimates round-trip times (RFC 6298)
+    with cache_lock:
+        latencies = wf.cached_data('hub_latency', max_age=0) or {}
+        if mode in latencies:
+            mean, deviation = latencies[mode]
+            latencies[mode] = (0.875 * mean + 0.125 * seconds, 0.75 * deviation + 0.25 * abs(mean - seconds))
+        else:
+            latencies[mode] = (seconds, seconds / 2)
+        save_cache(wf, 'hub_latency', latencies)
+
+def hedging(wf, urls, idempotent):
+    return idempotent and len(urls) > 1 and wf.settings.get('hedge', True)
+
+async def hedged_get(wf, hub_ip, urls, params, headers):
+    """GET the first of `urls`, and the next as well if no answer has come back after the hedge delay
+
+    The first good response wins and the other request is cancelled. A request that fails sends the next at once.
+    A 4xx answer wins too, since the other endpoint would give the same one - the caller raises it.
+    """
+    import asyncio
+    import http.client
+    from workflow import web
+    pool = get_async_hub_pool()
+    delay = hedge_delay(wf, urls[0][0])
+    waiting = list(urls)
+    tasks = {}
+
+    async def get(mode, url):
+        start = time.time()
+        r = await web.get_async(url, params, headers, pool=pool, idempotent=True)
+        if r.status_code >= 500:
+            # the relay answers for a hub it can't reach
+            r.raise_for_status()
+        return mode, time.time() - start, r
+
+    def send():
+        mode, url = waiting.pop(0)
+        tasks[asyncio.ensure_future(get(mode, url))] = mode
+
+    send()
+    error = None
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(tasks, timeout=delay if waiting else None, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                wf.logger.debug("hedging: no answer through "+urls[0][0]+" after "+("%0.3f" % delay)+"s, asking "+waiting[0][0]+" too")
+                send()
+                continue
+            for task in done:
+                del tasks[task]
+                try:
+                    mode, seconds, r = task.result()
+                except (OSError, http.client.HTTPException) as e:
+                    wf.logger.debug("hedging: "+str(e))
+                    error = e
+                    if waiting:
+                        send()
+                    continue
+                record_latency(wf, mode, seconds)
+                if mode != urls[0][0]:
+                    # the other endpoint answered first - try it first from now on
+                    set_mode(wf, hub_ip, mode)
+                wf.logger.debug("hedging: answered through "+mode+" in "+("%0.3f" % seconds)+"s")
+                return r
+    finally:
+        for task in tasks:
+            task.cancel()
+        # let the cancelled requests close their connections
+        await asyncio.gather(*tasks, return_exceptions=True)
+    # neither endpoint answered - probe again on the next call
+    invalidate_mode(wf)
+    raise error
+
+def hubitat_request(wf, api_key, hub_id, hub_ip, url, data=None, stream=False, idempotent=False):
+    """Send a Maker API call to the hub and return the response, with its body still unread if `stream` is set
+
+    In auto mode, a call that can't connect is sent through the other endpoint instead, and `idempotent` calls that
+    are slow to answer are sent through both (see hedged_get). They are also sent again if a kept-alive connection
+    drops under them. Anything else is only ever sent once.
+    """
+    from workflow import web
+    urls = hubitat_urls(wf, hub_id, hub_ip, url, data)
     headers = {'Accept':"application/json"}
     params = {'access_token': api_key}
-    r = None
-    args = ','.join(map(lambda x: quote_plus(json.dumps(x) if isinstance(x, dict) else str(x)), data)) if data else ''
-    url = url+('/' if args else '')+args
-    r = web.get(url, params, headers)
+    if not stream and hedging(wf, urls, idempotent):
+        r = run_async(hedged_get(wf, hub_ip, urls, params, headers))
+    else:
+        pool = get_hub_pool()
+        r = None
+        for i, (mode, url) in enumerate(urls):
+            start = time.time()
+            try:
+                r = web.get(url, params, headers, stream=stream, pool=pool, idempotent=idempotent)
+            except web.ConnectError as e:
+                # the call never reached the hub, so it is safe to send it the other way
+                invalidate_mode(wf)
+                if i + 1 == len(urls):
+                    raise
+                wf.logger.debug("could not connect through "+mode+", failing over: "+str(e))
+                set_mode(wf, hub_ip, urls[i + 1][0])
+                continue
+            except OSError:
+                # the chosen endpoint is unreachable - probe again on the next call
+                invalidate_mode(wf)
+                raise
+            if len(urls) > 1:
+                record_latency(wf, mode, time.time() - start)
+            break
 
-    wf.logger.debug("hubitat_api: url:"+url+", headers: "+str(headers)+", params: "+str(params))
+        wf.logger.debug("hubitat_api: url:"+url+", headers: "+str(headers)+", params: "+str(params))
+        wf.logger.debug("hubitat_api: connections "+str(pool.stats))
     # throw an error if request failed
     # Workflow will catch this and show it to the user
     r.raise_for_status()
+    return r
+
+def hubitat_api(wf, api_key, hub_id, hub_ip, url, data=None, idempotent=False):
+    r = hubitat_request(wf, api_key, hub_id, hub_ip, url, data, idempotent=idempotent)
 
     # Parse the JSON returned by pinboard and extract the posts
     result = r.json()
-    wf.logger.debug(str(result))
-    return result    
+    # a device list can run to megabytes - only log how long it is
+    wf.logger.debug("hubitat_api: "+(str(len(result))+" items" if isinstance(result, list) else str(result)))
+    return result
+
+async def hubitat_api_async(wf, api_key, hub_id, hub_ip, url, data=None, idempotent=False):
+    """hubitat_api as a coroutine, so that several calls can be waiting on the hub at once - say with asyncio.gather"""
+    from workflow import web
+    urls = hubitat_urls(wf, hub_id, hub_ip, url, data)
+    headers = {'Accept':"application/json"}
+    params = {'access_token': api_key}
+    if hedging(wf, urls, idempotent):
+        r = await hedged_get(wf, hub_ip, urls, params, headers)
+    else:
+        pool = get_async_hub_pool()
+        for i, (mode, url) in enumerate(urls):
+            start = time.time()
+            try:
+                r = await web.get_async(url, params, headers, pool=pool, idempotent=idempotent)
+            except web.ConnectError as e:
+                # the call never reached the hub, so it is safe to send it the other way
+                invalidate_mode(wf)
+                if i + 1 == len(urls):
+                    raise
+                wf.logger.debug("could not connect through "+mode+", failing over: "+str(e))
+                set_mode(wf, hub_ip, urls[i + 1][0])
+                continue
+            except OSError:
+                # the chosen endpoint is unreachable - probe again on the next call
+                invalidate_mode(wf)
+                raise
+            if len(urls) > 1:
+                record_latency(wf, mode, time.time() - start)
+            break
+
+        wf.logger.debug("hubitat_api_async: url:"+url+", headers: "+str(headers)+", params: "+str(params))
+        wf.logger.debug("hubitat_api_async: connections "+str(pool.stats))
+    r.raise_for_status()
+    result = r.json()
+    wf.logger.debug("hubitat_api_async: "+(str(len(result))+" items" if isinstance(result, list) else str(result)))
+    return result
+
+def iter_json_array(chunks):
+    """Decode a JSON array from an iterable of bytes, yielding each element as soon as all of it has arrived
+
+    Only the chunk and the element being read are held as text, never the whole array. Raises ValueError if
+    the data is not a single JSON array.
+    """
+    # json.loads shares the strings of repeated keys across a document - elements decoded one by one only do
+    # so if they are given the same keys, and without it a device list takes half as much memory again
+    keys = {}
+    decoder = json.JSONDecoder(object_pairs_hook=lambda pairs: {keys.setdefault(key, key): value for key, value in pairs})
+    text = codecs.getincrementaldecoder('utf-8')()
+    # what may come next: the opening '[', the first element or ']', an element, ',' or ']', or nothing but whitespace
+    buffer, pos, expect = '', 0, 'start'
+    for chunk in chunks:
+        buffer = buffer[pos:]+text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if 'end' == expect:
+                raise ValueError('data after the end of the JSON array')
+            if 'start' == expect:
+                if '[' != buffer[pos]:
+                    raise ValueError('expected a JSON array')
+                expect = 'first'
+                pos += 1
+            elif 'separator' == expect:
+                if buffer[pos] not in ',]':
+                    raise ValueError("expected ',' or ']' after an array element")
+                expect = 'element' if ',' == buffer[pos] else 'end'
+                pos += 1
+            elif ']' == buffer[pos] and 'first' == expect:
+                expect = 'end'
+                pos += 1
+            elif buffer[pos] in ',]':
+                raise ValueError('expected an array element')
+            else:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    # the rest of the element is still to come
+                    break
+                after = end
+                while after < len(buffer) and buffer[after] in ' \t\r\n':
+                    after += 1
+                if after == len(buffer) or buffer[after] not in ',]':
+                    # a number or literal might carry on in the next chunk
+                    break
+                pos = end
+                expect = 'separator'
+                yield value
+    if 'end' != expect or (buffer[pos:]+text.decode(b'', final=True)).strip():
+        raise ValueError('incomplete JSON array')
+
+def hubitat_devices(wf, api_key, hub_id, hub_ip, project=None):
+    """Every device from devices/all, decoded one at a time as the response arrives
+
+    `project` is applied to each device as it is read, so only what it returns is kept.
+    """
+    r = hubitat_request(wf, api_key, hub_id, hub_ip, 'devices/all', stream=True, idempotent=True)
+    count = 0
+    for device in iter_json_array(r.iter_content(STREAM_CHUNK_SIZE)):
+        if isinstance(device, dict) and 'id' in device:
+            count += 1
+            yield project(device) if project else device
+    wf.logger.debug("hubitat_devices: "+str(count)+" devices")
 
 def get_device_capabilities(device):
-    return device['capabilities'] if 'capabilities' in device else []
+    return device.get('capabilities') or []
+
+# datastores already loaded by this process, keyed by name - a long-lived process only reloads them when they change on disk
+stored_data_memo = {}
+
+def datastore_version(wf, name):
+    metadata_path = wf.datafile('.'+name+'.alfred-workflow')
+    try:
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            serializer_name = f.read().strip()
+        stat = os.stat(wf.datafile(name+'.'+serializer_name))
+    except OSError:
+        return None
+    return (serializer_name, stat.st_mtime_ns, stat.st_size)
 
 def get_stored_data(wf, name):
+    version = datastore_version(wf, name)
+    if version and name in stored_data_memo and version == stored_data_memo[name][0]:
+        return stored_data_memo[name][1]
     data = {}
     try:
         data = wf.stored_data(name)
     except ValueError:
         pass
+    if version:
+        stored_data_memo[name] = (version, data)
     return data
 
-# From http://www.tannerhelland.com/4435/convert-temperature-rgb-algorithm-code/
-def colorTemperatureToRGB(kelvin):
-    temp = kelvin / 100
-
-    if( temp <= 66 ):
-        red = 255
-        
-        green = temp
-        green = 99.4708025861 * log(green) - 161.1195681661
-        
-        if( temp <= 19):
-            blue = 0
-        else:
-            blue = temp-10
-            blue = 138.5177312231 * log(blue) - 305.0447927307
-    else:
-        red = temp - 60
-        red = 329.698727446 * pow(red, -0.1332047592)
-        
-        green = temp - 60
-        green = 288.1221695283 * pow(green, -0.0755148492 )
-
-        blue = 255
-
-    return "%x%x%x" % (
-        clamp(red,   0, 255),
-        clamp(green, 0, 255),
-        clamp(blue,  0, 255))
-    
-def clamp( x, min, max ):
-    if(x<min):
-        return min
-    if(x>max):
-        return max
-
-    return int(x)
+# how old the devices may get before filter.py refreshes them in the background, in seconds - 0 turns refreshing off
+INVENTORY_MAX_AGE = 86400
+# how long to wait after starting a refresh before starting another, in seconds
+REFRESH_RETRY = 300
+INVENTORY_FILE = 'inventory.json'
+
+# the fields of each device kept in the devices datastore
+DEVICE_FIELDS = ('id', 'label', 'type', 'capabilities')
+# what else is kept of each device in device_details - only what changes with the device itself, not its states
+DETAIL_FIELDS = ('commands',)
+DETAIL_ATTRIBUTES = ('supportedThermostatModes',)
+
+def device_record(device):
+    return {field: device[field] for field in DEVICE_FIELDS if field in device}
+
+def device_details(device):
+    details = {field: device[field] for field in DETAIL_FIELDS if field in device}
+    attributes = device.get('attributes')
+    if isinstance(attributes, dict):
+        details.update({name: attributes[name] for name in DETAIL_ATTRIBUTES if attributes.get(name)})
+    return details
+
+def store_devices(wf, devices):
+    """Save the devices/all response, split into compact device records and their details by device id"""
+    wf.store_data('devices', [device_record(device) for device in devices], serializer=records.SERIALIZER)
+    wf.store_data('device_details', {device['id']: device_details(device) for device in devices})
+
+def read_devices(devices):
+    """Device records and details by device id from devices/all, with the hash of both
+
+    Each device is cut down to what is stored as it is read, so a response that is streamed in is never held whole.
+    The hash leaves out device states, which change all the time.
+    """
+    new, details = [], {}
+    digest = hashlib.sha1()
+    for device in devices:
+        record, detail = device_record(device), device_details(device)
+        new.append(record)
+        details[record['id']] = detail
+        digest.update(json.dumps([record, detail], sort_keys=True, default=str).encode('utf-8'))
+    return new, details, digest.hexdigest()
+
+def read_inventory(wf):
+    """When the devices were last fetched and the hash of what was fetched, and when a refresh was last started"""
+    try:
+        with open(wf.datafile(INVENTORY_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_inventory(wf, **changes):
+    inventory = read_inventory(wf)
+    inventory.update(changes)
+    with atomic_writer(wf.datafile(INVENTORY_FILE), 'w') as f:
+        json.dump(inventory, f)
+
+def content_hash(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def diff_devices(old, new):
+    """Ids of the devices added, removed and changed from `old` to `new` device records, compared by content hash"""
+    def hashes(devices):
+        return {device['id']: content_hash([device.get(field) for field in DEVICE_FIELDS]) for device in devices}
+    old_hashes, new_hashes = hashes(old), hashes(new)
+    added = [id for id in new_hashes if id not in old_hashes]
+    removed = [id for id in old_hashes if id not in new_hashes]
+    changed = [id for id in new_hashes if id in old_hashes and old_hashes[id] != new_hashes[id]]
+    return added, removed, changed
+
+def update_devices(wf, new, details):
+    """Save device records and details from read_devices like store_devices, but only rewrite what differs from what
+    is stored
+
+    Returns the ids of the devices added, removed and changed.
+    """
+    old = load_devices(wf) or []
+    added, removed, changed = diff_devices(old, new)
+    if added or removed or changed or [device['id'] for device in old] != [device['id'] for device in new]:
+        wf.store_data('devices', new, serializer=records.SERIALIZER)
+    if details != get_stored_data(wf, 'device_details'):
+        wf.store_data('device_details', details)
+    return added, removed, changed
+
+def load_devices(wf):
+    """The stored device records, converting a whole devices/all response saved by earlier versions first"""
+    version = datastore_version(wf, 'devices')
+    if version and records.SERIALIZER != version[0]:
+        wf.logger.debug("converting devices."+version[0]+" to device records")
+        try:
+            devices = wf.stored_data('devices')
+        except ValueError:
+            devices = []
+        store_devices(wf, devices or [])
+        old_path = wf.datafile('devices.'+version[0])
+        if os.path.exists(old_path):
+            os.unlink(old_path)
+    return get_stored_data(wf, 'devices')
 
 def get_attributes(device):
     attributes = {}
     if 'id' in device and 'attributes' in device:
+        # devices/all gives attributes as a name to value map, devices/<id> as a list
+        if isinstance(device['attributes'], dict):
+            return dict(device['attributes'])
         for attribute in device['attributes']:
             attributes[attribute['name']] = attribute['currentValue']
     return attributes     
 
-def device_color(attributes, colors):
-    rgb = None
-    if 'RGB' in attributes and attributes['RGB']:
-        rgb = attributes['RGB']
-    if not rgb and 'colorName' in attributes and attributes['colorName']:
-        return attributes['colorName']
-    if not rgb and 'colorTemperature' in attributes and attributes['colorTemperature']:
-        rgb = colorTemperatureToRGB(attributes['colorTemperature'])
-    if not rgb and 'hue' in attributes and attributes['hue'] and 'saturation' in attributes and attributes['saturation'] and 'level' in attributes and attributes['level']:
-        (r, g, b) = hls_to_rgb(attributes['hue'], attributes['level'], attributes['saturation'])
-        rgb = "%x%x%x" % int(r), int(g), int(b)
-    if rgb:
-        inv_colors = {v: k for k, v in colors.items()}
-        if rgb in inv_colors:
-            return inv_colors['#'+rgb]
-    return rgb
-        
-def device_status(wf, api_key, hub_id, hub_ip, id):
-    result = hubitat_api(wf, api_key, hub_id, hub_ip, '/devices/'+id)
+def device_status(wf, api_key, hub_id, hub_ip, id, max_age=None):
+    # answer from the event-fed state store when it is fresh enough, max_age=0 forces a live call
+    result = read_state(wf, id, max_age)
+    if result is not None:
+        return result
+    result = hubitat_api(wf, api_key, hub_id, hub_ip, '/devices/'+id, idempotent=True)
+    result = get_attributes(result) if result else None
+    if result:
+        write_state(wf, id, result)
+    return result
+
+async def device_status_async(wf, api_key, hub_id, hub_ip, id, max_age=None):
+    # device_status as a coroutine - the state store is read the same way, only the hub call is awaited
+    result = read_state(wf, id, max_age)
+    if result is not None:
+        return result
+    result = await hubitat_api_async(wf, api_key, hub_id, hub_ip, '/devices/'+id, idempotent=True)
     result = get_attributes(result) if result else None
+    if result:
+        write_state(wf, id, result)
     return result
+
+def confirm_deadline(wf, capability):
+    deadlines = dict(CONFIRM_DEADLINES)
+    deadlines.update(wf.settings.get('confirm_deadlines', {}))
+    return deadlines.get(capability, wf.settings.get('confirm_deadline', CONFIRM_DEADLINE))
+
+def confirm_attribute(wf, api_key, hub_id, hub_ip, id, attribute, expected, deadline, result=None):
+    """Wait until a device reports `attribute` as `expected`, or `deadline` seconds have passed
+
+    Starts from `result`, the hub's answer to the command, then checks again with growing waits in between. When
+    pushed events keep the device's stored state current, the store is watched instead of asking the hub.
+    Returns whether it was confirmed and the last attributes seen.
+    """
+    start = time.time()
+    events = bool(listener_since(wf)) and os.path.exists(state_path(wf, id))
+    attributes = get_attributes(result) if result and 'attributes' in result else result
+    delay = wf.settings.get('confirm_first_delay', CONFIRM_FIRST_DELAY)
+    checks = 0
+    confirmed = False
+    while True:
+        confirmed = bool(attributes) and attribute in attributes and str(attributes[attribute]) == expected
+        remaining = deadline - (time.time() - start)
+        if confirmed or remaining <= 0:
+            break
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, CONFIRM_MAX_DELAY)
+        checks += 1
+        attributes = read_state(wf, id) if events else device_status(wf, api_key, hub_id, hub_ip, id, max_age=0)
+    if not confirmed and events:
+        # the event may have been lost - ask the hub once before giving up
+        attributes = device_status(wf, api_key, hub_id, hub_ip, id, max_age=0)
+        confirmed = bool(attributes) and attribute in attributes and str(attributes[attribute]) == expected
+    wf.logger.debug("confirm: device "+id+" "+attribute+"="+expected+(" confirmed" if confirmed else " not confirmed")
+        +" via "+("events" if events else "polling")+" in "+("%0.3f" % (time.time() - start))+"s after "+str(checks)+" checks")
+    return confirmed, attributes
+
+def status_snapshot(wf, api_key, hub_id, hub_ip):
+    """Attributes of every device keyed by id, from a single devices/all call reused for a few seconds"""
+    ttl = wf.settings.get('snapshot_max_age', SNAPSHOT_MAX_AGE)
+    # a max_age of 0 means forever to cached_data
+    snapshot = wf.cached_data('status_snapshot', max_age=ttl) if ttl > 0 else None
+    if snapshot is None:
+        snapshot = dict(hubitat_devices(wf, api_key, hub_id, hub_ip, lambda device: (str(device['id']), get_attributes(device))))
+        wf.cache_data('status_snapshot', snapshot)
+    return snapshot
+
+def device_statuses(wf, api_key, hub_id, hub_ip, ids):
+    """Attributes of several devices by id - what the state store can't answer comes from one snapshot"""
+    statuses = {id: read_state(wf, id) for id in ids}
+    if None in statuses.values():
+        snapshot = status_snapshot(wf, api_key, hub_id, hub_ip)
+        for id, status in statuses.items():
+            if status is None:
+                statuses[id] = snapshot.get(id)
+    return statuses
+
+def register_events(wf, api_key, hub_id, hub_ip, port):
+    url = 'http://'+local_ip_for(hub_ip)+':'+str(port)+'/'
+    wf.logger.debug("registering event url "+url)
+    return hubitat_api(wf, api_key, hub_id, hub_ip, 'postURL/'+quote(url, safe=''))
+
+def unregister_events(wf, api_key, hub_id, hub_ip):
+    # an empty URL stops the hub posting events
+    wf.logger.debug("clearing event url")
+    return hubitat_api(wf, api_key, hub_id, hub_ip, 'postURL/')
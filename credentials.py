@@ -0,0 +1,97 @@
+# encoding: utf-8
+
+"""Hubitat credentials, read from the Keychain in one go and kept for a short while.
+
+The API key, access mode, hub ID and hub IP are saved together as one Keychain
+item, URL-encoded so that `security` prints it back without quoting trouble,
+so reading them all takes a single call. Items saved one per credential by
+earlier versions are moved into it the first time it is missing. Once read,
+the credentials are kept for a few minutes in a session file in the workflow
+cache that only the user can read, and the file is removed whenever a
+credential changes.
+"""
+
+import json
+import os
+import time
+from urllib.parse import parse_qsl, urlencode
+from workflow import PasswordNotFound
+
+# the Keychain account holding all the credentials
+ACCOUNT = 'hubitat_credentials'
+# credentials saved as separate Keychain items by earlier versions
+NAMES = ['hubitat_api_key', 'hubitat_mode', 'hubitat_hub_id', 'hubitat_hub_ip']
+SESSION_FILE = 'credentials.json'
+# default number of seconds credentials are kept in the session file
+SESSION_TTL = 300
+
+def session_path(wf):
+    return wf.cachefile(SESSION_FILE)
+
+def write_session(wf, credentials):
+    path = session_path(wf)
+    temp_path = path+'.'+str(os.getpid())
+    # created readable by the user only, and moved into place whole
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(credentials, f)
+    os.replace(temp_path, path)
+
+def invalidate_session(wf):
+    path = session_path(wf)
+    if os.path.exists(path):
+        os.unlink(path)
+
+def read_keychain(wf):
+    """All credentials saved in the Keychain, as a dict of name to value"""
+    try:
+        return dict(parse_qsl(wf.get_password(ACCOUNT), keep_blank_values=True))
+    except PasswordNotFound:
+        pass
+    # move credentials saved by earlier versions into the single item
+    credentials = {}
+    for name in NAMES:
+        try:
+            credentials[name] = wf.get_password(name)
+        except PasswordNotFound:
+            continue
+    if credentials:
+        wf.logger.debug("moving credentials "+str(list(credentials.keys()))+" into one keychain item")
+        wf.save_password(ACCOUNT, urlencode(credentials))
+        for name in credentials:
+            wf.delete_password(name)
+    return credentials
+
+def load_credentials(wf):
+    """All credentials, from the session file while it is recent enough, otherwise from the Keychain"""
+    path = session_path(wf)
+    try:
+        if time.time() - os.stat(path).st_mtime < wf.settings.get('credentials_ttl', SESSION_TTL):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass
+    credentials = read_keychain(wf)
+    write_session(wf, credentials)
+    return credentials
+
+def get_credential(wf, name):
+    """Value of one credential, raising PasswordNotFound if it is not set"""
+    credentials = load_credentials(wf)
+    if name not in credentials:
+        raise PasswordNotFound()
+    return credentials[name]
+
+def save_credential(wf, name, value):
+    credentials = read_keychain(wf)
+    credentials[name] = value
+    wf.save_password(ACCOUNT, urlencode(credentials))
+    invalidate_session(wf)
+
+def clear_credentials(wf):
+    for account in [ACCOUNT] + NAMES:
+        try:
+            wf.delete_password(account)
+        except PasswordNotFound:
+            pass
+    invalidate_session(wf)
@@ -0,0 +1,212 @@
+# encoding: utf-8
+
+"""Resident helper that keeps the workflow warm between Alfred invocations.
+
+filter.py hands its arguments to this process over a Unix domain socket in
+the workflow cache directory. The helper runs it in-process, so imported
+modules, loaded datastores and open hub connections survive from one
+keystroke to the next. When the helper is not running, or is still busy
+with an earlier keystroke, the script simply runs as before.
+
+The helper takes one request at a time, and sends a byte as soon as it
+takes one. A client that gets no byte at once knows it is busy, and runs
+in-process rather than queue behind it; only then does it send its request,
+so a request given up on is never run.
+
+command.py always runs in its own process. A command can wait up to half a
+minute for a shade to close, and the helper answers one request at a time,
+so running commands there would hold up every search behind them.
+
+This module is imported by the scripts before anything else, so the client
+side must stay free of heavy imports.
+"""
+
+import json
+import os
+import socket
+import sys
+
+JOB_NAME = 'hubitat_daemon'
+SOCKET_NAME = 'hubitat.sock'
+# seconds without a request before the helper exits
+IDLE_TIMEOUT = 900
+# seconds a search waits for the helper to take its request before running in-process - an idle helper takes it at
+# once, so no answer means it is busy with an earlier keystroke
+ACCEPT_TIMEOUT = 0.05
+# seconds a search waits for the answer once the helper has taken its request
+FORWARD_TIMEOUT = 1.5
+# seconds stop() waits for the helper to take its exit request, after finishing the request it is on
+STOP_REQUEST_TIMEOUT = 45
+# seconds to wait for a stopped helper to exit, and between checks
+STOP_TIMEOUT = 5
+STOP_POLL = 0.05
+
+# the listening server, when running inside the helper process
+server = None
+
+def socket_path(cachedir):
+    return os.path.join(cachedir, SOCKET_NAME)
+
+def forward(script):
+    """Run `script` in the resident helper and exit with its result.
+
+    Returns without doing anything if no helper is listening, so that the
+    caller can carry on in-process.
+    """
+    cachedir = os.getenv('alfred_workflow_cache')
+    if not cachedir:
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(ACCEPT_TIMEOUT)
+    chunks = []
+    try:
+        with sock:
+            sock.connect(socket_path(cachedir))
+            if not sock.recv(1):
+                return
+            sock.settimeout(FORWARD_TIMEOUT)
+            env = {k: v for k, v in os.environ.items() if k.startswith('alfred_')}
+            sock.sendall(json.dumps({'script': script, 'args': sys.argv[1:], 'env': env}).encode('utf-8'))
+            sock.shutdown(socket.SHUT_WR)
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+    except OSError:
+        # not running, or busy for longer than a search should wait - run in-process instead
+        return
+    if not chunks:
+        return
+    reply = json.loads(b''.join(chunks))
+    sys.stdout.write(reply['output'])
+    sys.stdout.flush()
+    sys.exit(reply['code'])
+
+def is_running():
+    from workflow.background import is_running
+    return is_running(JOB_NAME)
+
+def start(wf):
+    from workflow.background import run_in_background
+    run_in_background(JOB_NAME, ['/usr/bin/python3', wf.workflowfile('daemon.py')])
+
+def stop(wf):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(STOP_REQUEST_TIMEOUT)
+    try:
+        sock.connect(socket_path(wf.cachedir))
+        sock.recv(1)
+        sock.sendall(json.dumps({'script': 'exit'}).encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        sock.recv(1)
+    except OSError:
+        return False
+    finally:
+        sock.close()
+    # the helper finishes the request it is on, then closes its socket and exits - starting it again before then
+    # would find it still running and do nothing
+    import time
+    deadline = time.time() + STOP_TIMEOUT
+    while is_running() and time.time() < deadline:
+        time.sleep(STOP_POLL)
+    return True
+
+def run_script(name, args, env):
+    import importlib
+    from contextlib import redirect_stdout
+    from io import StringIO
+    from workflow import Workflow
+
+    module = importlib.import_module(name)
+    saved_argv, saved_env = sys.argv, dict(os.environ)
+    sys.argv = [module.__file__] + args
+    os.environ.update(env)
+    output = StringIO()
+    try:
+        wf = Workflow(update_settings={
+            'github_slug': 'schwark/alfred-hubitat'
+        })
+        module.log = wf.logger
+        with redirect_stdout(output):
+            try:
+                code = wf.run(module.main)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 0
+    finally:
+        sys.argv = saved_argv
+        os.environ.clear()
+        os.environ.update(saved_env)
+    return code, output.getvalue()
+
+def serve(wf):
+    global server
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            # taken - a client that gave up waiting for this has closed the connection without sending anything
+            self.wfile.write(b'\0')
+            data = self.rfile.read()
+            if not data:
+                return
+            request = json.loads(data)
+            if 'exit' == request['script']:
+                self.server.idle = True
+                return
+            if 'filter' != request['script']:
+                return
+            code, output = run_script(request['script'], request['args'], request['env'])
+            self.wfile.write(json.dumps({'code': code, 'output': output}).encode('utf-8'))
+
+    class Server(socketserver.UnixStreamServer):
+        idle = False
+        timeout = IDLE_TIMEOUT
+
+        def handle_timeout(self):
+            self.idle = True
+
+    path = socket_path(wf.cachedir)
+    if os.path.exists(path):
+        os.unlink(path)
+    # requests are handled one at a time, so scripts never share state concurrently
+    # a socket file takes its mode from the umask - usable by this user only, from the moment it exists
+    umask = os.umask(0o077)
+    try:
+        server = Server(path, Handler)
+    finally:
+        os.umask(umask)
+    events = 'on' == wf.settings.get('events')
+    if events:
+        import states
+        from credentials import get_credential
+        from workflow import PasswordNotFound
+        try:
+            hub_ip = get_credential(wf, 'hubitat_hub_ip')
+        except PasswordNotFound:
+            wf.logger.info('no hub IP set, not listening for events')
+            events = False
+    if events:
+        states.start_listener(wf, wf.settings.get('events_port', states.EVENTS_PORT), hub_ip)
+        # stay up to keep receiving events
+        server.timeout = None
+    wf.logger.info('hubitat daemon listening on '+path)
+    try:
+        while not server.idle:
+            server.handle_request()
+    finally:
+        server.server_close()
+        server = None
+        if events:
+            states.stop_listener(wf)
+        if os.path.exists(path):
+            os.unlink(path)
+    wf.logger.info('hubitat daemon exiting')
+
+
+if __name__ == u"__main__":
+    # serve from the importable module so that scripts share its state
+    import daemon
+    from workflow import Workflow
+    wf = Workflow()
+    sys.exit(wf.run(daemon.serve))
@@ -1,14 +1,30 @@
 # encoding: utf-8
 
 import sys
+
+if __name__ == u"__main__":
+    # let the resident helper answer if it is running
+    from daemon import forward
+    forward('filter')
+
 import re
+import time
 import argparse
 from workflow.workflow import MATCH_ATOM, MATCH_STARTSWITH, MATCH_SUBSTRING, MATCH_ALL, MATCH_INITIALS, MATCH_CAPITALS, MATCH_INITIALS_STARTSWITH, MATCH_INITIALS_CONTAIN
-from workflow import Workflow, ICON_WEB, ICON_NOTE, ICON_BURN, ICON_SWITCH, ICON_HOME, ICON_COLOR, ICON_INFO, ICON_SYNC, web, PasswordNotFound
-from common import hubitat_api, get_stored_data, discover_hub, get_device_capabilities, get_attributes, device_color
+from workflow import Workflow, ICON_WEB, ICON_NOTE, ICON_BURN, ICON_SWITCH, ICON_HOME, ICON_COLOR, ICON_INFO, ICON_SYNC, PasswordNotFound
+import daemon
+from colors import ColorTable, device_color
+from vocabulary import Vocabulary, THERMOSTAT_MODES, SHADE_LEVELS
+from results import result_key, load_result, store_result
+from credentials import get_credential
+from search import get_commands, get_device_index
+from common import hubitat_api, get_stored_data, datastore_version, discover_hub, get_device_capabilities, get_attributes, device_status as device_attributes, device_statuses, read_inventory, write_inventory, INVENTORY_MAX_AGE, REFRESH_RETRY
 
 log = None
 
+# background job refreshing the devices
+REFRESH_JOB = 'hubitat_refresh'
+
 def get_device_icon(device):
     capabilities = get_device_capabilities(device)
     if 'Thermostat' in capabilities:
@@ -31,27 +47,35 @@ def get_device_icon(device):
         icon = 'switch'
     return 'icons/'+icon+'.png'
 
-def get_color(name, colors):
-    name = name.lower().replace(' ','')
-    if re.match('[0-9a-f]{6}', name):
-        return '#'+name.upper()
-    elif name in colors:
-        return colors[name].upper()
-    return ''
-
-def search_key_for_device(wf, device, commands):
-    """Generate a string search key for a switch"""
-    elements = []
-    supported_capabilities = set(map(lambda x: x[1]['capability'], commands.items()))
-    #wf.logger.debug("supported capabilities are : "+str(supported_capabilities))
-    capabilities = get_device_capabilities(device)
-    #wf.logger.debug("device capabilities are : "+str(capabilities))
-    if len(list(set(capabilities) & supported_capabilities)) > 0:
-        elements.append(device['label'])  # label of device
-    #wf.logger.debug(elements)
-    return u' '.join(elements)
-
-def add_config_commands(args, config_commands):
+# the index entries prepared for filtering, reused by the resident helper while they are unchanged
+device_search = {}
+
+def get_device_search(wf, devices):
+    """Devices prepared for filtering, from the keys stored with the search index rather than worked out again
+
+    Only the resident helper, which keeps them across queries, gets the character and trigram lookup tables.
+    """
+    if device_search.get('devices') is not devices:
+        device_search['devices'] = devices
+        device_search['search'] = wf.filter_index(devices, prepared=lambda x: x['search'], postings=bool(daemon.server))
+    return device_search['search']
+
+def refresh_if_stale(wf):
+    """Start refreshing the devices in the background once they are older than the refresh_age setting"""
+    max_age = wf.settings.get('refresh_age', INVENTORY_MAX_AGE)
+    if max_age <= 0 or not datastore_version(wf, 'devices'):
+        return False
+    inventory = read_inventory(wf)
+    now = time.time()
+    if now - inventory.get('updated', 0) < max_age or now - inventory.get('tried', 0) < REFRESH_RETRY:
+        return False
+    from workflow.background import run_in_background
+    wf.logger.debug("devices last fetched "+str(int(now - inventory.get('updated', 0)))+"s ago, refreshing")
+    write_inventory(wf, tried=now)
+    run_in_background(REFRESH_JOB, ['/usr/bin/python3', wf.workflowfile('command.py'), '--refresh'])
+    return True
+
+def add_config_commands(wf, args, config_commands):
     word = args.query.lower().split(' ')[0] if args.query else ''
     config_command_list = wf.filter(word, config_commands.keys(), min_score=80, match_on=MATCH_SUBSTRING | MATCH_STARTSWITH | MATCH_ATOM)
     if config_command_list:
@@ -64,48 +88,41 @@ def add_config_commands(args, config_commands):
                         valid=config_commands[cmd]['valid'])
     return config_command_list
 
-def get_device_commands(wf, device, commands):
-    result = []
-    if device['type'] == 'Scene Activator':
-        result.append('on') 
-    else:
-        capabilities = get_device_capabilities(device)
-        if not should_show_status(wf):
-            capabilities.append('global')
-        for capability in capabilities:
-            for command, map in commands.items():
-                if capability == map['capability']:
-                    result.append(command)
-                    
-        # start with off if available                    
-        if 'off' in result: 
-            result.insert(0, result.pop(result.index('off')))                
-        # start with on if available       
-        if 'on' in result:
-            result.insert(0, result.pop(result.index('on')))                
-        # start with toggle if available
-        if 'toggle' in result:
-            result.insert(0, result.pop(result.index('toggle'))) 
-        if 'togglock' in result:      
-            result.insert(0, result.pop(result.index('togglock')))       
-
+def get_device_commands(wf, device):
+    result = list(device['commands'])
+    # status is offered as a command when it is not shown up front
+    if device['type'] != 'Scene Activator' and not should_show_status(wf):
+        result.append('status')
     return result
 
-def get_filtered_devices(wf, query, devices, commands):
-    result = wf.filter(query, devices, key=lambda x: search_key_for_device(wf, x, commands), min_score=80, match_on=MATCH_SUBSTRING | MATCH_STARTSWITH | MATCH_ATOM)
+def exact_match(query, result):
     # check to see if the first one is an exact match - if yes, remove all the other results
     if result and query and 'label' in result[0] and result[0]['label'] and result[0]['label'].lower() == query.lower():
         result = result[0:1]
     return result
 
-def extract_commands(wf, args, devices, commands):
+def get_filtered_devices(wf, query, devices):
+    result = wf.filter(query, devices, key=lambda x: x['key'], min_score=80, match_on=MATCH_SUBSTRING | MATCH_STARTSWITH | MATCH_ATOM)
+    return exact_match(query, result)
+
+def group_command(devices, command):
+    """The devices that support a command given to all of them, e.g. 'downstairs lights off'"""
+    if 'status' == command or len(devices) < 2:
+        return []
+    return [device for device in devices if command in device['commands']]
+
+def extract_commands(wf, args, devices, commands=None):
     words = args.query.split() if args.query else []
     args.device_command = ''
     args.device_params = []
+    matched = None
     if devices:
-        full_devices = get_filtered_devices(wf, args.query,  devices, commands)
-        minusone_devices = get_filtered_devices(wf, ' '.join(words[0:-1]),  devices, commands)
-        minustwo_devices = get_filtered_devices(wf, ' '.join(words[0:-2]),  devices, commands)
+        # match the full query, and the query without its last one and two words, in a single pass over the devices
+        queries = [args.query, ' '.join(words[0:-1]), ' '.join(words[0:-2])]
+        results = wf.filter_prefixes(words, devices, key=lambda x: x['key'], drop=(0, 1, 2), min_score=80, match_on=MATCH_SUBSTRING | MATCH_STARTSWITH | MATCH_ATOM)
+        full_devices, minusone_devices, minustwo_devices = [exact_match(q, r) for q, r in zip(queries, results)]
+        # the query is left alone unless a command is found, so these are the devices it matches
+        matched = full_devices
 
         if 1 == len(minusone_devices) and (0 == len(full_devices) or (1 == len(full_devices) and full_devices[0]['id'] == minusone_devices[0]['id'])):
             extra_words = args.query.replace(minusone_devices[0]['label'],'').split()
@@ -113,16 +130,34 @@ def extract_commands(wf, args, devices, commands):
                 wf.logger.debug("extract_commands: setting command to "+extra_words[0])
                 args.device_command = extra_words[0]
                 args.query = minusone_devices[0]['label']
+                matched = None
         if 1 == len(minustwo_devices) and 0 == len(full_devices) and 0 == len(minusone_devices):
             extra_words = args.query.replace(minustwo_devices[0]['label'],'').split()
             if extra_words:
                 args.device_command = extra_words[0]
                 args.query = minustwo_devices[0]['label']
                 args.device_params = extra_words[1:]
+                matched = None
+        # several devices and a complete command name
+        if commands and not args.device_command and 0 == len(full_devices):
+            if words[-1] in commands and group_command(minusone_devices, words[-1]):
+                args.device_command = words[-1]
+                args.query = ' '.join(words[0:-1])
+                matched = group_command(minusone_devices, words[-1])
+            elif len(words) > 2 and 0 == len(minusone_devices) and words[-2] in commands and group_command(minustwo_devices, words[-2]):
+                args.device_command = words[-2]
+                args.device_params = words[-1:]
+                args.query = ' '.join(words[0:-2])
+                matched = group_command(minustwo_devices, words[-2])
         wf.logger.debug("extract_commands: "+str(args))
-    return args
+    return args, matched
+
+# whether this run has shown a device's status, which is never saved with the results
+status_shown = False
 
-def device_status(wf, api_key, hub_id, hub_ip, device, colors):
+def device_status(wf, api_key, hub_id, hub_ip, device, colors, status=None):
+    global status_shown
+    status_shown = True
     caps = {
         'switch': {
             'tag': 'switch',
@@ -208,7 +243,8 @@ def device_status(wf, api_key, hub_id, hub_ip, device, colors):
         ]
     }
     subtitle = ''
-    status = get_attributes(hubitat_api(wf, api_key, hub_id, hub_ip, '/devices/'+device['id']))
+    if status is None:
+        status = device_attributes(wf, api_key, hub_id, hub_ip, device['id'])
     if status:
         detail = status
         for cap in caps:
@@ -230,9 +266,14 @@ def should_show_status(wf):
     return ('on' == wf.settings['showstatus']) if 'showstatus' in wf.settings else False
 
 def main(wf):
-    # retrieve cached devices and scenes
-    devices = get_stored_data(wf, 'devices')
-    colors = get_stored_data(wf, 'colors')
+    # this run was not served by the helper - start it for the next keystroke
+    if 'on' == wf.settings.get('daemon') and not daemon.is_running():
+        daemon.start(wf)
+    # the stored devices are used as they are while newer ones are fetched
+    refresh_if_stale(wf)
+
+    # colors are only read from disk if the query gets to a color
+    colors = ColorTable(wf)
 
     # build argument parser to parse script args and collect their
     # values
@@ -244,117 +285,41 @@ def main(wf):
 
     log.debug("args are "+str(args))
 
+    # serve the results saved for this query if nothing they depend on has changed
+    global status_shown
+    status_shown = False
+    result = None
+    if args.query and not wf.debugging:
+        try:
+            mode = get_credential(wf, 'hubitat_mode')
+        except PasswordNotFound:
+            mode = 'local'
+        result = result_key(wf, args.query, mode)
+        feedback = load_result(wf, result)
+        if feedback is not None:
+            log.debug("serving saved results for "+args.query)
+            sys.stdout.write(feedback)
+            sys.stdout.flush()
+            return 0
+
     words = args.query.split(' ') if args.query else []
 
-    # list of commands
-    commands = {
-        'status': {
-            'capability': 'global'
-        },
-        'on': {
-                'component': 'main',
-                'capability': 'Switch',
-                'command': 'on'
-        }, 
-        'off': {
-                'component': 'main',
-                'capability': 'Switch',
-                'command': 'off'
-        },
-        'toggle': {
-                'component': 'main',
-                'capability': 'Switch',
-                'command': 'off'
-        },
-        'dim': {
-                'component': 'main',
-                'capability': 'SwitchLevel',
-                'command': 'setLevel',
-                'arguments': [
-                    lambda: int(args.device_params[0]),
-                ]
-        },
-        'slevel': {
-                'component': 'main',
-                'capability': 'WindowShadeLevel',
-                'command': 'setShadeLevel',
-                'arguments': [
-                    lambda: int(args.device_params[0]),
-                ]
-        },
-        'open': {
-                'component': 'main',
-                'capability': 'WindowShade',
-                'command': 'open'
-        },
-        'close': {
-                'component': 'main',
-                'capability': 'WindowShade',
-                'command': 'close'
-        },
-        'lock': {
-                'component': 'main',
-                'capability': 'Lock',
-                'command': 'lock'
-        }, 
-        'unlock': {
-                'component': 'main',
-                'capability': 'Lock',
-                'command': 'unlock'
-        },
-        'togglock': {
-                'component': 'main',
-                'capability': 'Lock',
-                'command': 'unlock'
-        },
-        'view': {
-                'component': 'main',
-                'capability': 'ContactSensor',
-                'command': 'view'
-        },
-        'color': {
-                'component': 'main',
-                'capability': 'ColorControl',
-                'command': 'setColor',
-                'arguments': [
-                    {
-                        'hex': lambda: get_color(args.device_params[0], colors)
-                    }
-                ]
-        },
-        'mode': {
-            'component': 'main',
-            'capability': 'Thermostat',
-            'command': 'setThermostatMode',
-            'arguments': [
-                lambda: str(args.device_params[0])
-            ]
-        },
-        'heat': {
-                'component': 'main',
-                'capability': 'Thermostat',
-                'command': 'setHeatingSetpoint',
-                'arguments': [
-                    lambda: int(args.device_params[0]),
-                ]
-        },
-        'cool': {
-                'component': 'main',
-                'capability': 'Thermostat',
-                'command': 'setCoolingSetpoint',
-                'arguments': [
-                    lambda: int(args.device_params[0]),
-                ]
-        }
-    }
+    commands = get_commands(args, colors)
+
+    # retrieve cached devices and scenes, as entries of the prebuilt search index
+    devices = get_device_index(wf, commands)['entries']
 
     command_params = {
         'color': {
-            'values': colors.keys() if colors else [],
+            'values': colors,
             'regex': '[0-9a-f]{6}'
         },
         'mode': {
-            'values': ['auto','heat','cool','off']
+            'values': Vocabulary(wf, 'modes', THERMOSTAT_MODES)
+        },
+        'slevel': {
+            'values': Vocabulary(wf, 'levels', SHADE_LEVELS, numeric=True),
+            'regex': '[0-9]{1,3}$'
         }
     }
 
@@ -393,11 +358,11 @@ def main(wf):
         },
         'mode': {
             'title': 'Set access mode',
-            'subtitle': 'Set access mode to local or cloud',
+            'subtitle': 'Set access mode to local, cloud or auto',
             'autocomplete': 'mode',
             'args': ' --mode '+(words[1] if len(words)>1 else ''),
             'icon': ICON_WEB,
-            'valid': len(words) > 1 and words[1] in ['local', 'cloud']
+            'valid': len(words) > 1 and words[1] in ['local', 'cloud', 'auto']
         },
         'showstatus': {
             'title': 'Turn on/off showing of status when single device',
@@ -407,6 +372,22 @@ def main(wf):
             'icon': ICON_INFO,
             'valid': len(words) > 1 and words[1] in ['on', 'off']
         },
+        'events': {
+            'title': 'Turn on/off event push from the hub',
+            'subtitle': 'Hub pushes device changes to the background helper so status shows without waiting. Local mode only',
+            'autocomplete': 'events',
+            'args': ' --events '+(words[1] if len(words)>1 else ''),
+            'icon': ICON_INFO,
+            'valid': len(words) > 1 and words[1] in ['on', 'off']
+        },
+        'daemon': {
+            'title': 'Turn on/off the background helper',
+            'subtitle': 'Keeps devices and hub connection warm between searches for faster results',
+            'autocomplete': 'daemon',
+            'args': ' --daemon '+(words[1] if len(words)>1 else ''),
+            'icon': ICON_INFO,
+            'valid': len(words) > 1 and words[1] in ['on', 'off']
+        },
         'reinit': {
             'title': 'Reinitialize the workflow',
             'subtitle': 'CAUTION: this deletes all scenes, devices and apikeys...',
@@ -426,14 +407,14 @@ def main(wf):
     }
 
     # add config commands to filter
-    add_config_commands(args, config_commands)
+    config_command_list = add_config_commands(wf, args, config_commands)
 
     ####################################################################
     # Check that we have an API key saved
     ####################################################################
 
     try:
-        api_key = wf.get_password('hubitat_api_key')
+        api_key = get_credential(wf, 'hubitat_api_key')
     except PasswordNotFound:  # API key has not yet been set
         wf.add_item('No API key set...',
                     'Please use hb apikey to set your Hubitat API key.',
@@ -443,14 +424,14 @@ def main(wf):
         return 0
 
     try:
-        mode = wf.get_password('hubitat_mode')
+        mode = get_credential(wf, 'hubitat_mode')
     except PasswordNotFound:  # mode has not yet been set
         mode = 'local'
 
     if 'cloud' == mode:
         hub_ip = None
         try:
-            hub_id = wf.get_password('hubitat_hub_id')
+            hub_id = get_credential(wf, 'hubitat_hub_id')
         except PasswordNotFound:  # Hub ID has not yet been set
             wf.add_item('No Hub ID set in cloud mode...',
                         'Please use hb hubid to set your Hubitat Hub ID or revert to local mode',
@@ -460,15 +441,21 @@ def main(wf):
             return 0
     else:
         hub_id = None
+        if 'auto' == mode:
+            # status calls go through both the hub and the cloud when one is slow to answer
+            try:
+                hub_id = get_credential(wf, 'hubitat_hub_id')
+            except PasswordNotFound:
+                pass
         try:
-            hub_ip = wf.get_password('hubitat_hub_ip')
+            hub_ip = get_credential(wf, 'hubitat_hub_ip')
         except PasswordNotFound:  # Hub IP has not yet been set
             try:
                 hub_ip = None #discover_hub()
             except:
                 pass
             wf.logger.debug('discovered hub ip is '+(hub_ip or ''))
-            if not hub_ip:
+            if not hub_ip and not hub_id:
                 wf.add_item('No Hub IP set in local mode...',
                             'Please use hb ip to set your Hubitat Hub IP or revert to cloud mode',
                             valid=False,
@@ -477,7 +464,8 @@ def main(wf):
                 return 0
         
     # since this i now sure to be a device/scene query, fix args if there is a device/scene command in there
-    args = extract_commands(wf, args, devices, commands)
+    search = get_device_search(wf, devices)
+    args, matched = extract_commands(wf, args, search, commands)
  
     # update query post extraction
     query = args.query
@@ -505,7 +493,7 @@ def main(wf):
 
     # If script was passed a query, use it to filter posts
     if query:
-        devices = get_filtered_devices(wf, query, devices, commands)
+        devices = matched if matched is not None else get_filtered_devices(wf, query, search)
 
         if devices:
             if 1 == len(devices):
@@ -527,7 +515,7 @@ def main(wf):
                             icon=icon)
                 if (not args.device_command or args.device_command not in commands):
                     # Single device only, no command or not complete command yet so populate with all the commands
-                    device_commands = get_device_commands(wf, device, commands)
+                    device_commands = get_device_commands(wf, device)
                     device_commands = list(filter(lambda x: x.startswith(args.device_command), device_commands))
                     log.debug('args.device_command is '+args.device_command)
                     for command in device_commands:
@@ -537,14 +525,13 @@ def main(wf):
                                 autocomplete=device['label']+' '+command,
                                 valid=bool('status' != command and ('arguments' not in commands[command] or args.device_params)),
                                 icon=icon)
-                elif (args.device_command and args.device_command in commands and args.device_command in command_params):
+                elif (args.device_command and args.device_command in commands and args.device_command in command_params
+                        and args.device_command in device['commands']):
                     # single device and has command already - populate with params?
-                    param_list = command_params[args.device_command]['values']
                     param_start = args.device_params[0] if args.device_params else ''
-                    param_list = list(filter(lambda x: x.startswith(param_start), param_list))
-                    param_list.sort()
+                    param_list = command_params[args.device_command]['values'].complete(param_start, device['id'])
                     check_regex = False
-                    if not param_list and command_params[args.device_command]['regex']:
+                    if not param_list and command_params[args.device_command].get('regex'):
                         param_list.append(args.device_params[0].lower())
                         check_regex = True
                     for param in param_list:
@@ -562,19 +549,36 @@ def main(wf):
                             valid=True,
                             icon=icon)
             else:
+                # with no command typed yet, show what each device is doing - fetched for all of them at once
+                statuses = {}
+                if should_show_status(wf) and not args.device_command:
+                    statuses = device_statuses(wf, api_key, hub_id, hub_ip, [device['id'] for device in devices])
+                # one item to send the command to all of them at once
+                if args.device_command in commands and 'status' != args.device_command:
+                    params = ' '.join(args.device_params)
+                    wf.add_item(title='All '+str(len(devices))+' devices matching '+query,
+                            subtitle='Turn '+', '.join([device['label'] for device in devices])+' '+args.device_command+' '+params,
+                            arg=' --device-uids '+','.join([device['id'] for device in devices])+' --device-command '+args.device_command+' --device-params '+params,
+                            autocomplete=query+' '+args.device_command,
+                            valid=bool('arguments' not in commands[args.device_command] or args.device_params),
+                            icon=ICON_SWITCH)
                 # Loop through the returned devices and add an item for each to
                 # the list of results for Alfred
                 for device in devices:
                     command = 'on' if device['type'] == 'Scene Activator' else args.device_command
+                    status = device_status(wf, api_key, hub_id, hub_ip, device, colors, statuses[device['id']] or {}) if device['id'] in statuses else ''
                     wf.add_item(title=device['label'],
-                            subtitle='Turn '+device['label']+' '+command+' '+(' '.join(args.device_params) if args.device_params else ''),
+                            subtitle=status or 'Turn '+device['label']+' '+command+' '+(' '.join(args.device_params) if args.device_params else ''),
                             arg=' --device-uid '+device['id']+' --device-command '+command+' --device-params '+(' '.join(args.device_params)),
                             autocomplete=device['label'],
                             valid=bool(command in commands),
                             icon=get_device_icon(device))
 
         # Send the results to Alfred as XML
-        wf.send_feedback()
+        feedback = wf.send_feedback()
+        # config items carry what was typed after them, API keys included, which must not be saved in the cache
+        if result and not status_shown and not config_command_list:
+            store_result(wf, result, feedback)
     return 0
 
 
@@ -0,0 +1,44 @@
+# encoding: utf-8
+
+"""Compact on-disk format for lists of flat records, such as the device list.
+
+Field names are written once, followed by each record as a row of values in
+field order, all with marshal, which loads plain data faster than pickle.
+Importing this module registers the format with the workflow's serializer
+manager as 'records', so it can be passed to Workflow.store_data and is
+picked up by Workflow.stored_data.
+"""
+
+import marshal
+from workflow import manager
+from workflow.workflow import BaseSerializer
+
+SERIALIZER = 'records'
+
+class RecordSerializer(BaseSerializer):
+    """Stores a list of dicts as a field list and one tuple per dict.
+
+    Values must be plain data (str, int, float, bool, None and lists,
+    tuples or dicts of them). A record missing a field another record has
+    reads back with that field set to None.
+    """
+
+    is_binary = True
+
+    @classmethod
+    def load(cls, file_obj):
+        fields, rows = marshal.load(file_obj)
+        return [dict(zip(fields, row)) for row in rows]
+
+    @classmethod
+    def dump(cls, obj, file_obj):
+        fields = []
+        for record in obj:
+            for field in record:
+                if field not in fields:
+                    fields.append(field)
+        rows = [tuple(record.get(field) for field in fields) for record in obj]
+        return marshal.dump((tuple(fields), rows), file_obj)
+
+
+manager.register(SERIALIZER, RecordSerializer)
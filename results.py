@@ -0,0 +1,85 @@
+# encoding: utf-8
+
+"""Script filter results remembered by query.
+
+Alfred runs the script filter again for queries it has just seen, as the
+user backspaces or reopens the bar. The feedback sent for a query is saved
+in the workflow cache, under a key that also covers everything else the
+results depend on: the access mode, the workflow settings, whether an update
+is available and the stored devices and vocabularies. When any of them
+changes the key changes with it, so a saved result is never served stale,
+and `hb update` clears them all when the devices change. Results that show device status are not
+saved, as the devices may change at any time, and neither are results offering config items, whose
+arguments hold what was typed after them - API keys included.
+"""
+
+import hashlib
+import json
+import os
+from common import datastore_version
+from vocabulary import vocabulary_path
+from workflow.util import atomic_writer
+
+RESULTS_DIR = 'results'
+# default number of results kept, the least recently used being dropped first
+RESULTS_SIZE = 200
+# bump when the feedback for a query changes shape
+RESULTS_VERSION = 1
+# stored data the results are built from
+DATASTORES = ['devices', 'index']
+VOCABULARIES = ['colors', 'color_names', 'modes', 'levels']
+
+def results_dir(wf):
+    path = wf.cachefile(RESULTS_DIR)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return path
+
+def file_version(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def result_key(wf, query, mode):
+    """Key for the results of `query` with the workflow as it is now"""
+    parts = [RESULTS_VERSION, query, mode, wf.settings, wf.update_available]
+    parts.extend(datastore_version(wf, name) for name in DATASTORES)
+    parts.extend(file_version(vocabulary_path(wf, name)) for name in VOCABULARIES)
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def load_result(wf, key):
+    """Saved feedback for `key`, or None"""
+    path = os.path.join(results_dir(wf), key+'.json')
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            feedback = f.read()
+        # mark it as recently used
+        os.utime(path)
+    except OSError:
+        return None
+    return feedback
+
+def store_result(wf, key, feedback):
+    path = results_dir(wf)
+    with atomic_writer(os.path.join(path, key+'.json'), 'w') as f:
+        f.write(feedback)
+    names = [name for name in os.listdir(path) if name.endswith('.json')]
+    size = wf.settings.get('results_size', RESULTS_SIZE)
+    if len(names) > size:
+        def last_used(name):
+            return (file_version(os.path.join(path, name)) or (0,))[0]
+        for name in sorted(names, key=last_used)[:len(names) - size]:
+            try:
+                os.unlink(os.path.join(path, name))
+            except OSError:
+                pass
+
+def clear_results(wf):
+    path = results_dir(wf)
+    for name in os.listdir(path):
+        try:
+            os.unlink(os.path.join(path, name))
+        except OSError:
+            pass
@@ -0,0 +1,221 @@
+# encoding: utf-8
+
+"""The script filter's commands, and the search index of the devices built from them.
+
+Each device's search key and the commands it offers depend only on the
+device and the command table, so they are worked out once when the devices
+are updated and stored as the 'index' datastore - along with everything
+Workflow.filter derives from the key (lowercased and ASCII-folded forms,
+capitals, atoms and initials, see FilterIndex.prepare). The script filter
+loads the index as it is and searches those, and rebuilds the index only if
+the devices or the command table changed since it was built.
+"""
+
+import re
+from workflow.workflow import FilterIndex
+from common import get_stored_data, load_devices, datastore_version, get_device_capabilities
+
+# bump whenever the layout of the search index changes, so stale indexes get rebuilt
+INDEX_VERSION = 3
+
+def get_color(name, colors):
+    name = name.lower().replace(' ','')
+    if re.match('[0-9a-f]{6}', name):
+        return '#'+name.upper()
+    elif name in colors:
+        return colors[name].upper()
+    return ''
+
+def get_commands(args, colors):
+    # list of commands
+    return {
+        'status': {
+            'capability': 'global'
+        },
+        'on': {
+                'component': 'main',
+                'capability': 'Switch',
+                'command': 'on'
+        }, 
+        'off': {
+                'component': 'main',
+                'capability': 'Switch',
+                'command': 'off'
+        },
+        'toggle': {
+                'component': 'main',
+                'capability': 'Switch',
+                'command': 'off'
+        },
+        'dim': {
+                'component': 'main',
+                'capability': 'SwitchLevel',
+                'command': 'setLevel',
+                'arguments': [
+                    lambda: int(args.device_params[0]),
+                ]
+        },
+        'slevel': {
+                'component': 'main',
+                'capability': 'WindowShadeLevel',
+                'command': 'setShadeLevel',
+                'arguments': [
+                    lambda: int(args.device_params[0]),
+                ]
+        },
+        'open': {
+                'component': 'main',
+                'capability': 'WindowShade',
+                'command': 'open'
+        },
+        'close': {
+                'component': 'main',
+                'capability': 'WindowShade',
+                'command': 'close'
+        },
+        'lock': {
+                'component': 'main',
+                'capability': 'Lock',
+                'command': 'lock'
+        }, 
+        'unlock': {
+                'component': 'main',
+                'capability': 'Lock',
+                'command': 'unlock'
+        },
+        'togglock': {
+                'component': 'main',
+                'capability': 'Lock',
+                'command': 'unlock'
+        },
+        'view': {
+                'component': 'main',
+                'capability': 'ContactSensor',
+                'command': 'view'
+        },
+        'color': {
+                'component': 'main',
+                'capability': 'ColorControl',
+                'command': 'setColor',
+                'arguments': [
+                    {
+                        'hex': lambda: get_color(args.device_params[0], colors)
+                    }
+                ]
+        },
+        'mode': {
+            'component': 'main',
+            'capability': 'Thermostat',
+            'command': 'setThermostatMode',
+            'arguments': [
+                lambda: str(args.device_params[0])
+            ]
+        },
+        'heat': {
+                'component': 'main',
+                'capability': 'Thermostat',
+                'command': 'setHeatingSetpoint',
+                'arguments': [
+                    lambda: int(args.device_params[0]),
+                ]
+        },
+        'cool': {
+                'component': 'main',
+                'capability': 'Thermostat',
+                'command': 'setCoolingSetpoint',
+                'arguments': [
+                    lambda: int(args.device_params[0]),
+                ]
+        }
+    }
+
+def search_key_for_device(wf, device, supported_capabilities):
+    """Generate a string search key for a switch"""
+    elements = []
+    capabilities = get_device_capabilities(device)
+    if len(list(set(capabilities) & supported_capabilities)) > 0:
+        elements.append(device['label'])  # label of device
+    return u' '.join(elements)
+
+def command_signature(commands):
+    return sorted((command, map['capability']) for command, map in commands.items())
+
+def index_entry(wf, device, commands, supported_capabilities):
+    """Precompute everything searching and listing a device needs"""
+    key = search_key_for_device(wf, device, supported_capabilities)
+    return {
+        'id': device['id'],
+        'label': device['label'],
+        'type': device['type'],
+        'capabilities': get_device_capabilities(device),
+        'key': key,
+        'search': FilterIndex.prepare(key),
+        'commands': list_device_commands(device, commands)
+    }
+
+def list_device_commands(device, commands):
+    result = []
+    if device['type'] == 'Scene Activator':
+        result.append('on') 
+    else:
+        capabilities = get_device_capabilities(device)
+        for capability in capabilities:
+            for command, map in commands.items():
+                if capability == map['capability']:
+                    result.append(command)
+                    
+        # start with off if available                    
+        if 'off' in result: 
+            result.insert(0, result.pop(result.index('off')))                
+        # start with on if available       
+        if 'on' in result:
+            result.insert(0, result.pop(result.index('on')))                
+        # start with toggle if available
+        if 'toggle' in result:
+            result.insert(0, result.pop(result.index('toggle'))) 
+        if 'togglock' in result:      
+            result.insert(0, result.pop(result.index('togglock')))       
+
+    return result
+
+def build_device_index(wf, devices, commands):
+    supported_capabilities = set(map(lambda x: x[1]['capability'], commands.items()))
+    return {
+        'version': INDEX_VERSION,
+        'devices': datastore_version(wf, 'devices'),
+        'signature': command_signature(commands),
+        'entries': [index_entry(wf, device, commands, supported_capabilities) for device in devices or []]
+    }
+
+def store_device_index(wf, devices):
+    index = build_device_index(wf, devices, get_commands(None, None))
+    wf.store_data('index', index)
+    return index
+
+def update_device_index(wf, devices, changed):
+    """Bring the stored search index in line with `devices`, only working out the entries of devices that are new or in `changed`"""
+    commands = get_commands(None, None)
+    index = get_stored_data(wf, 'index')
+    if not index or INDEX_VERSION != index['version'] or command_signature(commands) != index['signature']:
+        return store_device_index(wf, devices)
+    version = datastore_version(wf, 'devices')
+    if version == index['devices'] and not changed:
+        return index
+    supported_capabilities = set(map(lambda x: x[1]['capability'], commands.items()))
+    entries = {entry['id']: entry for entry in index['entries']}
+    index = dict(index, devices=version, entries=[
+        entries[device['id']] if device['id'] in entries and device['id'] not in changed
+        else index_entry(wf, device, commands, supported_capabilities)
+        for device in devices or []])
+    wf.store_data('index', index)
+    return index
+
+def get_device_index(wf, commands):
+    """Load the search index built by hb update, rebuilding it if it is stale"""
+    index = get_stored_data(wf, 'index')
+    if (not index or INDEX_VERSION != index['version'] or command_signature(commands) != index['signature']
+            or datastore_version(wf, 'devices') != index['devices']):
+        wf.logger.debug("rebuilding stale search index")
+        index = build_device_index(wf, load_devices(wf), commands)
+        wf.store_data('index', index)
+    return index
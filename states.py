@@ -0,0 +1,169 @@
+# encoding: utf-8
+
+"""Per-device attribute store kept current by events pushed from the hub.
+
+Every live status call writes the device's attributes to a small file in
+the workflow cache. When event push is turned on, the resident helper also
+listens for the Maker API's postURL events and applies each attribute change
+to the same files, so status lookups and toggles can be answered without
+asking the hub.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from workflow.util import atomic_writer
+
+# default number of seconds a stored device state may be used for, when not kept current by events
+STATE_MAX_AGE = 10
+# default number of seconds a state kept current by events may be used for - an event can still be lost
+EVENT_STATE_MAX_AGE = 300
+# default port the event listener accepts Maker API posts on
+EVENTS_PORT = 39501
+# how often a running event listener marks itself alive, in seconds
+HEARTBEAT = 30
+
+LISTENER_FILE = '.listener'
+
+write_lock = threading.Lock()
+
+def state_dir(wf):
+    path = wf.cachefile('states')
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return path
+
+def state_path(wf, device_id):
+    return os.path.join(state_dir(wf), str(device_id)+'.json')
+
+def listener_since(wf):
+    """Start time of a live event listener, or None if none is running"""
+    path = os.path.join(state_dir(wf), LISTENER_FILE)
+    try:
+        if time.time() - os.stat(path).st_mtime > 2 * HEARTBEAT:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return float(f.read())
+    except (OSError, ValueError):
+        return None
+
+def read_state(wf, device_id, max_age=None):
+    """Stored attributes of a device, or None if missing or stale"""
+    if max_age is None:
+        max_age = wf.settings.get('state_max_age', STATE_MAX_AGE)
+    if max_age <= 0:
+        return None
+    try:
+        with open(state_path(wf, device_id), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # a state recorded while the listener has been up is kept current by events, so it can be trusted for longer
+    since = listener_since(wf)
+    if since and state['updated'] >= since:
+        max_age = max(max_age, wf.settings.get('event_state_max_age', EVENT_STATE_MAX_AGE))
+    if time.time() - state['updated'] < max_age:
+        return state['attributes']
+    return None
+
+def write_state(wf, device_id, attributes, merge=False):
+    path = state_path(wf, device_id)
+    with write_lock:
+        state = {'updated': time.time(), 'attributes': {}}
+        if merge:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    state['attributes'] = json.load(f)['attributes']
+            except (OSError, ValueError):
+                pass
+        state['attributes'].update(attributes)
+        with atomic_writer(path, 'w') as f:
+            json.dump(state, f)
+
+def drop_state(wf, device_id):
+    """Forget the stored attributes of a device, so the next lookup asks the hub"""
+    with write_lock:
+        try:
+            os.unlink(state_path(wf, device_id))
+        except OSError:
+            pass
+
+def apply_event(wf, event):
+    """Apply one Maker API event (the 'content' of a postURL post) to the store"""
+    if not event.get('deviceId') or not event.get('name'):
+        return False
+    device_id = str(event['deviceId'])
+    # only merge into devices we already have a full picture of
+    if not os.path.exists(state_path(wf, device_id)):
+        return False
+    write_state(wf, device_id, {event['name']: event.get('value')}, merge=True)
+    return True
+
+def local_ip_for(hub_ip):
+    # address of the interface this machine uses to reach the hub
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.connect((hub_ip.partition(':')[0], 80))
+        return sock.getsockname()[0]
+    finally:
+        sock.close()
+
+def serve_events(wf, port, hub_ip):
+    """Accept Maker API event posts from the hub at `hub_ip` on `port` until the process exits"""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    hub_host = hub_ip.partition(':')[0]
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.client_address[0] != hub_host:
+                # only the hub gets to change device states
+                wf.logger.debug('ignoring event from '+self.client_address[0])
+                self.send_response(403)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            try:
+                event = json.loads(body).get('content') or {}
+                wf.logger.debug('event: '+str(event))
+                apply_event(wf, event)
+            except (ValueError, AttributeError):
+                wf.logger.debug('ignoring malformed event: '+str(body))
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(HTTPServer):
+        beat = 0
+
+        def service_actions(self):
+            if time.time() - self.beat > HEARTBEAT:
+                self.beat = time.time()
+                os.utime(marker)
+
+    marker = os.path.join(state_dir(wf), LISTENER_FILE)
+    # listen only on the interface the hub posts to
+    server = Server((local_ip_for(hub_ip), port), Handler)
+    with atomic_writer(marker, 'w') as f:
+        f.write(str(time.time()))
+    wf.logger.info('listening for hub events on port '+str(port))
+    try:
+        server.serve_forever(poll_interval=1)
+    finally:
+        server.server_close()
+        stop_listener(wf)
+
+def stop_listener(wf):
+    marker = os.path.join(state_dir(wf), LISTENER_FILE)
+    if os.path.exists(marker):
+        os.unlink(marker)
+
+def start_listener(wf, port, hub_ip):
+    thread = threading.Thread(target=serve_events, args=(wf, port, hub_ip), daemon=True)
+    thread.start()
+    return thread
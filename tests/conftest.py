@@ -0,0 +1,21 @@
+# encoding: utf-8
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def wf(tmp_path, monkeypatch):
+    """A Workflow with its data and cache in a temporary directory"""
+    monkeypatch.setenv('alfred_workflow_bundleid', 'net.schwark.hubitat')
+    monkeypatch.setenv('alfred_workflow_name', 'Hubitat')
+    monkeypatch.setenv('alfred_workflow_version', '1.0')
+    monkeypatch.setenv('alfred_workflow_data', str(tmp_path / 'data'))
+    monkeypatch.setenv('alfred_workflow_cache', str(tmp_path / 'cache'))
+    from workflow import Workflow
+    return Workflow()
@@ -0,0 +1,133 @@
+# encoding: utf-8
+
+"""Credentials come from one `security` call, are kept in a private session file for SESSION_TTL, and items saved
+one per credential by earlier versions are moved into one"""
+
+import json
+import os
+import stat
+import sys
+import time
+
+import pytest
+
+import credentials
+from credentials import ACCOUNT, NAMES, SESSION_TTL, get_credential, save_credential, session_path
+from workflow import PasswordNotFound
+
+# a stand-in for macOS's `security`, keeping its items in a JSON file and logging every call
+SECURITY = '''#!%s
+import json, os, sys
+args = sys.argv[1:]
+action, service, account = args[0], args[args.index('-s') + 1], args[args.index('-a') + 1]
+with open(os.environ['KEYCHAIN_LOG'], 'a') as f:
+    f.write(json.dumps([action, account]) + '\\n')
+path = os.environ['KEYCHAIN']
+items = json.load(open(path)) if os.path.exists(path) else {}
+key = service + '/' + account
+if 'find-generic-password' == action:
+    if key not in items:
+        sys.exit(44)
+    sys.stderr.write('password: "%%s"\\n' %% items[key])
+elif 'add-generic-password' == action:
+    if key in items:
+        sys.exit(45)
+    items[key] = args[args.index('-w') + 1]
+elif 'delete-generic-password' == action:
+    if key not in items:
+        sys.exit(44)
+    del items[key]
+json.dump(items, open(path, 'w'))
+''' % sys.executable
+
+VALUES = {'hubitat_api_key': 'a1b2-c3d4', 'hubitat_mode': 'auto', 'hubitat_hub_id': 'abc-123',
+          'hubitat_hub_ip': '192.168.1.10'}
+
+
+class Keychain:
+    def __init__(self, path, log, service):
+        self.path, self.log, self.service = path, log, service
+
+    def set(self, items):
+        with open(self.path, 'w') as f:
+            json.dump({self.service+'/'+account: value for account, value in items.items()}, f)
+
+    def items(self):
+        with open(self.path) as f:
+            return {key.split('/', 1)[1]: value for key, value in json.load(f).items()}
+
+    def calls(self, action=None):
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log) as f:
+            calls = [tuple(json.loads(line)) for line in f]
+        return [call for call in calls if action is None or action == call[0]]
+
+
+@pytest.fixture
+def keychain(wf, tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    security = bin_dir / 'security'
+    security.write_text(SECURITY)
+    security.chmod(0o755)
+    monkeypatch.setenv('PATH', str(bin_dir)+os.pathsep+os.environ['PATH'])
+    monkeypatch.setenv('KEYCHAIN', str(tmp_path / 'keychain.json'))
+    monkeypatch.setenv('KEYCHAIN_LOG', str(tmp_path / 'security.log'))
+    return Keychain(str(tmp_path / 'keychain.json'), str(tmp_path / 'security.log'), wf.bundleid)
+
+
+def test_one_call_for_all_credentials(wf, keychain):
+    keychain.set({ACCOUNT: credentials.urlencode(VALUES)})
+    assert VALUES == {name: get_credential(wf, name) for name in NAMES}
+    assert [('find-generic-password', ACCOUNT)] == keychain.calls()
+    # readable and writable by the user only
+    assert 0o600 == stat.S_IMODE(os.stat(session_path(wf)).st_mode)
+
+
+def test_session_expires(wf, keychain):
+    keychain.set({ACCOUNT: credentials.urlencode(VALUES)})
+    get_credential(wf, 'hubitat_api_key')
+    old = time.time() - SESSION_TTL + 5
+    os.utime(session_path(wf), (old, old))
+    get_credential(wf, 'hubitat_hub_ip')
+    assert 1 == len(keychain.calls())
+    old = time.time() - SESSION_TTL - 1
+    os.utime(session_path(wf), (old, old))
+    assert 'abc-123' == get_credential(wf, 'hubitat_hub_id')
+    assert 2 == len(keychain.calls())
+    assert 0o600 == stat.S_IMODE(os.stat(session_path(wf)).st_mode)
+
+
+def test_missing_credential(wf, keychain):
+    keychain.set({ACCOUNT: credentials.urlencode({'hubitat_api_key': 'key'})})
+    with pytest.raises(PasswordNotFound):
+        get_credential(wf, 'hubitat_hub_ip')
+    with pytest.raises(PasswordNotFound):
+        get_credential(wf, 'hubitat_hub_id')
+    assert 1 == len(keychain.calls())
+
+
+def test_items_from_earlier_versions_are_moved(wf, keychain):
+    old = dict(VALUES)
+    del old['hubitat_hub_id']
+    keychain.set(old)
+    assert 'a1b2-c3d4' == get_credential(wf, 'hubitat_api_key')
+    assert [ACCOUNT] == list(keychain.items())
+    assert [ACCOUNT] + NAMES == [account for _, account in keychain.calls('find-generic-password')]
+    assert [('add-generic-password', ACCOUNT)] == keychain.calls('add-generic-password')
+    assert 3 == len(keychain.calls('delete-generic-password'))
+    # from then on, one call again
+    os.unlink(session_path(wf))
+    count = len(keychain.calls())
+    assert old == {name: get_credential(wf, name) for name in old}
+    assert count + 1 == len(keychain.calls())
+
+
+def test_saving_replaces_the_session(wf, keychain):
+    keychain.set({ACCOUNT: credentials.urlencode(VALUES)})
+    assert '192.168.1.10' == get_credential(wf, 'hubitat_hub_ip')
+    save_credential(wf, 'hubitat_hub_ip', '192.168.1.20')
+    assert '192.168.1.20' == get_credential(wf, 'hubitat_hub_ip')
+    assert 'a1b2-c3d4' == get_credential(wf, 'hubitat_api_key')
+    assert dict(VALUES, hubitat_hub_ip='192.168.1.20') == dict(credentials.parse_qsl(keychain.items()[ACCOUNT]))
@@ -0,0 +1,85 @@
+# encoding: utf-8
+
+"""forward() hands a search to the resident helper when it is free, and runs it in-process at once when it is busy"""
+
+import os
+import stat
+import threading
+import time
+
+import pytest
+
+import daemon
+
+
+class Scripts:
+    """Stand-in for daemon.run_script, holding each search until `release` is set"""
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, name, args, env):
+        self.calls.append(args)
+        self.started.set()
+        self.release.wait(5)
+        return 0, 'results for '+' '.join(args)
+
+
+@pytest.fixture
+def helper(wf, monkeypatch):
+    scripts = Scripts()
+    monkeypatch.setattr(daemon, 'run_script', scripts)
+    thread = threading.Thread(target=daemon.serve, args=(wf,), daemon=True)
+    thread.start()
+    path = daemon.socket_path(wf.cachedir)
+    deadline = time.time() + 5
+    while not (daemon.server and os.path.exists(path)) and time.time() < deadline:
+        time.sleep(0.01)
+    yield scripts
+    scripts.release.set()
+    daemon.stop(wf)
+    thread.join(5)
+
+
+def forward(monkeypatch, *args):
+    """What forward() printed and exited with, or None if it left the search to run in-process"""
+    import io
+    import sys
+    output = io.StringIO()
+    monkeypatch.setattr(sys, 'argv', ['filter.py'] + list(args))
+    monkeypatch.setattr(sys, 'stdout', output)
+    try:
+        daemon.forward('filter')
+    except SystemExit as e:
+        return e.code, output.getvalue()
+    return None
+
+
+def test_forwarded_to_the_helper(wf, helper, monkeypatch):
+    helper.release.set()
+    assert (0, 'results for porch') == forward(monkeypatch, 'porch')
+
+
+def test_busy_helper_is_not_waited_for(wf, helper, monkeypatch):
+    first = threading.Thread(target=forward, args=(monkeypatch, 'porch'))
+    first.start()
+    assert helper.started.wait(5)
+    start = time.time()
+    assert forward(monkeypatch, 'porch lamp') is None
+    assert time.time() - start < 10 * daemon.ACCEPT_TIMEOUT
+    helper.release.set()
+    first.join(5)
+    # the search given up on was never run by the helper
+    time.sleep(0.1)
+    assert [['porch']] == helper.calls
+
+
+def test_socket_is_private(wf, helper):
+    mode = stat.S_IMODE(os.stat(daemon.socket_path(wf.cachedir)).st_mode)
+    assert 0 == mode & 0o077
+
+
+def test_no_helper(wf, monkeypatch):
+    assert forward(monkeypatch, 'porch') is None
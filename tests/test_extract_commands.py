@@ -0,0 +1,69 @@
+# encoding: utf-8
+
+"""extract_commands makes of each query in extract_commands_corpus.json what the three-filter version it replaced did
+
+The corpus holds a set of devices and, for each query, the device, command and params the earlier extract_commands
+found, recorded by running it over the same devices. Its quirks are kept on purpose: a lower-case query that
+matches one device still loses its first word as the command, as before.
+"""
+
+import argparse
+import json
+import os
+
+import pytest
+
+import filter
+from search import build_device_index, get_commands
+
+CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extract_commands_corpus.json')
+
+with open(CORPUS_FILE, 'r', encoding='utf-8') as f:
+    CORPUS = json.load(f)
+
+
+@pytest.fixture(scope='module')
+def devices(tmp_path_factory):
+    from workflow import Workflow
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv('alfred_workflow_bundleid', 'net.schwark.hubitat')
+        monkeypatch.setenv('alfred_workflow_name', 'Hubitat')
+        monkeypatch.setenv('alfred_workflow_version', '1.0')
+        monkeypatch.setenv('alfred_workflow_data', str(tmp_path_factory.mktemp('data')))
+        monkeypatch.setenv('alfred_workflow_cache', str(tmp_path_factory.mktemp('cache')))
+        wf = Workflow()
+        yield wf, build_device_index(wf, CORPUS['devices'], get_commands(None, None))['entries']
+
+
+def parse(wf, devices, query, commands=None):
+    args, matched = filter.extract_commands(wf, argparse.Namespace(query=query), devices, commands)
+    return {'query': query, 'device': args.query, 'command': args.device_command, 'params': args.device_params}
+
+
+@pytest.mark.parametrize('case', CORPUS['cases'], ids=lambda case: case['query'] or '(empty)')
+def test_same_as_before(devices, case):
+    wf, entries = devices
+    assert case == parse(wf, entries, case['query'])
+
+
+@pytest.mark.parametrize('case', CORPUS['cases'], ids=lambda case: case['query'] or '(empty)')
+def test_same_from_stored_keys(devices, case):
+    # as the script filter searches, with the keys stored in the index
+    wf, entries = devices
+    filter.device_search.clear()
+    assert case == parse(wf, filter.get_device_search(wf, entries), case['query'])
+
+
+@pytest.mark.parametrize('case', [case for case in CORPUS['cases'] if case['command']],
+                         ids=lambda case: case['query'])
+def test_group_commands_leave_device_commands_alone(devices, case):
+    # commands for several devices at once are only looked for when no single device was found
+    wf, entries = devices
+    assert case == parse(wf, entries, case['query'], get_commands(None, None))
+
+
+def test_corpus_covers(devices):
+    cases = CORPUS['cases']
+    assert any(case['params'] for case in cases)
+    assert any(case['command'] and len(case['device'].split()) > 2 for case in cases)
+    assert any(not case['command'] for case in cases)
@@ -0,0 +1,67 @@
+# encoding: utf-8
+
+"""Feedback encoded straight to JSON is byte for byte what json.dumps(wf.obj) gives"""
+
+import json
+
+import pytest
+
+from workflow import ICON_SWITCH, ICON_WEB
+from workflow.workflow import Item
+
+
+def add_device_items(wf, count):
+    """Items like those filter.py shows for a list of devices"""
+    for i in range(count):
+        label = 'Living Room Lamp %d' % i if i % 3 else 'Café Outlet %d' % i
+        wf.add_item(title=label,
+                    subtitle='Turn '+label+' on',
+                    arg=' --device-uid '+str(i)+' --device-command on --device-params ',
+                    autocomplete=label,
+                    valid=bool(i % 2),
+                    icon='icons/light.png' if i % 4 else ICON_SWITCH)
+
+
+def test_device_items(wf):
+    add_device_items(wf, 50)
+    assert wf._json() == json.dumps(wf.obj)
+
+
+def test_every_field(wf):
+    wf.add_item('Title "quoted" \\ back', 'Sub\ttitle\n', arg=['a', 'b'], autocomplete='auto', valid=True,
+                uid='uid-1', icon='icon.png', icontype='fileicon', type='file', largetext='large',
+                copytext='copy', quicklookurl='https://example.com', match='match words')
+    wf.add_item('Unicode ☃ é  ', icon=ICON_WEB, icontype='filetype')
+    wf.add_item('Empty')
+    assert wf._json() == json.dumps(wf.obj)
+
+
+def test_modifiers_and_variables(wf):
+    item = wf.add_item('With modifiers', arg='x', valid=True)
+    item.setvar('device', '1')
+    item.add_modifier('cmd', subtitle='Cmd subtitle', arg='cmd-arg', valid=True)
+    mod = item.add_modifier('alt', subtitle='Alt', icon='alt.png', icontype='fileicon')
+    mod.setvar('alt', 'on')
+    item.config['key'] = 'value'
+    wf.setvar('shared', 'yes')
+    wf.add_item('Inherits the workflow variables')
+    wf.rerun = 0.5
+    assert wf._json() == json.dumps(wf.obj)
+
+
+def test_obj_overrides_are_used(wf):
+    class Custom(Item):
+        @property
+        def obj(self):
+            return {'title': 'custom', 'extra': [1, 2]}
+
+    wf._items.append(Custom('ignored', ''))
+    add_device_items(wf, 2)
+    assert wf._json() == json.dumps(wf.obj)
+
+
+@pytest.mark.parametrize('count', [0, 1, 1000])
+def test_sent_feedback(wf, capsys, count):
+    add_device_items(wf, count)
+    sent = wf.send_feedback()
+    assert capsys.readouterr().out == sent == json.dumps(wf.obj)
@@ -0,0 +1,136 @@
+# encoding: utf-8
+
+"""Filtering a FilterIndex gives exactly what filtering its items does"""
+
+import json
+import random
+
+import pytest
+
+from workflow.workflow import FilterIndex
+from workflow import (
+    MATCH_ALL,
+    MATCH_ALLCHARS,
+    MATCH_ATOM,
+    MATCH_CAPITALS,
+    MATCH_INITIALS,
+    MATCH_INITIALS_CONTAIN,
+    MATCH_INITIALS_STARTSWITH,
+    MATCH_STARTSWITH,
+    MATCH_SUBSTRING,
+)
+
+RULES = [MATCH_STARTSWITH, MATCH_CAPITALS, MATCH_ATOM, MATCH_INITIALS_STARTSWITH,
+         MATCH_INITIALS_CONTAIN, MATCH_SUBSTRING, MATCH_ALLCHARS]
+MATCH_ONS = [MATCH_ALL, MATCH_ALL ^ MATCH_ALLCHARS, MATCH_STARTSWITH | MATCH_SUBSTRING,
+             MATCH_STARTSWITH | MATCH_ATOM | MATCH_SUBSTRING, MATCH_INITIALS, MATCH_CAPITALS] + RULES
+
+WORDS = ['Living', 'Room', 'Lamp', 'Café', 'Outlet', 'Den', 'Shade', 'Kitchen', 'Über', 'Garage',
+         'Door', 'Front', 'Porch', 'Light', 'Thermostat', 'Office', 'Bedroom', 'Fan', 'Señor', 'Hall']
+
+
+def make_items(count, seed=1):
+    rng = random.Random(seed)
+    items = []
+    for i in range(count):
+        label = ' '.join(rng.sample(WORDS, rng.randint(1, 3)))
+        if rng.random() < 0.3:
+            label += ' ' + str(i)
+        if rng.random() < 0.1:
+            label = label.replace(' ', rng.choice(['-', '.', "'"]))
+        items.append({'id': str(i), 'label': label})
+    # an empty key is never matched
+    items.append({'id': 'empty', 'label': ''})
+    return items
+
+
+def make_queries(items, seed=2):
+    rng = random.Random(seed)
+    queries = ['', ' ', 'l', 'lr', 'lamp', 'LAMP', 'cafe', 'café', 'uber', 'über', 'den sh', 'rm',
+               'xyz', 'ooo', 'ght', 'f', 'ss', '1', '12', 'señ']
+    for _ in range(60):
+        label = rng.choice(items)['label']
+        if not label:
+            continue
+        start = rng.randint(0, len(label) - 1)
+        queries.append(label[start:start + rng.randint(1, 6)].lower())
+    return queries
+
+
+@pytest.fixture(scope='module')
+def corpus():
+    items = make_items(300)
+    return items, make_queries(items)
+
+
+def key(item):
+    return item['label']
+
+
+@pytest.mark.parametrize('postings', [True, False], ids=['postings', 'scan'])
+@pytest.mark.parametrize('match_on', MATCH_ONS)
+def test_filter_parity(wf, corpus, match_on, postings):
+    items, queries = corpus
+    index = wf.filter_index(items, key, postings=postings)
+    for query in queries:
+        for fold in (True, False):
+            expected = wf.filter(query, items, key, include_score=True, match_on=match_on, fold_diacritics=fold)
+            actual = wf.filter(query, index, include_score=True, match_on=match_on, fold_diacritics=fold)
+            assert actual == expected, (query, match_on, fold)
+
+
+@pytest.mark.parametrize('options', [
+    {'min_score': 80},
+    {'max_results': 5},
+    {'ascending': True},
+    {'ascending': True, 'max_results': 3, 'min_score': 50},
+])
+def test_filter_options_parity(wf, corpus, options):
+    items, queries = corpus
+    index = wf.filter_index(items, key)
+    for query in queries:
+        assert wf.filter(query, index, **options) == wf.filter(query, items, key, **options), (query, options)
+
+
+@pytest.mark.parametrize('match_on', [MATCH_ALL, MATCH_STARTSWITH | MATCH_SUBSTRING | MATCH_ATOM])
+def test_filter_prefixes_parity(wf, corpus, match_on):
+    items, queries = corpus
+    index = wf.filter_index(items, key)
+    for query in ['living room lamp on', 'den shade 12 open', 'cafe outlet toggle', 'porch', 'x y z']:
+        words = query.split()
+        drop = tuple(range(len(words)))
+        expected = wf.filter_prefixes(words, items, key, drop=drop, include_score=True, match_on=match_on)
+        assert wf.filter_prefixes(words, index, drop=drop, include_score=True, match_on=match_on) == expected
+        # and each list is what filter gives for that part of the query
+        for n, results in zip(drop, expected):
+            part = ' '.join(words[:len(words) - n])
+            assert results == wf.filter(part, items, key, include_score=True, match_on=match_on)
+
+
+def test_index_reused_across_queries(wf, corpus):
+    items, queries = corpus
+    index = wf.filter_index(items, key)
+    # postings built for one query must not change the results of the next
+    first = [wf.filter(query, index) for query in queries]
+    second = [wf.filter(query, index) for query in reversed(queries)]
+    assert first == list(reversed(second))
+
+
+def ids(results):
+    # the stored items are copies, so compare them by id - an empty query gives the items without scores
+    return [(r[0]['id'],) + r[1:] if isinstance(r, tuple) else r['id'] for r in results]
+
+
+@pytest.mark.parametrize('postings', [True, False], ids=['postings', 'scan'])
+@pytest.mark.parametrize('match_on', [MATCH_ALL, MATCH_STARTSWITH | MATCH_SUBSTRING | MATCH_ATOM])
+def test_prepared_keys_parity(wf, corpus, match_on, postings):
+    items, queries = corpus
+    # keys worked out ahead of time and stored as JSON, as the device search index keeps them
+    stored = [dict(item, search=FilterIndex.prepare(key(item))) for item in items]
+    stored = json.loads(json.dumps(stored))
+    index = wf.filter_index(stored, prepared=lambda item: item['search'], postings=postings)
+    for query in queries:
+        for fold in (True, False):
+            expected = wf.filter(query, items, key, include_score=True, match_on=match_on, fold_diacritics=fold)
+            actual = wf.filter(query, index, include_score=True, match_on=match_on, fold_diacritics=fold)
+            assert ids(actual) == ids(expected), (query, match_on, fold)
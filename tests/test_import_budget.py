@@ -0,0 +1,103 @@
+# encoding: utf-8
+
+"""Cold start of filter.py for a query whose results are saved leaves out the modules import_budget.json lists
+
+How long its imports take depends on the machine and how busy it is, so it is checked against the budget's
+cached_query_ms by bench/import_time.py rather than here.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import ROOT
+
+BUDGET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'import_budget.json')
+QUERY = 'porch'
+# runs timed, the fastest one counting
+RUNS = 3
+
+
+def load_budget():
+    with open(BUDGET_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def parse_importtime(output):
+    """(module, cumulative microseconds, nested) for each line `python -X importtime` writes"""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line.split(':', 1)[1].split('|')
+        rows.append((name.strip(), int(cumulative), name.startswith('  ')))
+    return rows
+
+
+def prepare(env):
+    """Store a few devices and credentials, then run the query once so its results are saved"""
+    os.makedirs(env['alfred_workflow_data'])
+    os.makedirs(env['alfred_workflow_cache'])
+    with open(os.path.join(env['alfred_workflow_cache'], 'credentials.json'), 'w', encoding='utf-8') as f:
+        json.dump({'hubitat_api_key': 'KEY', 'hubitat_mode': 'local', 'hubitat_hub_ip': '127.0.0.1:1'}, f)
+    setup = '\n'.join([
+        'import time, common',
+        'from workflow import Workflow',
+        'wf = Workflow()',
+        'common.store_devices(wf, [',
+        '    {"id": "1", "label": "Porch Lamp", "type": "Generic Switch", "capabilities": ["Switch", "Light"]},',
+        '    {"id": "2", "label": "Porch Shade", "type": "Shade", "capabilities": ["WindowShade"]}])',
+        # fresh devices and a recent update check, so nothing is started in the background
+        'common.write_inventory(wf, updated=time.time())',
+        'wf.cache_data("__workflow_latest_version", {"available": False})',
+    ])
+    subprocess.run([sys.executable, '-c', setup], cwd=ROOT, env=env, check=True)
+    return run_query(env)
+
+
+def run_query(env, *options):
+    result = subprocess.run([sys.executable] + list(options) + ['filter.py', QUERY], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True)
+    return result.stdout, result.stderr
+
+
+def cached_query_imports(tmp_path):
+    """Import timings of the fastest of a few cold starts serving saved results, and their output"""
+    # what Alfred sets for every run
+    env = dict(os.environ,
+               alfred_workflow_bundleid='net.schwark.hubitat',
+               alfred_workflow_name='Hubitat',
+               alfred_workflow_version='1.0',
+               alfred_workflow_data=str(tmp_path / 'data'),
+               alfred_workflow_cache=str(tmp_path / 'cache'))
+    env.pop('alfred_debug', None)
+    first, _ = prepare(env)
+    best = None
+    for _ in range(RUNS):
+        output, importtime = run_query(env, '-X', 'importtime')
+        rows = parse_importtime(importtime)
+        total = sum(cumulative for name, cumulative, nested in rows if not nested)
+        if best is None or total < best[0]:
+            best = (total, rows, output)
+    return best[1], first, best[2]
+
+
+@pytest.fixture(scope='module')
+def imports(tmp_path_factory):
+    return cached_query_imports(tmp_path_factory.mktemp('budget'))
+
+
+def test_cached_query_is_served(imports):
+    rows, first, cached = imports
+    assert json.loads(cached)['items']
+    assert cached == first
+
+
+def test_cached_query_skips_modules(imports):
+    rows, first, cached = imports
+    imported = {name for name, cumulative, nested in rows}
+    assert [name for name in load_budget()['not_imported'] if name in imported] == []
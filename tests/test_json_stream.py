@@ -0,0 +1,70 @@
+# encoding: utf-8
+
+"""iter_json_array gives what json.loads does for a JSON array however its bytes are split, and rejects anything else"""
+
+import json
+
+import pytest
+
+from common import iter_json_array
+
+DOCUMENT = json.dumps([
+    {'id': '1', 'label': 'Living Room Lamp', 'attributes': {'switch': 'on', 'level': 75}, 'capabilities': ['Switch']},
+    {'id': '2', 'label': 'Café "Corner" \\ Outlet', 'attributes': {}, 'capabilities': []},
+    {'id': '3', 'label': 'Snow ☃ and \U0001f600', 'note': 'commas, ] and [ brackets } inside', 'temp': -12.5e+3},
+    [1, [2, [3, []]], {}],
+    'plain string', 0, -7, 3.25, 1e-5, True, False, None,
+], ensure_ascii=False).encode('utf-8')
+# the same with \\u escapes and whitespace everywhere it is allowed
+ESCAPED = json.dumps(json.loads(DOCUMENT), indent=3).encode('ascii')
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('data', [DOCUMENT, ESCAPED], ids=['utf-8', 'escaped'])
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 64, 100000])
+def test_chunk_sizes(data, size):
+    assert json.loads(data) == list(iter_json_array(split(data, size)))
+
+
+@pytest.mark.parametrize('data', [DOCUMENT, ESCAPED], ids=['utf-8', 'escaped'])
+def test_every_boundary(data):
+    # every split of the bytes in two: inside strings, escapes, multi-byte characters, numbers and literals
+    expected = json.loads(data)
+    for i in range(len(data) + 1):
+        assert expected == list(iter_json_array([data[:i], data[i:]])), data[:i]
+
+
+def test_elements_arrive_as_they_complete():
+    chunks = [b'[{"id": "1"}, {"id"', b': "2"}', b', 3', b'4]']
+    read = []
+
+    def source():
+        for chunk in chunks:
+            read.append(chunk)
+            yield chunk
+
+    # each element as soon as the ',' or ']' after it has been read, as a number may carry on in the next chunk
+    assert [({'id': '1'}, 1), ({'id': '2'}, 3), (34, 4)] == [(value, len(read)) for value in iter_json_array(source())]
+
+
+@pytest.mark.parametrize('data', [b'[]', b' [ ] ', b'\n[\r\n\t]\n', b'[[]]', b'[{}]'])
+@pytest.mark.parametrize('size', [1, 100])
+def test_empty(data, size):
+    assert json.loads(data) == list(iter_json_array(split(data, size)))
+
+
+def test_no_chunks():
+    with pytest.raises(ValueError):
+        list(iter_json_array([]))
+
+
+@pytest.mark.parametrize('data', [b'', b'   ', b'{}', b'"text"', b'1', b'[', b'[1', b'[1,', b'[1,]', b'[,1]',
+                                  b'[,]', b'[1,,2]', b'[1 2]', b'[1]x', b'[1] [2]', b'[1]]', b']', b'[x]',
+                                  b'["open]', b'[{"a": 1]', b'[tru]'])
+@pytest.mark.parametrize('size', [1, 100])
+def test_malformed(data, size):
+    with pytest.raises(ValueError):
+        list(iter_json_array(split(data, size)))
@@ -0,0 +1,43 @@
+# encoding: utf-8
+
+"""get_mode probes the hub once per reachability_ttl, or on every call when it is 0"""
+
+import pytest
+
+import common
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    calls = []
+    monkeypatch.setattr(common, 'probe_hub', lambda ip: calls.append(ip) or '10.0.0.2' == ip)
+    return calls
+
+
+def test_mode_is_reused(wf, probes):
+    assert ['local', 'local'] == [common.get_mode(wf, '10.0.0.2') for _ in range(2)]
+    assert ['10.0.0.2'] == probes
+
+
+def test_new_ip_is_probed(wf, probes):
+    assert 'local' == common.get_mode(wf, '10.0.0.2')
+    assert 'cloud' == common.get_mode(wf, '10.0.0.3')
+    assert ['10.0.0.2', '10.0.0.3'] == probes
+
+
+def test_invalidated_mode_is_probed_again(wf, probes):
+    common.get_mode(wf, '10.0.0.2')
+    common.invalidate_mode(wf)
+    common.get_mode(wf, '10.0.0.2')
+    assert 2 == len(probes)
+
+
+def test_ttl_of_zero_always_probes(wf, probes):
+    wf.settings['reachability_ttl'] = 0
+    assert ['local'] * 3 == [common.get_mode(wf, '10.0.0.2') for _ in range(3)]
+    assert 3 == len(probes)
+
+
+def test_no_ip_is_cloud(wf, probes):
+    assert 'cloud' == common.get_mode(wf, None)
+    assert [] == probes
@@ -0,0 +1,84 @@
+# encoding: utf-8
+
+"""Device records stored with the 'records' serializer read back as they were written, and a devices datastore
+saved whole by earlier versions is converted to them"""
+
+import io
+import os
+
+import pytest
+
+import common
+import records
+from records import RecordSerializer
+
+# devices/all as the hub answers it, states and all
+DEVICES = [
+    {'id': '1', 'name': 'Generic Zigbee Bulb', 'label': 'Living Room Lamp', 'type': 'Generic Zigbee Bulb',
+     'room': 'Living Room', 'capabilities': ['Switch', 'SwitchLevel', 'Light'], 'commands': ['on', 'off', 'setLevel'],
+     'attributes': {'switch': 'on', 'level': 75}},
+    {'id': '2', 'name': 'Thermostat', 'label': 'Café Thermostat ☃', 'type': 'Generic Z-Wave Thermostat',
+     'capabilities': ['Thermostat'], 'commands': ['setThermostatMode'],
+     'attributes': {'thermostatMode': 'heat', 'temperature': 68.5, 'supportedThermostatModes': '[heat, off]'}},
+    {'id': '3', 'label': 'Good Night', 'type': 'Scene Activator', 'capabilities': ['Switch'], 'attributes': {}},
+]
+
+
+@pytest.fixture(autouse=True)
+def fresh_memo(monkeypatch):
+    # datastores loaded by earlier tests must not be served from memory
+    monkeypatch.setattr(common, 'stored_data_memo', {})
+
+
+def round_trip(obj):
+    buf = io.BytesIO()
+    RecordSerializer.dump(obj, buf)
+    buf.seek(0)
+    return RecordSerializer.load(buf)
+
+
+@pytest.mark.parametrize('obj', [
+    [],
+    [{}],
+    [{'id': '1', 'label': 'Lamp'}],
+    [{'id': '1', 'n': 1, 'f': 1.5, 'b': True, 'none': None, 'list': ['a', 1], 'dict': {'k': [1, 2]}, 'text': 'é ☃ \U0001f600'}],
+    [common.device_record(device) for device in DEVICES],
+], ids=['empty', 'empty record', 'one', 'types', 'devices'])
+def test_round_trip(obj):
+    assert obj == round_trip(obj)
+
+
+def test_missing_fields_read_back_as_none():
+    assert [{'a': 1, 'b': None}, {'a': None, 'b': 2}] == round_trip([{'a': 1}, {'b': 2}])
+
+
+def test_field_names_written_once():
+    many = [{'identifier': str(i), 'description': 'x'} for i in range(1000)]
+    buf = io.BytesIO()
+    RecordSerializer.dump(many, buf)
+    assert 1 == buf.getvalue().count(b'description')
+
+
+def test_datastore(wf):
+    devices = [common.device_record(device) for device in DEVICES]
+    wf.store_data('devices', devices, serializer=records.SERIALIZER)
+    assert os.path.exists(wf.datafile('devices.records'))
+    assert devices == wf.stored_data('devices')
+    assert devices == common.load_devices(wf)
+
+
+@pytest.mark.parametrize('serializer', ['pickle', 'json'])
+def test_earlier_datastore_is_converted(wf, serializer):
+    wf.store_data('devices', DEVICES, serializer=serializer)
+    devices = common.load_devices(wf)
+    assert [{field: device[field] for field in common.DEVICE_FIELDS if field in device} for device in DEVICES] == devices
+    assert not os.path.exists(wf.datafile('devices.'+serializer))
+    assert records.SERIALIZER == common.datastore_version(wf, 'devices')[0]
+    assert {'1': {'commands': ['on', 'off', 'setLevel']},
+            '2': {'commands': ['setThermostatMode'], 'supportedThermostatModes': '[heat, off]'},
+            '3': {}} == common.get_stored_data(wf, 'device_details')
+    # converted once only
+    version = common.datastore_version(wf, 'devices')
+    assert devices == common.load_devices(wf)
+    assert version == common.datastore_version(wf, 'devices')
+
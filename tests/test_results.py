@@ -0,0 +1,64 @@
+# encoding: utf-8
+
+"""filter.py saves its results by query, except for queries offering config items, which may carry an API key"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+
+@pytest.fixture
+def env(tmp_path):
+    env = dict(os.environ,
+               alfred_workflow_bundleid='net.schwark.hubitat',
+               alfred_workflow_name='Hubitat',
+               alfred_workflow_version='1.0',
+               alfred_workflow_data=str(tmp_path / 'data'),
+               alfred_workflow_cache=str(tmp_path / 'cache'))
+    env.pop('alfred_debug', None)
+    os.makedirs(env['alfred_workflow_cache'])
+    # the session file credentials are read from, so that `security` isn't needed
+    with open(os.path.join(env['alfred_workflow_cache'], 'credentials.json'), 'w', encoding='utf-8') as f:
+        json.dump({'hubitat_api_key': 'KEY', 'hubitat_mode': 'local', 'hubitat_hub_ip': '127.0.0.1:1'}, f)
+    setup = '\n'.join([
+        'import time, common',
+        'from workflow import Workflow',
+        'wf = Workflow()',
+        'common.store_devices(wf, [{"id": "1", "label": "Porch Lamp", "type": "Generic Switch", "capabilities": ["Switch"]}])',
+        'common.write_inventory(wf, updated=time.time())',
+        'wf.cache_data("__workflow_latest_version", {"available": False})',
+    ])
+    subprocess.run([sys.executable, '-c', setup], cwd=ROOT, env=env, check=True)
+    return env
+
+
+def saved(env):
+    path = os.path.join(env['alfred_workflow_cache'], 'results')
+    if not os.path.exists(path):
+        return []
+    contents = []
+    for name in os.listdir(path):
+        with open(os.path.join(path, name), 'r', encoding='utf-8') as f:
+            contents.append(f.read())
+    return contents
+
+
+def run_filter(env, query):
+    return subprocess.run([sys.executable, 'filter.py', query], cwd=ROOT, env=env, check=True,
+                          capture_output=True, text=True).stdout
+
+
+def test_device_results_are_saved(env):
+    output = run_filter(env, 'porch')
+    assert [output] == saved(env)
+
+
+@pytest.mark.parametrize('query', ['apikey a1b2-c3d4-secret', 'hubid a1b2-c3d4-secret', 'ip a1b2-c3d4-secret'])
+def test_config_results_are_not_saved(env, query):
+    assert 'a1b2-c3d4-secret' in run_filter(env, query)
+    assert not any('a1b2-c3d4-secret' in content for content in saved(env))
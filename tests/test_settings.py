@@ -0,0 +1,83 @@
+# encoding: utf-8
+
+"""Settings transactions, and settings.json under many processes reading and writing at once"""
+
+import json
+import multiprocessing
+
+import pytest
+
+from workflow.workflow import Settings
+
+WRITERS = 8
+READERS = 8
+WRITES = 20
+READS = 200
+
+
+def write_settings(path, writer):
+    for n in range(WRITES):
+        with Settings(path).transaction() as settings:
+            settings['count'] = settings.get('count', 0) + 1
+            settings['writer%d' % writer] = n
+
+
+def read_settings(path):
+    for _ in range(READS):
+        settings = Settings(path)
+        # every read sees a whole file, with as many writes counted as writers recorded
+        count = settings['count']
+        assert isinstance(count, int)
+        assert count >= sum(settings.get('writer%d' % i, -1) + 1 for i in range(WRITERS))
+
+
+def test_concurrent_readers_and_writers(tmp_path):
+    path = str(tmp_path / 'settings.json')
+    Settings(path, {'count': 0})
+    processes = ([multiprocessing.Process(target=write_settings, args=(path, i)) for i in range(WRITERS)]
+                 + [multiprocessing.Process(target=read_settings, args=(path,)) for _ in range(READERS)])
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0] * len(processes)
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    # no write was lost
+    assert data['count'] == WRITERS * WRITES
+    assert all(data['writer%d' % i] == WRITES - 1 for i in range(WRITERS))
+
+
+def test_transaction_writes_once(tmp_path, monkeypatch):
+    path = str(tmp_path / 'settings.json')
+    settings = Settings(path, {'a': 1})
+    writes = []
+    write = Settings._write
+    monkeypatch.setattr(Settings, '_write', lambda self: writes.append(1) or write(self))
+    with settings.transaction() as s:
+        s['a'] = 2
+        s.update(b=3)
+        s.setdefault('c', 4)
+        del s['b']
+    assert len(writes) == 1
+    assert Settings(path) == {'a': 2, 'c': 4}
+
+
+def test_transaction_keeps_changes_saved_elsewhere(tmp_path):
+    path = str(tmp_path / 'settings.json')
+    settings = Settings(path, {'a': 1})
+    Settings(path)['b'] = 2
+    with settings.transaction() as s:
+        s['c'] = 3
+    assert Settings(path) == {'a': 1, 'b': 2, 'c': 3}
+
+
+def test_failed_transaction_writes_nothing(tmp_path):
+    path = str(tmp_path / 'settings.json')
+    settings = Settings(path, {'a': 1})
+    with pytest.raises(RuntimeError):
+        with settings.transaction() as s:
+            s['a'] = 2
+            raise RuntimeError()
+    assert settings == {'a': 1}
+    assert Settings(path) == {'a': 1}
@@ -0,0 +1,192 @@
+# encoding: utf-8
+
+"""Events posted to the listener update the device state store, which confirm_attribute watches while it runs"""
+
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import common
+import states
+from states import EVENT_STATE_MAX_AGE, STATE_MAX_AGE, LISTENER_FILE, read_state, write_state, state_path, state_dir
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_listener(wf, hub_ip):
+    """Start serve_events on a free port and wait until it accepts posts"""
+    port = free_port()
+    states.start_listener(wf, port, hub_ip)
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            if states.listener_since(wf):
+                return port
+        except OSError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError('event listener did not start')
+
+
+def post_event(port, event):
+    """POST an event the way the hub's postURL does, returning the status"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    try:
+        conn.request('POST', '/', json.dumps({'content': event}), {'Content-Type': 'application/json'})
+        return conn.getresponse().status
+    finally:
+        conn.close()
+
+
+def age_state(wf, device_id, seconds):
+    # as if the state had been written `seconds` ago, while the listener has been up for longer still
+    with open(os.path.join(state_dir(wf), LISTENER_FILE), 'w', encoding='utf-8') as f:
+        f.write(str(time.time() - 2 * EVENT_STATE_MAX_AGE))
+    with open(state_path(wf, device_id), 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    state['updated'] = time.time() - seconds
+    with open(state_path(wf, device_id), 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+
+
+@pytest.fixture
+def hub(wf):
+    """Port of a listener taking events from this machine as the hub"""
+    return start_listener(wf, '127.0.0.1')
+
+
+def test_event_is_applied_then_expires(wf, hub):
+    write_state(wf, '1', {'switch': 'off', 'level': 50})
+    assert 200 == post_event(hub, {'deviceId': 1, 'name': 'switch', 'value': 'on'})
+    assert {'switch': 'on', 'level': 50} == read_state(wf, '1')
+    # kept current by events, so trusted for longer than a state from a status call
+    age_state(wf, '1', EVENT_STATE_MAX_AGE - 5)
+    assert {'switch': 'on', 'level': 50} == read_state(wf, '1')
+    age_state(wf, '1', EVENT_STATE_MAX_AGE + 1)
+    assert read_state(wf, '1') is None
+
+
+def test_state_from_before_the_listener_expires_sooner(wf, hub):
+    write_state(wf, '1', {'switch': 'off'})
+    with open(state_path(wf, '1'), 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    state['updated'] = states.listener_since(wf) - STATE_MAX_AGE
+    with open(state_path(wf, '1'), 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    assert read_state(wf, '1') is None
+
+
+def test_event_for_unknown_device_is_ignored(wf, hub):
+    assert 200 == post_event(hub, {'deviceId': 2, 'name': 'switch', 'value': 'on'})
+    assert not os.path.exists(state_path(wf, '2'))
+
+
+def test_malformed_event_is_ignored(wf, hub):
+    write_state(wf, '1', {'switch': 'off'})
+    conn = http.client.HTTPConnection('127.0.0.1', hub, timeout=5)
+    conn.request('POST', '/', b'not json')
+    assert 200 == conn.getresponse().status
+    conn.close()
+    assert {'switch': 'off'} == read_state(wf, '1')
+
+
+def test_only_the_hub_may_post(wf, monkeypatch):
+    # the listener binds to the address this machine reaches the hub from, which posts don't come from here
+    monkeypatch.setattr(states, 'local_ip_for', lambda hub_ip: '127.0.0.1')
+    port = start_listener(wf, '127.0.0.2')
+    write_state(wf, '1', {'switch': 'off'})
+    assert 403 == post_event(port, {'deviceId': 1, 'name': 'switch', 'value': 'on'})
+    assert {'switch': 'off'} == read_state(wf, '1')
+
+
+class Hub:
+    """Stand-in for hubitat_api answering devices/<id> with the next of `values` for the switch"""
+
+    def __init__(self, values):
+        self.values = list(values)
+        self.calls = []
+
+    def __call__(self, wf, api_key, hub_id, hub_ip, url, data=None, idempotent=False):
+        self.calls.append(url)
+        value = self.values.pop(0) if len(self.values) > 1 else self.values[0]
+        return {'id': '1', 'attributes': [{'name': 'switch', 'currentValue': value}]}
+
+
+def test_confirm_watches_events(wf, hub, monkeypatch):
+    api = Hub(['off'])
+    monkeypatch.setattr(common, 'hubitat_api', api)
+    write_state(wf, '1', {'switch': 'off'})
+    timer = threading.Timer(0.2, post_event, (hub, {'deviceId': '1', 'name': 'switch', 'value': 'on'}))
+    timer.start()
+    confirmed, attributes = common.confirm_attribute(wf, 'key', None, '127.0.0.1', '1', 'switch', 'on', 5)
+    timer.join()
+    assert confirmed
+    assert {'switch': 'on'} == attributes
+    assert [] == api.calls
+
+
+def test_confirm_asks_the_hub_once_when_the_event_is_lost(wf, hub, monkeypatch):
+    api = Hub(['on'])
+    monkeypatch.setattr(common, 'hubitat_api', api)
+    write_state(wf, '1', {'switch': 'off'})
+    confirmed, attributes = common.confirm_attribute(wf, 'key', None, '127.0.0.1', '1', 'switch', 'on', 0.3)
+    assert confirmed
+    assert ['/devices/1'] == api.calls
+
+
+def test_confirm_polls_without_events(wf, monkeypatch):
+    api = Hub(['off', 'off', 'on'])
+    monkeypatch.setattr(common, 'hubitat_api', api)
+    write_state(wf, '1', {'switch': 'off'})
+    confirmed, attributes = common.confirm_attribute(wf, 'key', None, '127.0.0.1', '1', 'switch', 'on', 5)
+    assert confirmed
+    assert ['/devices/1'] * 3 == api.calls
+    # every poll went to the hub and was stored
+    assert {'switch': 'on'} == read_state(wf, '1')
+
+
+def test_confirm_from_the_reply(wf, monkeypatch):
+    api = Hub(['off'])
+    monkeypatch.setattr(common, 'hubitat_api', api)
+    reply = {'id': '1', 'attributes': [{'name': 'switch', 'currentValue': 'on'}]}
+    assert (True, {'switch': 'on'}) == common.confirm_attribute(wf, 'key', None, '127.0.0.1', '1', 'switch', 'on', 5, reply)
+    assert [] == api.calls
+
+
+class Switch:
+    """Stand-in for hubitat_api for a switch that answers commands with its new state"""
+
+    def __init__(self, value):
+        self.value = value
+        self.calls = []
+
+    def __call__(self, wf, api_key, hub_id, hub_ip, url, data=None, idempotent=False):
+        self.calls.append(url)
+        if url.startswith('devices/1/'):
+            self.value = url.rpartition('/')[2]
+        return {'id': '1', 'attributes': [{'name': 'switch', 'currentValue': self.value}]}
+
+
+def test_toggle_twice_switches_back(wf, monkeypatch):
+    import command
+    switch = Switch('off')
+    monkeypatch.setattr(common, 'hubitat_api', switch)
+    monkeypatch.setattr(command, 'hubitat_api', switch)
+    monkeypatch.setattr(command, 'log', wf.logger)
+    common.store_devices(wf, [{'id': '1', 'label': 'Lamp', 'capabilities': ['Switch']}])
+    commands = {name: {'capability': 'Switch', 'command': name, 'attribute': 'switch'} for name in ['on', 'off', 'toggle']}
+    # showing the device stores its state
+    common.device_status(wf, 'key', None, '127.0.0.1', '1')
+    sent = [command.run_device_command(wf, 'key', None, '127.0.0.1', '1', 'toggle', commands)[1] for _ in range(2)]
+    assert ['on', 'off'] == sent
+    assert {'switch': 'off'} == read_state(wf, '1')
@@ -0,0 +1,395 @@
+# encoding: utf-8
+
+"""workflow.web against a local HTTP server: pooled keep-alive connections, what is sent again when they drop,
+reading gzipped bodies a bounded chunk at a time, and the asyncio client"""
+
+import asyncio
+import gzip
+import http.client
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from workflow import web
+
+BODY = b''.join(b'{"id": "%d", "label": "Lamp %d"}\n' % (i, i) for i in range(2000))
+# expands over a thousand times when decompressed
+ZEROS = bytes(1000000)
+API = '/apps/api/5/'
+API_DELAY = 0.3
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        with self.server.lock:
+            self.server.hits.append(url.path)
+            hits = self.server.hits.count(url.path)
+        if url.path.startswith(API):
+            return self.route_api(url.path[len(API):], query)
+        getattr(self, 'route_'+url.path.strip('/').replace('-', '_'), self.route_missing)(query, hits)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, status=200, headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunked(self, body, size, headers=()):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        for i in range(0, len(body), size):
+            chunk = body[i:i + size]
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+    def route_ok(self, query, hits):
+        self.send_body(b'{"ok": true}')
+
+    def route_missing(self, query, hits):
+        self.send_body(b'{"error": "not found"}', 404)
+
+    def route_close_after(self, query, hits):
+        # answers as if the connection stayed open, then closes it, as an idle timeout does
+        self.send_body(b'{"ok": true}')
+        self.close_connection = True
+
+    def route_body(self, query, hits):
+        # BODY, in chunks of `chunk` bytes if given, gzipped if `gzip` is set
+        body = gzip.compress(BODY) if query.get('gzip') else BODY
+        headers = [('Content-Encoding', 'gzip')] if query.get('gzip') else []
+        if query.get('chunk'):
+            self.send_chunked(body, int(query['chunk']), headers)
+        else:
+            self.send_body(body, headers=headers)
+
+    def route_zeros(self, query, hits):
+        self.send_body(gzip.compress(ZEROS), headers=[('Content-Encoding', 'gzip')])
+
+    def route_slow(self, query, hits):
+        time.sleep(1)
+        self.send_body(b'{"ok": true}')
+
+    def route_garbage(self, query, hits):
+        self.wfile.write(b'garbage\r\n\r\n')
+        self.close_connection = True
+
+    def route_api(self, path, query):
+        # the Maker API's devices/<id>, slow to answer, for the access token `key` only
+        if 'key' != query.get('access_token'):
+            return self.send_body(b'{"error": "unauthorized"}', 401)
+        time.sleep(API_DELAY)
+        id = path.rpartition('/')[2]
+        device = {'id': id, 'attributes': [{'name': 'switch', 'currentValue': 'on' if '1' == id else 'off'}]}
+        self.send_body(json.dumps(device).encode('utf-8'))
+
+    def route_drop_once(self, query, hits):
+        # takes the request, then closes the connection without answering - the first time only
+        if 1 == hits:
+            self.close_connection = True
+            return
+        self.send_body(b'{"ok": true}')
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients closing their connections while the handler waits on them for more requests
+        pass
+
+
+@pytest.fixture
+def server():
+    """A local HTTP/1.1 server, with the paths of the requests it received in `hits`"""
+    httpd = Server(('127.0.0.1', 0), Handler)
+    httpd.hits = []
+    httpd.lock = threading.Lock()
+    httpd.url = 'http://127.0.0.1:%d' % httpd.server_address[1]
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_connection_is_reused(server):
+    pool = web.ConnectionPool()
+    for _ in range(3):
+        assert {'ok': True} == web.get(server.url+'/ok', pool=pool).json()
+    assert {'requests': 3, 'created': 1, 'reused': 2, 'retried': 0} == pool.stats
+
+
+def test_error_status_releases_connection(server):
+    pool = web.ConnectionPool()
+    r = web.get(server.url+'/missing', pool=pool)
+    assert 404 == r.status_code
+    with pytest.raises(web.urllib.error.HTTPError):
+        r.raise_for_status()
+    web.get(server.url+'/ok', pool=pool)
+    assert 1 == pool.stats['reused']
+
+
+def test_connection_closed_while_idle_is_not_used(server):
+    pool = web.ConnectionPool()
+    web.get(server.url+'/close-after', pool=pool).json()
+    time.sleep(0.1)
+    assert {'ok': True} == web.get(server.url+'/ok', pool=pool).json()
+    assert {'requests': 2, 'created': 2, 'reused': 0, 'retried': 0} == pool.stats
+
+
+def test_request_is_not_sent_again(server):
+    pool = web.ConnectionPool()
+    web.get(server.url+'/ok', pool=pool).json()
+    with pytest.raises((http.client.HTTPException, ConnectionError)):
+        web.get(server.url+'/drop-once', pool=pool)
+    # the server got the request once, and may have acted on it
+    assert ['/ok', '/drop-once'] == server.hits
+    assert 0 == pool.stats['retried']
+
+
+def test_idempotent_request_is_sent_again(server):
+    pool = web.ConnectionPool()
+    web.get(server.url+'/ok', pool=pool).json()
+    assert {'ok': True} == web.get(server.url+'/drop-once', pool=pool, idempotent=True).json()
+    assert ['/ok', '/drop-once', '/drop-once'] == server.hits
+    assert 1 == pool.stats['retried']
+
+
+def test_connection_refused():
+    with pytest.raises(web.ConnectError):
+        web.get('http://127.0.0.1:9/', pool=web.ConnectionPool(), timeout=5)
+
+
+BODIES = ['', '?chunk=7', '?gzip=1', '?gzip=1&chunk=1', '?gzip=1&chunk=2', '?gzip=1&chunk=13',
+          '?gzip=1&chunk=4096']
+
+
+@pytest.mark.parametrize('pooled', [True, False], ids=['pool', 'urllib'])
+@pytest.mark.parametrize('query', BODIES)
+@pytest.mark.parametrize('size', [1, 10, 4096, 1000000])
+def test_iter_content(server, query, size, pooled):
+    r = web.get(server.url+'/body'+query, stream=True, pool=web.ConnectionPool() if pooled else None)
+    chunks = list(r.iter_content(size))
+    assert BODY == b''.join(chunks)
+    assert max(len(chunk) for chunk in chunks) <= size
+
+
+@pytest.mark.parametrize('query', BODIES)
+@pytest.mark.parametrize('size', [1, 3, 100])
+def test_readinto(server, query, size):
+    r = web.get(server.url+'/body'+query, stream=True, pool=web.ConnectionPool())
+    buf = bytearray(size)
+    data = bytearray()
+    while True:
+        read = r.readinto(buf)
+        if not read:
+            break
+        assert read <= size
+        data += buf[:read]
+    assert BODY == data
+
+
+@pytest.mark.parametrize('query', BODIES)
+def test_content(server, query):
+    pool = web.ConnectionPool()
+    assert BODY == web.get(server.url+'/body'+query, pool=pool).content
+    # read to the end, so the connection went back to the pool
+    web.get(server.url+'/ok', pool=pool)
+    assert 1 == pool.stats['reused']
+
+
+def test_decompressed_output_is_bounded(server):
+    pool = web.ConnectionPool()
+    r = web.get(server.url+'/zeros', stream=True, pool=pool)
+    sizes = [len(chunk) for chunk in r.iter_content(4096)]
+    assert len(ZEROS) == sum(sizes)
+    assert 4096 == max(sizes)
+    web.get(server.url+'/ok', pool=pool)
+    assert 1 == pool.stats['reused']
+
+
+@pytest.mark.parametrize('query', ['', '?gzip=1', '?gzip=1&chunk=5'])
+def test_save_to_path(server, query, tmp_path):
+    path = tmp_path / 'saved' / 'body.json'
+    web.get(server.url+'/body'+query, pool=web.ConnectionPool()).save_to_path(str(path))
+    assert BODY == path.read_bytes()
+
+
+def test_save_to_path_expands(server, tmp_path):
+    path = tmp_path / 'zeros'
+    web.get(server.url+'/zeros').save_to_path(str(path))
+    assert ZEROS == path.read_bytes()
+
+
+def test_streaming_needs_stream(server):
+    r = web.get(server.url+'/body?gzip=1')
+    with pytest.raises(RuntimeError):
+        r.readinto(bytearray(10))
+    with pytest.raises(RuntimeError):
+        next(r.iter_content(10))
+
+
+def get_all(pool, *urls, **kwargs):
+    """Responses to GETs of `urls` one after the other with the asyncio client"""
+    async def main():
+        try:
+            return [await web.get_async(url, pool=pool, **kwargs) for url in urls]
+        finally:
+            pool.clear()
+    return asyncio.run(main())
+
+
+def test_async_connection_is_reused(server):
+    pool = web.AsyncConnectionPool()
+    responses = get_all(pool, *[server.url+'/ok'] * 3)
+    assert [{'ok': True}] * 3 == [r.json() for r in responses]
+    assert {'requests': 3, 'created': 1, 'reused': 2, 'retried': 0} == pool.stats
+
+
+def test_async_requests_at_once(server):
+    pool = web.AsyncConnectionPool()
+
+    async def main():
+        try:
+            first = await asyncio.gather(*[web.get_async(server.url+'/ok', pool=pool) for _ in range(3)])
+            second = await asyncio.gather(*[web.get_async(server.url+'/ok', pool=pool) for _ in range(3)])
+            return first + second
+        finally:
+            pool.clear()
+
+    assert [200] * 6 == [r.status_code for r in asyncio.run(main())]
+    # one connection for each request in flight, all of them reused for the next round
+    assert {'requests': 6, 'created': 3, 'reused': 3, 'retried': 0} == pool.stats
+
+
+@pytest.mark.parametrize('query', ['', '?chunk=1', '?chunk=7', '?chunk=4096', '?gzip=1', '?gzip=1&chunk=1',
+                                   '?gzip=1&chunk=13'])
+def test_async_bodies(server, query):
+    pool = web.AsyncConnectionPool()
+    r, after = get_all(pool, server.url+'/body'+query, server.url+'/ok')
+    assert BODY == r.content
+    assert 'utf-8' == r.encoding
+    assert BODY.decode('utf-8') == r.text
+    # the whole body was read, so the connection could be used again
+    assert {'ok': True} == after.json()
+    assert 1 == pool.stats['reused']
+
+
+def test_async_error_status(server):
+    pool = web.AsyncConnectionPool()
+    r, after = get_all(pool, server.url+'/missing', server.url+'/ok')
+    assert 404 == r.status_code
+    assert {'error': 'not found'} == r.json()
+    with pytest.raises(web.urllib.error.HTTPError):
+        r.raise_for_status()
+    assert 200 == after.status_code
+    assert 1 == pool.stats['reused']
+
+
+def test_async_malformed_response(server):
+    with pytest.raises(http.client.HTTPException):
+        get_all(web.AsyncConnectionPool(), server.url+'/garbage')
+
+
+def test_async_timeout(server):
+    with pytest.raises(socket.timeout):
+        get_all(web.AsyncConnectionPool(), server.url+'/slow', timeout=0.2)
+
+
+def test_async_connection_refused():
+    with pytest.raises(web.ConnectError):
+        get_all(web.AsyncConnectionPool(), 'http://127.0.0.1:9/')
+
+
+def test_async_request_is_not_sent_again(server):
+    pool = web.AsyncConnectionPool()
+    with pytest.raises((http.client.HTTPException, ConnectionError)):
+        get_all(pool, server.url+'/ok', server.url+'/drop-once')
+    assert ['/ok', '/drop-once'] == server.hits
+    assert 0 == pool.stats['retried']
+
+
+def test_async_idempotent_request_is_sent_again(server):
+    pool = web.AsyncConnectionPool()
+    r = get_all(pool, server.url+'/ok', server.url+'/drop-once', idempotent=True)[1]
+    assert {'ok': True} == r.json()
+    assert ['/ok', '/drop-once', '/drop-once'] == server.hits
+    assert 1 == pool.stats['retried']
+
+
+def test_run_async_from_a_coroutine(server):
+    import common
+
+    async def main():
+        # as a plain function that uses coroutines inside would, called from a coroutine
+        return common.run_async(web.get_async(server.url+'/ok')).json()
+
+    assert {'ok': True} == asyncio.run(main())
+    assert {'ok': True} == common.run_async(web.get_async(server.url+'/ok')).json()
+
+
+def test_device_status_async_at_once(wf, server):
+    import common
+    hub_ip = server.url.partition('//')[2]
+
+    async def main():
+        return await asyncio.gather(*[common.device_status_async(wf, 'key', None, hub_ip, id) for id in ['1', '2']])
+
+    start = time.time()
+    assert [{'switch': 'on'}, {'switch': 'off'}] == asyncio.run(main())
+    # waited on the hub together rather than one after the other
+    assert time.time() - start < 2 * API_DELAY
+    # and stored, as device_status does
+    assert {'switch': 'off'} == common.read_state(wf, '2')
+
+
+def test_hubitat_api_async_fails_over(wf, server, monkeypatch):
+    import common
+    urls = [('local', 'http://127.0.0.1:9'+API+'devices/1'), ('cloud', server.url+API+'devices/1')]
+    monkeypatch.setattr(common, 'hubitat_urls', lambda *args: list(urls))
+    wf.settings['hedge'] = False
+    # a command, so not hedged - it never reached the first endpoint, so it is sent through the other
+    result = asyncio.run(common.hubitat_api_async(wf, 'key', 'abc', '127.0.0.1:9', 'devices/1'))
+    assert '1' == result['id']
+    assert 'cloud' == wf.cached_data('reachability', max_age=0)['mode']
+
+
+@pytest.mark.parametrize('hedge', [True, False], ids=['hedged', 'single'])
+def test_async_error_status_raises(wf, server, hedge):
+    import common
+    wf.settings['hedge'] = hedge
+    hub_ip = server.url.partition('//')[2]
+    with pytest.raises(web.urllib.error.HTTPError):
+        asyncio.run(common.device_status_async(wf, 'bad', None, hub_ip, '1'))
+
+
+@pytest.mark.parametrize('key,status', [('bad', 401), ('key', 404)])
+def test_hedged_error_status_raises(wf, server, monkeypatch, key, status):
+    import common
+    # both endpoints answer, as in auto mode with the hub and the cloud relay up
+    urls = [('local', server.url+API+'devices/1'), ('cloud', server.url+'/missing')]
+    if 404 == status:
+        urls.reverse()
+    monkeypatch.setattr(common, 'hubitat_urls', lambda *args: list(urls))
+    with pytest.raises(web.urllib.error.HTTPError) as e:
+        common.hubitat_api(wf, key, 'abc', '127.0.0.1', '/devices/1', idempotent=True)
+    assert status == e.value.code
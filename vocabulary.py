@@ -0,0 +1,183 @@
+# encoding: utf-8
+
+"""Sorted word lists used to complete command parameters.
+
+Each vocabulary is a text file in the workflow data directory with one
+``name<TAB>value`` line per word, sorted by name, written when the devices
+are updated. The file is memory-mapped and its lines bisected, so looking up
+a name or listing the first few names that start with what has been typed
+takes time in proportion to the answer, not to the size of the vocabulary.
+
+Words that only apply to one device, such as the thermostat modes a device
+reports it supports, are stored in the same file under that device's scope.
+Scoped lines start with a control character, so they sort ahead of all the
+unscoped words and never turn up in an unscoped search.
+"""
+
+import mmap
+import os
+from collections.abc import Mapping
+from workflow.util import atomic_writer
+
+# most parameter values offered for one query
+PARAM_LIMIT = 25
+# thermostat modes offered for devices that do not report their own
+THERMOSTAT_MODES = ['auto', 'heat', 'cool', 'off']
+# shade levels offered for setShadeLevel
+SHADE_LEVELS = [str(level) for level in range(0, 101, 10)]
+# marks the start and end of a scope in a name
+SCOPE = '\x1f'
+
+def vocabulary_path(wf, name):
+    return wf.datafile(name+'.tsv')
+
+def scoped(scope, name):
+    return SCOPE+scope+SCOPE+name
+
+def store_vocabulary(wf, name, words, scopes=None):
+    """Write a vocabulary, returning False if it was already stored as it is
+
+    `words` maps each name to its value, `scopes` each scope to a list of names.
+    """
+    entries = dict(words)
+    for scope, names in (scopes or {}).items():
+        entries.update({scoped(scope, word): word for word in names})
+    data = b''.join(sorted(word.encode('utf-8')+b'\t'+value.encode('utf-8')+b'\n'
+                   for word, value in entries.items() if word and '\t' not in word+value and '\n' not in word+value))
+    path = vocabulary_path(wf, name)
+    # leave an unchanged vocabulary alone, so what depends on its version is kept
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    except OSError:
+        pass
+    with atomic_writer(path, 'wb') as f:
+        f.write(data)
+    return True
+
+def parse_modes(value):
+    """Names in a supportedThermostatModes attribute, which hubs report as "[auto, heat]" or '["auto","heat"]'"""
+    if isinstance(value, (list, tuple)):
+        return [str(mode) for mode in value]
+    return [mode.strip(' "\'') for mode in str(value or '').strip('[] ').split(',') if mode.strip(' "\'')]
+
+def store_modes(wf, details):
+    """Write the thermostat modes, with those supported by each device that reports them
+
+    `details` maps device ids to what is kept in the device_details datastore.
+    """
+    scopes = {}
+    for id, device in details.items():
+        if device.get('supportedThermostatModes'):
+            scopes[str(id)] = parse_modes(device['supportedThermostatModes'])
+    store_vocabulary(wf, 'modes', {mode: mode for mode in THERMOSTAT_MODES}, scopes)
+
+def find_line(data, key):
+    """Start and end of the line in sorted `data` whose name is `key`, and
+    whether there is one - otherwise the position of the first line after it"""
+    lo, hi = 0, len(data)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = data.rfind(b'\n', 0, mid) + 1
+        end = data.find(b'\n', start)
+        if end < 0:
+            end = len(data)
+        name = data[start:data.find(b'\t', start, end)]
+        if name < key:
+            lo = end + 1
+        elif name > key:
+            hi = start
+        else:
+            return start, end, True
+    return lo, lo, False
+
+class Vocabulary(Mapping):
+    """Read-only mapping of name to value, backed by a vocabulary file
+
+    Nothing is read until a name is looked up. A vocabulary that has not been
+    stored yet starts out with `defaults`. The names of a `numeric` vocabulary
+    are numbers, and are completed in numeric order.
+    """
+
+    def __init__(self, wf, name, defaults=None, numeric=False):
+        self.wf = wf
+        self.name = name
+        self.defaults = defaults
+        self.numeric = numeric
+        self._data = None
+
+    def create(self):
+        """Store the vocabulary if it is missing, returning False if there is nothing to store"""
+        if self.defaults is None:
+            return False
+        store_vocabulary(self.wf, self.name, {word: word for word in self.defaults})
+        return True
+
+    @property
+    def data(self):
+        if self._data is None:
+            path = vocabulary_path(self.wf, self.name)
+            if not os.path.exists(path) and not self.create():
+                self._data = b''
+                return self._data
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size:
+                    self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    self._data = b''
+        return self._data
+
+    def __getitem__(self, name):
+        data = self.data
+        start, end, found = find_line(data, name.encode('utf-8'))
+        if not found:
+            raise KeyError(name)
+        return data[start:end].split(b'\t', 1)[1].decode('utf-8')
+
+    def __contains__(self, name):
+        return isinstance(name, str) and find_line(self.data, name.encode('utf-8'))[2]
+
+    def lines(self, start=0):
+        data = self.data
+        while start < len(data):
+            end = data.find(b'\n', start)
+            if end < 0:
+                end = len(data)
+            yield data[start:end].decode('utf-8').split('\t', 1)
+            start = end + 1
+
+    def __iter__(self):
+        return (name for name, value in self.lines() if not name.startswith(SCOPE))
+
+    def items(self):
+        return [(name, value) for name, value in self.lines() if not name.startswith(SCOPE)]
+
+    def __len__(self):
+        return sum(1 for name in self)
+
+    def starting_with(self, prefix, limit):
+        names = []
+        # unscoped names sort after every scoped one, starting from ' '
+        start = find_line(self.data, (prefix or ' ').encode('utf-8'))[0]
+        for name, value in self.lines(start):
+            if not name.startswith(prefix) or len(names) >= limit:
+                break
+            names.append(name)
+        return names
+
+    def complete(self, prefix, scope=None, limit=PARAM_LIMIT):
+        """The first `limit` names starting with `prefix`, in order
+
+        When `scope` is given and has names of its own, only those are searched.
+        """
+        # stored order is only numeric order between numbers of the same length, so numbers are all read and sorted
+        found = float('inf') if self.numeric else limit
+        if scope is not None and self.starting_with(scoped(scope, ''), 1):
+            start = scoped(scope, '')
+            names = [name[len(start):] for name in self.starting_with(start+prefix, found)]
+        else:
+            names = self.starting_with(prefix, found)
+        if self.numeric:
+            names = sorted(names, key=lambda name: (len(name), name))[:limit]
+        return names
@@ -14,13 +14,11 @@
 import json
 import os
 import re
-import subprocess
-import tempfile
 from collections import defaultdict
 from functools import total_ordering
 from itertools import zip_longest
 
-from . import Workflow, web
+from . import Workflow
 
 
 RELEASES_BASE = "https://api.github.com/repos/{}/releases"
@@ -384,6 +382,9 @@ def retrieve_download(dl):
     if not match_workflow(dl.filename):
         raise ValueError(f"attachment not a workflow: {dl.filename}")
 
+    import tempfile
+    from . import web
+
     path = os.path.join(tempfile.gettempdir(), dl.filename)
     wf.logger.debug("downloading update from %r to %r ...", dl.url, path)
 
@@ -422,6 +423,8 @@ def get_downloads(repo):
     url = build_api_url(repo)
 
     def _fetch():
+        from . import web
+
         wf.logger.info("retrieving releases for %r ...", repo)
         r = web.get(url)
         r.raise_for_status()
@@ -537,6 +540,8 @@ def install_update():
 
     path = retrieve_download(Download.from_dict(dl))
 
+    import subprocess
+
     wf.logger.info("installing updated workflow ...")
     subprocess.run(["/usr/bin/open", path], check=True)
 
@@ -9,7 +9,6 @@ import functools
 import json
 import os
 import signal
-import subprocess
 import sys
 import time
 from collections import namedtuple
@@ -98,6 +97,8 @@ def run_command(cmd, **kwargs):
         str: Output returned by :func:`~subprocess.check_output`.
 
     """
+    import subprocess
+
     cmd = [str(s) for s in cmd]
     return subprocess.check_output(cmd, **kwargs).decode()
 
@@ -352,15 +353,18 @@ def atomic_writer(fpath, mode):
     """
     suffix = f".{os.getpid()}.tmp"
     temppath = fpath + suffix
-    with open(temppath, mode) as f:  # pylint: disable=unspecified-encoding
-        try:
+    try:
+        with open(temppath, mode) as f:  # pylint: disable=unspecified-encoding
             yield f
-            os.rename(temppath, fpath)
-        finally:
-            try:
-                os.remove(temppath)
-            except (OSError, IOError):
-                pass
+        # only once the file is closed, so its contents are all written
+        # when it replaces the original and readers never see it partly
+        # written
+        os.rename(temppath, fpath)
+    finally:
+        try:
+            os.remove(temppath)
+        except (OSError, IOError):
+            pass
 
 
 class LockFile:
@@ -435,6 +439,16 @@ class LockFile:
             # Try to acquire the lock
             try:
                 fcntl.lockf(self._lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                # The holder before us deletes the lockfile on release,
+                # so the lock only counts if it is on the file still there
+                try:
+                    current = os.stat(self.lockfile).st_ino
+                except OSError:
+                    current = None
+                if current != os.fstat(self._lockfile.fileno()).st_ino:
+                    self._lockfile.close()
+                    self._lockfile = None
+                    continue
                 self._lock.set()
                 break
             except IOError as err:  # pragma: no cover
@@ -455,19 +469,24 @@ class LockFile:
         if not self._lock.is_set():
             return False
 
+        # Delete the lockfile while still holding the lock, so nobody can
+        # lock it in between and then share the lock with whoever creates
+        # the next one
+        try:
+            os.unlink(self.lockfile)
+        except (IOError, OSError):  # pragma: no cover
+            pass
+
         try:
             fcntl.lockf(self._lockfile, fcntl.LOCK_UN)
         except IOError:  # pragma: no cover
             pass
         finally:
             self._lock.clear()
+            self._lockfile.close()
             self._lockfile = None
-            try:
-                os.unlink(self.lockfile)
-            except (IOError, OSError):  # pragma: no cover
-                pass
 
-            return True  # pylint: disable=lost-exception
+        return True
 
     def __enter__(self):
         """Acquire lock."""
@@ -1,13 +1,17 @@
 """Lightweight HTTP library with a requests-like interface."""
 
 import codecs
+import http.client
+import io
 import json
 import mimetypes
 import os
 import re
 import secrets
+import select
 import socket
 import string
+import threading
 import unicodedata
 import urllib.request
 import urllib.parse
@@ -21,6 +25,9 @@ __version__ = open(
 
 USER_AGENT = f"Alpynist/{__version__}"
 
+# Bytes read and decompressed at a time when a whole body is read or saved
+CHUNK_SIZE = 65536
+
 # Valid characters for multipart form data boundaries
 BOUNDARY_CHARS = string.digits + string.ascii_letters
 
@@ -69,6 +76,15 @@ RESPONSES = {
 }
 
 
+class ConnectError(OSError):
+    """Raised by pooled requests that could not connect to the server.
+
+    The request was never sent, so it is safe to send it again elsewhere,
+    even if it is not idempotent.
+
+    """
+
+
 class NoRedirectHandler(urllib.request.HTTPRedirectHandler):
     """Prevent redirections."""
 
@@ -158,12 +174,509 @@ class Request(urllib.request.Request):
     def __init__(self, *args, **kwargs):
         """Create a new :class:`Request`."""
         self._method = kwargs.pop("method", None)
+        #: Whether the request may be sent again if it may have reached
+        #: the server already
+        self.idempotent = kwargs.pop("idempotent", False)
         urllib.request.Request.__init__(self, *args, **kwargs)
 
     def get_method(self):
         return self._method.upper()
 
 
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections shared between requests.
+
+    Connections are keyed by scheme, host and port, so every request to
+    the same server within one process reuses an already-open (and, for
+    HTTPS, already-negotiated) connection instead of opening a new one.
+
+    Pass an instance as the ``pool`` argument of :func:`request` /
+    :func:`get` / :func:`post`. Pooled requests bypass :mod:`urllib`'s
+    opener chain, so proxies and redirects are not handled.
+
+    A request on a reused connection that fails before it has been sent
+    in full is sent again on a new connection. Once sent, it is only
+    sent again if it is ``idempotent``: the server may already have
+    acted on it.
+
+    >>> pool = ConnectionPool()
+    >>> r = get('http://192.168.1.10/apps/api/5/devices', pool=pool)
+    >>> pool.stats
+    {'requests': 1, 'created': 1, 'reused': 0, 'retried': 0}
+
+    :param maxsize: maximum number of idle connections kept per server
+    :type maxsize: int
+
+    """
+
+    def __init__(self, maxsize=4):
+        """Create a new, empty :class:`ConnectionPool`."""
+        self.maxsize = maxsize
+        self._idle = {}
+        self._lock = threading.Lock()
+        #: Counters of requests made and connections created/reused
+        self.stats = {"requests": 0, "created": 0, "reused": 0, "retried": 0}
+
+    def urlopen(self, request):  # pylint: disable=redefined-outer-name
+        """Send ``request`` over a pooled connection.
+
+        Raises :class:`urllib.error.HTTPError` for error statuses, like
+        :func:`urllib.request.urlopen`.
+
+        :param request: :class:`Request` instance
+        :returns: file-like response object
+
+        """
+        scheme, netloc, path, query, _ = urllib.parse.urlsplit(request.full_url)
+        key = (scheme, netloc)
+        target = (path or "/") + ("?" + query if query else "")
+        timeout = socket.getdefaulttimeout()
+        headers = dict(request.header_items())
+
+        with self._lock:
+            self.stats["requests"] += 1
+
+        while True:
+            conn, reused = self._acquire(key, timeout)
+
+            if not reused:
+                try:
+                    conn.connect()
+                except OSError as err:
+                    conn.close()
+                    raise ConnectError(
+                        err.errno, f"Could not connect to {netloc}: {err}"
+                    ) from err
+
+            try:
+                conn.request(request.get_method(), target, request.data, headers)
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                # server closed an idle keep-alive connection before the
+                # request was sent in full: retry on a fresh one
+                if not reused:
+                    raise
+                with self._lock:
+                    self.stats["retried"] += 1
+                continue
+            except OSError:
+                conn.close()
+                raise
+
+            try:
+                resp = conn.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                # the server may have closed the connection just as the
+                # request arrived, or after acting on it: only requests
+                # that are safe to repeat are sent again
+                if not (reused and request.idempotent):
+                    raise
+                with self._lock:
+                    self.stats["retried"] += 1
+                continue
+            except OSError:
+                conn.close()
+                raise
+
+            break
+
+        resp.url = request.full_url
+        raw = _PooledResponse(self, key, conn, resp)
+
+        if resp.status >= 400:
+            # read the error body now, so the connection goes back to the
+            # pool (or is closed) instead of being left open
+            try:
+                body = raw.read()
+            except (http.client.HTTPException, OSError):
+                raw.close()
+                body = b""
+
+            raise urllib.error.HTTPError(
+                request.full_url, resp.status, resp.reason, resp.msg, io.BytesIO(body)
+            )
+
+        return raw
+
+    def clear(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _acquire(self, key, timeout):
+        """Return ``(connection, reused)`` for server ``key``."""
+        with self._lock:
+            conns = self._idle.get(key)
+            while conns:
+                conn = conns.pop()
+                if _is_dropped(conn):
+                    conn.close()
+                    continue
+
+                self.stats["reused"] += 1
+                conn.timeout = timeout
+                conn.sock.settimeout(timeout)
+                return conn, True
+
+            self.stats["created"] += 1
+
+        scheme, netloc = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=timeout), False
+
+        return http.client.HTTPConnection(netloc, timeout=timeout), False
+
+    def _release(self, key, conn, resp):
+        """Return ``conn`` to the pool once ``resp`` has been read."""
+        if resp.will_close:
+            conn.close()
+            return
+
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.maxsize:
+                conns.append(conn)
+                return
+
+        conn.close()
+
+
+def _is_dropped(conn):
+    """Whether the server has closed idle connection ``conn``.
+
+    An idle connection has nothing to read, so a readable one has either
+    been closed or has been sent something unexpected. Either way, it
+    can't be used for another request.
+
+    """
+    if conn.sock is None:
+        return True
+
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+
+    return bool(readable)
+
+
+class _PooledResponse:
+    """File-like wrapper that hands its connection back to the pool.
+
+    The connection is released as soon as the body has been read in full.
+
+    """
+
+    def __init__(self, pool, key, conn, resp):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+
+    def getcode(self):  # pylint: disable=missing-function-docstring
+        return self._resp.status
+
+    def geturl(self):  # pylint: disable=missing-function-docstring
+        return self._resp.url
+
+    def info(self):  # pylint: disable=missing-function-docstring
+        return self._resp.msg
+
+    def read(self, amt=None):  # pylint: disable=missing-function-docstring
+        data = self._resp.read(amt)
+        self._check_done()
+        return data
+
+    def readinto(self, b):  # pylint: disable=missing-function-docstring
+        size = self._resp.readinto(b)
+        self._check_done()
+        return size
+
+    def close(self):  # pylint: disable=missing-function-docstring
+        self._resp.close()
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def _check_done(self):
+        if self._conn and self._resp.isclosed():
+            self._pool._release(  # pylint: disable=protected-access
+                self._key, self._conn, self._resp
+            )
+            self._conn = None
+
+
+class AsyncConnectionPool:
+    """Keep-alive HTTP(S) connections for :func:`request_async`.
+
+    The :mod:`asyncio` counterpart of :class:`ConnectionPool`: connections
+    are keyed by scheme, host and port and reused by later requests to the
+    same server, so several requests can be in flight at once, each on a
+    connection of its own. Connections belong to the event loop that
+    opened them, so a pool must only be used within one loop. Like
+    :class:`ConnectionPool`, it only sends a request again after it went
+    out on a connection that then failed if it is ``idempotent``.
+
+    >>> async def main():
+    ...     pool = AsyncConnectionPool()
+    ...     return await asyncio.gather(
+    ...         get_async('http://192.168.1.10/apps/api/5/devices/1', pool=pool),
+    ...         get_async('http://192.168.1.10/apps/api/5/devices/2', pool=pool),
+    ...     )
+
+    :param maxsize: maximum number of idle connections kept per server
+    :type maxsize: int
+
+    """
+
+    def __init__(self, maxsize=4):
+        """Create a new, empty :class:`AsyncConnectionPool`."""
+        self.maxsize = maxsize
+        self._idle = {}
+        #: Counters of requests made and connections created/reused
+        self.stats = {"requests": 0, "created": 0, "reused": 0, "retried": 0}
+
+    async def send(
+        self, method, url, data, headers, idempotent=False
+    ):  # pylint: disable=too-many-arguments
+        """Send a request over a pooled connection and read the response.
+
+        Unlike :meth:`ConnectionPool.urlopen`, error statuses do not raise:
+        they are set as the response's ``error``.
+
+        :param method: HTTP method
+        :type method: str
+        :param url: URL to open
+        :type url: str
+        :param data: Request body or ``None``
+        :type data: bytes
+        :param headers: HTTP headers
+        :type headers: :class:`CaseInsensitiveDictionary`
+        :param idempotent: Whether the request may be sent again if a
+            reused connection fails after it has been sent
+        :type idempotent: bool
+        :returns: Response with its body read in full
+        :rtype: :class:`AsyncResponse`
+
+        """
+        scheme, netloc, path, query, _ = urllib.parse.urlsplit(url)
+        key = (scheme, netloc)
+        target = (path or "/") + ("?" + query if query else "")
+        head = [f"{method} {target} HTTP/1.1", f"Host: {netloc}"]
+        head.extend(f"{k}: {v}" for k, v in headers.items() if k.lower() != "host")
+
+        if data or method in ("POST", "PUT"):
+            head.append(f"Content-Length: {len(data or b'')}")
+
+        message = ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + (data or b"")
+        self.stats["requests"] += 1
+
+        while True:
+            (reader, writer), reused = await self._acquire(key)
+
+            try:
+                writer.write(message)
+                await writer.drain()
+            except ConnectionError:
+                writer.close()
+                # server closed an idle keep-alive connection before the
+                # request was sent in full: retry on a fresh one
+                if not reused:
+                    raise
+                self.stats["retried"] += 1
+                continue
+            except BaseException:
+                writer.close()
+                raise
+
+            try:
+                status, reason, msg, content, will_close = await _read_response(
+                    reader, method
+                )
+            except (http.client.HTTPException, ConnectionError):
+                writer.close()
+                # the server may have closed the connection just as the
+                # request arrived, or after acting on it: only requests
+                # that are safe to repeat are sent again
+                if not (reused and idempotent):
+                    raise
+                self.stats["retried"] += 1
+                continue
+            except BaseException:
+                # timed out, cancelled or failed part-way through: the
+                # connection is in an unknown state
+                writer.close()
+                raise
+
+            break
+
+        if will_close:
+            writer.close()
+        else:
+            self._release(key, (reader, writer))
+
+        return AsyncResponse(url, status, reason, msg, content)
+
+    def clear(self):
+        """Close all idle connections."""
+        idle, self._idle = self._idle, {}
+
+        for conns in idle.values():
+            for _, writer in conns:
+                writer.close()
+
+    async def _acquire(self, key):
+        """Return ``((reader, writer), reused)`` for server ``key``."""
+        import asyncio
+
+        conns = self._idle.get(key)
+        while conns:
+            reader, writer = conns.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                self.stats["reused"] += 1
+                return (reader, writer), True
+
+            writer.close()
+
+        self.stats["created"] += 1
+        scheme, netloc = key
+        parts = urllib.parse.urlsplit(f"{scheme}://{netloc}")
+
+        try:
+            if scheme == "https":
+                import ssl
+
+                conn = await asyncio.open_connection(
+                    parts.hostname,
+                    parts.port or 443,
+                    ssl=ssl.create_default_context(),
+                )
+            else:
+                conn = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        except OSError as err:
+            raise ConnectError(
+                err.errno, f"Could not connect to {netloc}: {err}"
+            ) from err
+
+        return conn, False
+
+    def _release(self, key, conn):
+        """Return ``conn`` to the pool after a complete response."""
+        conns = self._idle.setdefault(key, [])
+        if len(conns) < self.maxsize:
+            conns.append(conn)
+            return
+
+        conn[1].close()
+
+
+async def _read_response(reader, method):
+    """Read an HTTP response from ``reader``, decompressing it if gzipped.
+
+    :returns: ``(status, reason, headers, content, will_close)``
+    :rtype: tuple
+
+    """
+    import asyncio
+    import email.parser
+
+    try:
+        while True:
+            line = await reader.readline()
+
+            if not line:
+                raise http.client.RemoteDisconnected(
+                    "Remote end closed connection without response"
+                )
+
+            version, status, reason = (
+                line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""]
+            )[:3]
+
+            if not version.startswith("HTTP/") or not status.isdigit():
+                raise http.client.BadStatusLine(line)
+
+            status = int(status)
+            lines = []
+
+            while True:
+                line = await reader.readline()
+
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+                lines.append(line)
+
+            msg = email.parser.BytesParser(_class=http.client.HTTPMessage).parsebytes(
+                b"".join(lines)
+            )
+
+            # skip interim responses such as 100 Continue
+            if not 100 <= status < 200:
+                break
+
+        connection = msg.get("connection", "").lower()
+        will_close = connection == "close" or (
+            version == "HTTP/1.0" and connection != "keep-alive"
+        )
+        decoder = None
+
+        if "gzip" in msg.get("content-encoding", ""):
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        buf = io.BytesIO()
+
+        def write(data):
+            buf.write(decoder.decompress(data) if decoder else data)
+
+        if method == "HEAD" or status in (204, 304):
+            pass
+        elif "chunked" in msg.get("transfer-encoding", "").lower():
+            while True:
+                size = int((await reader.readline()).split(b";", 1)[0], 16)
+
+                if not size:
+                    # skip any trailers
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+
+                write(await reader.readexactly(size))
+                await reader.readexactly(2)
+        elif msg.get("content-length"):
+            remaining = int(msg["content-length"])
+
+            while remaining:
+                data = await reader.readexactly(min(remaining, CHUNK_SIZE))
+                remaining -= len(data)
+                write(data)
+        else:
+            # body runs until the server closes the connection
+            will_close = True
+
+            while True:
+                data = await reader.read(CHUNK_SIZE)
+
+                if not data:
+                    break
+
+                write(data)
+    except asyncio.IncompleteReadError as err:
+        raise http.client.IncompleteRead(err.partial) from err
+    except ValueError as err:
+        raise http.client.HTTPException(f"Malformed response: {err}") from err
+
+    if decoder:
+        buf.write(decoder.flush())
+
+    return status, reason, msg, buf.getvalue(), will_close
+
+
 class Response:
     """
     Returned by :func:`request` / :func:`get` / :func:`post` functions.
@@ -183,12 +696,16 @@ class Response:
 
     """
 
-    def __init__(self, request, stream=False):  # pylint: disable=redefined-outer-name
+    def __init__(
+        self, request, stream=False, pool=None
+    ):  # pylint: disable=redefined-outer-name
         """Call `request` with :mod:`urllib` and process results.
 
         :param request: :class:`Request` instance
         :param stream: Whether to stream response or retrieve it all at once
         :type stream: bool
+        :param pool: Send the request over a pooled keep-alive connection
+        :type pool: :class:`ConnectionPool`
 
         """
         self.request = request
@@ -203,11 +720,15 @@ class Response:
         self._content = None
         self._content_loaded = False
         self._gzipped = False
+        self._decoder = None
 
         # Execute query
         try:
-            # pylint: disable=consider-using-with
-            self.raw = urllib.request.urlopen(request)
+            if pool is not None:
+                self.raw = pool.urlopen(request)
+            else:
+                # pylint: disable=consider-using-with
+                self.raw = urllib.request.urlopen(request)
         except urllib.error.HTTPError as err:
             self.error = err
 
@@ -292,10 +813,16 @@ class Response:
 
         """
         if not self._content:
-            # Decompress gzipped content
+            # Decompress gzipped content a chunk at a time, so the whole
+            # compressed body is never held alongside the decompressed one.
+            # BytesIO hands over its buffer without copying it.
             if self._gzipped:
-                decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
-                self._content = decoder.decompress(self.raw.read())
+                buf = io.BytesIO()
+
+                for data in iter(lambda: self._read(CHUNK_SIZE), b""):
+                    buf.write(data)
+
+                self._content = buf.getvalue()
             else:
                 self._content = self.raw.read()
 
@@ -329,13 +856,7 @@ class Response:
         :returns: iterator
 
         """
-        if not self.stream:
-            raise RuntimeError(
-                "You cannot call `iter_content` on a Response unless you passed `stream=True` to `get()`/`post()`/`request()`."
-            )
-
-        if self._content_loaded:
-            raise RuntimeError("`content` has already been read from this Response.")
+        self._check_streaming("iter_content")
 
         def decode_stream(iterator, r):
             dec = codecs.getincrementaldecoder(r.encoding)(errors="replace")
@@ -352,18 +873,12 @@ class Response:
                 yield data
 
         def generate():
-            if self._gzipped:
-                decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
-
             while True:
-                chunk = self.raw.read(chunk_size)
+                chunk = self._read(chunk_size)
 
                 if not chunk:
                     break
 
-                if self._gzipped:
-                    chunk = decoder.decompress(chunk)
-
                 yield chunk
 
         chunks = generate()
@@ -373,6 +888,28 @@ class Response:
 
         return chunks
 
+    def readinto(self, b):
+        """Read response data into a pre-allocated, writable buffer.
+
+        Data that is not compressed goes straight from the socket into
+        ``b``. Gzipped data is decompressed no more than ``len(b)`` bytes
+        at a time. Like :meth:`iter_content`, this needs ``stream=True``.
+
+        :param b: Buffer to fill, e.g. a :class:`bytearray`
+        :returns: Number of bytes read, ``0`` at the end of the response
+        :rtype: int
+
+        """
+        self._check_streaming("readinto")
+
+        if not self._gzipped:
+            return self.raw.readinto(b)
+
+        data = self._read(len(b))
+        size = len(data)
+        b[:size] = data
+        return size
+
     def save_to_path(self, filepath):
         """Save retrieved data to file at ``filepath``.
 
@@ -387,9 +924,17 @@ class Response:
 
         self.stream = True
 
+        buf = bytearray(CHUNK_SIZE)
+        view = memoryview(buf)
+
         with open(filepath, "wb") as fileobj:
-            for data in self.iter_content():
-                fileobj.write(data)
+            while True:
+                size = self.readinto(buf)
+
+                if not size:
+                    break
+
+                fileobj.write(view[:size])
 
     def raise_for_status(self):
         """Raise stored error if one occurred.
@@ -399,6 +944,51 @@ class Response:
         if self.error is not None:
             raise self.error
 
+    def _check_streaming(self, method):
+        if not self.stream:
+            raise RuntimeError(
+                f"You cannot call `{method}` on a Response unless you passed `stream=True` to `get()`/`post()`/`request()`."
+            )
+
+        if self._content_loaded:
+            raise RuntimeError("`content` has already been read from this Response.")
+
+    def _read(self, size):
+        """Read up to ``size`` bytes of the body, decompressing it if gzipped.
+
+        Compressed data is fed to the decompressor no faster than its
+        output is consumed, so only one raw chunk and ``size`` bytes of
+        output are held at a time, however much the data expands.
+
+        :param size: Most bytes to return
+        :type size: int
+        :returns: Data, or ``b""`` at the end of the body
+        :rtype: bytes
+
+        """
+        if not self._gzipped:
+            return self.raw.read(size)
+
+        if self._decoder is None:
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        decoder = self._decoder
+
+        while not decoder.eof:
+            data = decoder.unconsumed_tail or self.raw.read(size)
+
+            if not data:
+                return decoder.flush()
+
+            data = decoder.decompress(data, size)
+
+            if data:
+                return data
+
+        # finish reading the response, so its connection can be reused
+        self.raw.read()
+        return b""
+
     def _get_encoding(self):
         """Get encoding from HTTP headers or content.
 
@@ -448,6 +1038,90 @@ class Response:
         return encoding
 
 
+class AsyncResponse:
+    """Returned by :func:`request_async` / :func:`get_async` / :func:`post_async`.
+
+    Like :class:`Response`, but with the body already read in full, as
+    the result of awaiting the request.
+
+    """
+
+    def __init__(
+        self, url, status_code, reason, msg, content
+    ):  # pylint: disable=too-many-arguments
+        """Wrap a response read by :class:`AsyncConnectionPool`.
+
+        :param url: URL of the request
+        :type url: str
+        :param status_code: HTTP status
+        :type status_code: int
+        :param reason: Reason phrase sent by the server
+        :type reason: str
+        :param msg: Response headers
+        :type msg: :class:`http.client.HTTPMessage`
+        :param content: Response body, decompressed
+        :type content: bytes
+
+        """
+        self.url = url
+        self.status_code = status_code
+        self.reason = RESPONSES.get(status_code, reason)
+        self.content = content
+        self.error = None
+        self.mimetype = msg.get("content-type")
+        self.headers = CaseInsensitiveDictionary()
+
+        for key in list(msg.keys()):
+            self.headers[key.lower()] = msg.get(key)
+
+        charset = msg.get_content_charset()
+        if charset:
+            self.encoding = charset.lower()
+        elif self.mimetype and self.mimetype.split(";")[0] in (
+            "application/json",
+            "application/xml",
+        ):
+            self.encoding = "utf-8"
+        else:
+            self.encoding = None
+
+        if status_code >= 400:
+            self.error = urllib.error.HTTPError(url, status_code, reason, msg, None)
+
+    def json(self):
+        """Decode response contents as JSON.
+
+        :returns: object decoded from JSON
+        :rtype: list, dict or str
+
+        """
+        return json.loads(self.content)
+
+    @property
+    def text(self):
+        """Content of the response in unicode.
+
+        If no encoding can be determined from HTTP headers, the encoded
+        response body will be returned instead.
+
+        :returns: Body of HTTP response
+        :rtype: str or bytes
+
+        """
+        if self.encoding:
+            return unicodedata.normalize("NFC", str(self.content, self.encoding))
+
+        return self.content
+
+    def raise_for_status(self):
+        """Raise stored error if one occurred.
+
+        error will be instance of :class:`urllib.error.HTTPError`
+        """
+        if self.error is not None:
+            raise self.error
+
+
 def request(
     method,
     url,
@@ -460,6 +1134,8 @@ def request(
     timeout=60,
     allow_redirects=False,
     stream=False,
+    pool=None,
+    idempotent=False,
 ):
     """Initiate an HTTP(S) request. Returns :class:`Response` object.
 
@@ -487,6 +1163,14 @@ def request(
     :type allow_redirects: bool
     :param stream: Stream content instead of fetching it all at once.
     :type stream: bool
+    :param pool: Reuse keep-alive connections from this pool. Redirects
+        and proxies are not supported for pooled requests, which raise
+        :class:`ConnectError` if they cannot connect to the server.
+    :type pool: :class:`ConnectionPool`
+    :param idempotent: Whether a pooled request may be sent again when
+        its connection fails after it has been sent. Don't set it for
+        requests that change something on the server, even GETs.
+    :type idempotent: bool
     :returns: Response object
     :rtype: :class:`Response`
 
@@ -508,68 +1192,27 @@ def request(
     """
     socket.setdefaulttimeout(timeout)
 
-    # Default handlers
-    openers = [urllib.request.ProxyHandler(urllib.request.getproxies())]
+    if pool is None:
+        # Default handlers
+        openers = [urllib.request.ProxyHandler(urllib.request.getproxies())]
 
-    if not allow_redirects:
-        openers.append(NoRedirectHandler())
+        if not allow_redirects:
+            openers.append(NoRedirectHandler())
 
-    if auth is not None:  # Add authorisation handler
-        username, password = auth
-        password_manager = urllib.request.HTTPPasswordMgrWithDefaultRealm()
-        password_manager.add_password(None, url, username, password)
-        auth_manager = urllib.request.HTTPBasicAuthHandler(password_manager)
-        openers.append(auth_manager)
+        if auth is not None:  # Add authorisation handler
+            username, password = auth
+            password_manager = urllib.request.HTTPPasswordMgrWithDefaultRealm()
+            password_manager.add_password(None, url, username, password)
+            auth_manager = urllib.request.HTTPBasicAuthHandler(password_manager)
+            openers.append(auth_manager)
 
-    # Install our custom chain of openers
-    opener = urllib.request.build_opener(*openers)
-    urllib.request.install_opener(opener)
+        # Install our custom chain of openers
+        opener = urllib.request.build_opener(*openers)
+        urllib.request.install_opener(opener)
 
-    if not headers:
-        headers = CaseInsensitiveDictionary()
-    else:
-        headers = CaseInsensitiveDictionary(headers)
-
-    if "User-Agent" not in headers:
-        headers["User-Agent"] = USER_AGENT
-
-    # Accept gzip-encoded content
-    encodings = [s.strip() for s in headers.get("Accept-Encoding", "").split(",")]
-    if "gzip" not in encodings:
-        encodings.append("gzip")
-
-    headers["Accept-Encoding"] = ", ".join(encodings)
-
-    if files:
-        if not data:
-            data = {}
-
-        new_headers, data = _encode_multipart_formdata(data, files)
-        headers.update(new_headers)
-    elif data and isinstance(data, dict):
-        data = urllib.parse.urlencode(data)
-
-    if data:
-        data = data.encode("utf-8")
-
-    if json_data and not data:
-        data = json.dumps(json_data).encode("utf-8")
-        headers["Content-Type"] = "application/json"
-
-    if params:  # GET args (POST args are handled in _encode_multipart_formdata)
-        scheme, netloc, path, query, fragment = urllib.parse.urlsplit(url)
-
-        if query:  # Combine query string and `params`
-            url_params = urllib.parse.parse_qs(query)
-            # `params` take precedence over URL query string
-            url_params.update(params)
-            params = url_params
-
-        query = urllib.parse.urlencode(params, doseq=True)
-        url = urllib.parse.urlunsplit((scheme, netloc, path, query, fragment))
-
-    req = Request(url, data, headers, method=method)
-    return Response(req, stream)
+    url, data, headers = _prepare_request(url, params, data, json_data, headers, files)
+    req = Request(url, data, headers, method=method, idempotent=idempotent)
+    return Response(req, stream, pool)
 
 
 def get(
@@ -580,6 +1223,8 @@ def get(
     timeout=60,
     allow_redirects=True,
     stream=False,
+    pool=None,
+    idempotent=False,
 ):
     """Initiate a GET request. Arguments as for :func:`request`.
 
@@ -595,6 +1240,8 @@ def get(
         timeout=timeout,
         allow_redirects=allow_redirects,
         stream=stream,
+        pool=pool,
+        idempotent=idempotent,
     )
 
 
@@ -607,6 +1254,7 @@ def delete(
     timeout=60,
     allow_redirects=True,
     stream=False,
+    pool=None,
 ):
     """Initiate a DELETE request. Arguments as for :func:`request`.
 
@@ -623,6 +1271,7 @@ def delete(
         timeout=timeout,
         allow_redirects=allow_redirects,
         stream=stream,
+        pool=pool,
     )
 
 
@@ -637,6 +1286,7 @@ def post(
     timeout=60,
     allow_redirects=False,
     stream=False,
+    pool=None,
 ):
     """Initiate a POST request. Arguments as for :func:`request`.
 
@@ -655,6 +1305,7 @@ def post(
         timeout,
         allow_redirects,
         stream,
+        pool,
     )
 
 
@@ -668,6 +1319,7 @@ def put(
     timeout=60,
     allow_redirects=False,
     stream=False,
+    pool=None,
 ):
     """Initiate a PUT request. Arguments as for :func:`request`.
 
@@ -675,10 +1327,171 @@ def put(
 
     """
     return request(
-        "PUT", url, params, data, headers, files, auth, timeout, allow_redirects, stream
+        "PUT",
+        url,
+        params,
+        data,
+        headers=headers,
+        files=files,
+        auth=auth,
+        timeout=timeout,
+        allow_redirects=allow_redirects,
+        stream=stream,
+        pool=pool,
     )
 
 
+async def request_async(
+    method,
+    url,
+    params=None,
+    data=None,
+    json_data=None,
+    headers=None,
+    files=None,
+    auth=None,
+    timeout=60,
+    pool=None,
+    idempotent=False,
+):
+    """Make an HTTP(S) request on the running :mod:`asyncio` event loop.
+
+    Arguments as for :func:`request`, but redirects and proxies are not
+    handled and the body is always read in full (decompressing gzipped
+    content as it arrives). ``timeout`` covers the whole request, from
+    connecting to reading the last byte, and raises
+    :class:`socket.timeout` when it runs out.
+
+    :param pool: Reuse keep-alive connections from this pool. Without one,
+        a connection is opened for this request only. Raises
+        :class:`ConnectError` if it cannot connect to the server.
+    :type pool: :class:`AsyncConnectionPool`
+    :param idempotent: As for :func:`request`
+    :type idempotent: bool
+    :returns: Response object
+    :rtype: :class:`AsyncResponse`
+
+    """
+    import asyncio
+
+    url, data, headers = _prepare_request(url, params, data, json_data, headers, files)
+
+    if auth is not None:
+        import base64
+
+        credentials = base64.b64encode(":".join(auth).encode("utf-8"))
+        headers["Authorization"] = "Basic " + credentials.decode("ascii")
+
+    owned = pool is None
+    if owned:
+        pool = AsyncConnectionPool(maxsize=0)
+
+    try:
+        return await asyncio.wait_for(
+            pool.send(method.upper(), url, data, headers, idempotent), timeout
+        )
+    except asyncio.TimeoutError:
+        raise socket.timeout(f"timed out after {timeout}s: {url}") from None
+    finally:
+        if owned:
+            pool.clear()
+
+
+async def get_async(
+    url, params=None, headers=None, auth=None, timeout=60, pool=None, idempotent=False
+):
+    """Initiate a GET request. Arguments as for :func:`request_async`.
+
+    :returns: :class:`AsyncResponse` instance
+
+    """
+    return await request_async(
+        "GET",
+        url,
+        params,
+        headers=headers,
+        auth=auth,
+        timeout=timeout,
+        pool=pool,
+        idempotent=idempotent,
+    )
+
+
+async def post_async(
+    url,
+    params=None,
+    data=None,
+    json_data=None,
+    headers=None,
+    files=None,
+    auth=None,
+    timeout=60,
+    pool=None,
+):
+    """Initiate a POST request. Arguments as for :func:`request_async`.
+
+    :returns: :class:`AsyncResponse` instance
+
+    """
+    return await request_async(
+        "POST", url, params, data, json_data, headers, files, auth, timeout, pool
+    )
+
+
+def _prepare_request(url, params, data, json_data, headers, files):
+    """Encode the parts of a request. Arguments as for :func:`request`.
+
+    :returns: ``(url, data, headers)`` with ``params`` added to ``url``,
+        ``data`` encoded as bytes and default headers set
+    :rtype: tuple
+
+    """
+    if not headers:
+        headers = CaseInsensitiveDictionary()
+    else:
+        headers = CaseInsensitiveDictionary(headers)
+
+    if "User-Agent" not in headers:
+        headers["User-Agent"] = USER_AGENT
+
+    # Accept gzip-encoded content
+    encodings = [s.strip() for s in headers.get("Accept-Encoding", "").split(",")]
+    if "gzip" not in encodings:
+        encodings.append("gzip")
+
+    headers["Accept-Encoding"] = ", ".join(encodings)
+
+    if files:
+        if not data:
+            data = {}
+
+        new_headers, data = _encode_multipart_formdata(data, files)
+        headers.update(new_headers)
+    elif data and isinstance(data, dict):
+        data = urllib.parse.urlencode(data)
+
+    if data:
+        data = data.encode("utf-8")
+
+    if json_data and not data:
+        data = json.dumps(json_data).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+
+    if params:  # GET args (POST args are handled in _encode_multipart_formdata)
+        scheme, netloc, path, query, fragment = urllib.parse.urlsplit(url)
+
+        if query:  # Combine query string and `params`
+            url_params = urllib.parse.parse_qs(query)
+            # `params` take precedence over URL query string
+            url_params.update(params)
+            params = url_params
+
+        query = urllib.parse.urlencode(params, doseq=True)
+        url = urllib.parse.urlunsplit((scheme, netloc, path, query, fragment))
+
+    return url, data, headers
+
+
 def _encode_multipart_formdata(fields, files):
     """Encode form data (``fields``) and ``files`` for POST request.
 
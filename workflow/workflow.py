@@ -11,24 +11,19 @@ up your Python script to best utilise the :class:`Workflow` object.
 
 """
 
-import binascii
 import json
 import logging
 import logging.handlers
 import os
 import pickle
-import plistlib
 import re
-import shutil
 import string
-import subprocess
 import sys
 import time
 import unicodedata
 from contextlib import contextmanager
-from copy import deepcopy
-from typing import Optional
-from uuid import uuid4
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
 
 from .util import atomic_writer, LockFile, uninterruptible, set_config
 
@@ -513,7 +508,7 @@ class SerializerManager:
 class BaseSerializer:
     """Base class for serializers."""
 
-    is_binary: Optional[bool] = None
+    is_binary: "bool | None" = None
 
     @classmethod
     def binary_mode(cls):  # pylint: disable=missing-function-docstring
@@ -619,8 +614,31 @@ class Item:
     Don't use this class directly but via :meth:`Workflow.add_item`.
     See :meth:`~Workflow.add_item` for details of arguments.
 
+    Items are created for every result on every keystroke, so they use
+    ``__slots__``, and their ``modifiers``, ``config`` and ``variables``
+    dicts are only created when first used.
+
     """
 
+    __slots__ = (
+        "title",
+        "subtitle",
+        "arg",
+        "autocomplete",
+        "match",
+        "valid",
+        "uid",
+        "icon",
+        "icontype",
+        "type",
+        "quicklookurl",
+        "largetext",
+        "copytext",
+        "_mods",
+        "_config",
+        "_vars",
+    )
+
     def __init__(
         self,
         title,
@@ -659,10 +677,42 @@ class Item:
         self.largetext = largetext
         self.copytext = copytext
 
-        self.modifiers = {}
+        self._mods = None
+        self._config = None
+        self._vars = None
 
-        self.config = {}
-        self.variables = {}
+    @property
+    def modifiers(self):
+        """Modifiers added with :meth:`add_modifier`, by key."""
+        if self._mods is None:
+            self._mods = {}
+        return self._mods
+
+    @modifiers.setter
+    def modifiers(self, value):
+        self._mods = value
+
+    @property
+    def config(self):
+        """Configuration passed to the next object in the workflow."""
+        if self._config is None:
+            self._config = {}
+        return self._config
+
+    @config.setter
+    def config(self, value):
+        self._config = value
+
+    @property
+    def variables(self):
+        """Workflow variables set for this item."""
+        if self._vars is None:
+            self._vars = {}
+        return self._vars
+
+    @variables.setter
+    def variables(self, value):
+        self._vars = value
 
     def setvar(self, name, value):
         """Set a workflow variable for this Item.
@@ -711,7 +761,8 @@ class Item:
         mod = Modifier(key, subtitle, arg, valid, icon, icontype)
 
         # Add Item variables to Modifier
-        mod.variables.update(self.variables)
+        if self._vars:
+            mod.variables.update(self._vars)
 
         self.modifiers[key] = mod
 
@@ -751,11 +802,11 @@ class Item:
         if self.quicklookurl is not None:
             obj_["quicklookurl"] = self.quicklookurl
 
-        if self.variables:
-            obj_["variables"] = self.variables
+        if self._vars:
+            obj_["variables"] = self._vars
 
-        if self.config:
-            obj_["config"] = self.config
+        if self._config:
+            obj_["config"] = self._config
 
         # Largetype and copytext
         text = self._text()
@@ -817,15 +868,95 @@ class Item:
             dict: Modifier mapping or `None`.
 
         """
-        if self.modifiers:
+        if self._mods:
             mods = {}
-            for k, mod in self.modifiers.items():
+            for k, mod in self._mods.items():
                 mods[k] = mod.obj
 
             return mods
 
         return None
 
+    def _json(self):
+        """Item as Alfred JSON, the same as ``json.dumps(self.obj)``.
+
+        Returns:
+            str: JSON object for the item.
+
+        """
+        parts = [
+            '{"title": ',
+            _encode(self.title),
+            ', "subtitle": ',
+            _encode(self.subtitle),
+            ', "valid": ',
+            _encode(self.valid),
+        ]
+
+        for name, key in _ITEM_OPTIONAL:
+            value = getattr(self, name)
+            if value is not None:
+                parts.append(key)
+                parts.append(_encode(value))
+
+        if self._vars:
+            parts.append(', "variables": ')
+            parts.append(json.dumps(self._vars))
+
+        if self._config:
+            parts.append(', "config": ')
+            parts.append(json.dumps(self._config))
+
+        if self.largetext is not None or self.copytext is not None:
+            parts.append(', "text": ')
+            parts.append(json.dumps(self._text()))
+
+        if self.icon is not None or self.icontype is not None:
+            parts.append(_icon_json(self.icon, self.icontype))
+
+        if self._mods:
+            parts.append(', "mods": ')
+            parts.append(json.dumps(self._modifiers()))
+
+        parts.append("}")
+        return "".join(parts)
+
+
+# Optional Item attributes in feedback order, with their JSON keys
+_ITEM_OPTIONAL = tuple(
+    (name, f', "{key}": ')
+    for name, key in (
+        ("arg", "arg"),
+        ("autocomplete", "autocomplete"),
+        ("match", "match"),
+        ("uid", "uid"),
+        ("type", "type"),
+        ("quicklookurl", "quicklookurl"),
+    )
+)
+
+
+def _encode(value):
+    """Encode one value as :func:`json.dumps` does, strings without the overhead."""
+    if value.__class__ is str:
+        return encode_basestring_ascii(value)
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    return json.dumps(value)
+
+
+@lru_cache(maxsize=64)
+def _icon_json(icon, icontype):
+    """``icon`` member of item JSON, cached as results mostly share a few icons."""
+    obj_ = {}
+    if icon is not None:
+        obj_["path"] = icon
+    if icontype is not None:
+        obj_["type"] = icontype
+    return ', "icon": ' + json.dumps(obj_)
+
 
 class Variables(dict):
     """Workflow variables for Run Script actions.
@@ -1044,6 +1175,11 @@ class Settings(dict):
     An appropriate instance is provided by :class:`Workflow` instances at
     :attr:`Workflow.settings`.
 
+    Reading settings takes no lock: the file is only ever replaced whole
+    (see :func:`~workflow.util.atomic_writer`), so a reader always sees a
+    complete version of it. Use :meth:`transaction` to make several changes
+    with a single write.
+
     """
 
     def __init__(self, filepath, defaults=None):
@@ -1051,7 +1187,11 @@ class Settings(dict):
         super().__init__()
         self._filepath = filepath
         self._nosave = False
-        self._original = {}
+        # settings as loaded, parsed into ``_original`` when first needed
+        self._raw = None
+        self._original_ = None
+        self._transaction = False
+        self._dirty = False
 
         if os.path.exists(self._filepath):
             self._load()
@@ -1061,37 +1201,96 @@ class Settings(dict):
 
             self.save()  # save default settings
 
+    @property
+    def _original(self):
+        """Settings as loaded, unaffected by later changes."""
+        if self._original_ is None:
+            self._original_ = json.loads(self._raw) if self._raw else {}
+
+        return self._original_
+
     def _load(self):
         """Load cached settings from JSON file `self._filepath`."""
-        data = {}
-
-        with LockFile(self._filepath, 0.5):
-            with open(self._filepath, "rb") as f:
-                data.update(json.load(f))
+        with open(self._filepath, "rb") as f:
+            raw = f.read()
 
-        self._original = deepcopy(data)
+        data = json.loads(raw)
+        self._raw = raw
+        self._original_ = None
 
         self._nosave = True
+        super().clear()
         self.update(data)
         self._nosave = False
 
     @uninterruptible
+    def _write(self):
+        """Write settings to ``self._filepath``. The caller holds the lock."""
+        data = {}
+        data.update(self)
+
+        with atomic_writer(self._filepath, "w") as f:
+            json.dump(data, f, sort_keys=True, indent=2)
+
     def save(self):
         """Save settings to JSON file specified in ``self._filepath``.
 
         If you're using this class via :attr:`Workflow.settings`, which
         you probably are, ``self._filepath`` will be ``settings.json``
         in your workflow's data directory (see :attr:`~Workflow.datadir`).
+
+        Inside a :meth:`transaction`, the settings are saved when it ends.
         """
         if self._nosave:
             return
 
-        data = {}
-        data.update(self)
+        if self._transaction:
+            self._dirty = True
+            return
 
         with LockFile(self._filepath, 0.5):
-            with atomic_writer(self._filepath, "w") as f:
-                json.dump(data, f, sort_keys=True, indent=2)
+            self._write()
+
+    @contextmanager
+    def transaction(self):
+        """Make several changes to the settings with a single write.
+
+        The settings file stays locked until the transaction ends, and
+        is read again at the start, so changes other processes saved in
+        the meantime are kept. The settings are written once at the end
+        if anything changed. If the block raises an exception, nothing is
+        written and the settings are read back from the file.
+
+        Transactions may be nested; only the outermost one writes.
+
+        Usage::
+
+            with wf.settings.transaction() as settings:
+                settings['daemon'] = 'on'
+                settings['events'] = 'on'
+
+        """
+        if self._transaction:
+            yield self
+            return
+
+        with LockFile(self._filepath, 0.5):
+            if os.path.exists(self._filepath):
+                self._load()
+
+            self._transaction = True
+            self._dirty = False
+            try:
+                yield self
+            except BaseException:
+                self._transaction = False
+                if os.path.exists(self._filepath):
+                    self._load()
+                raise
+
+            self._transaction = False
+            if self._dirty:
+                self._write()
 
     # dict methods
     def __setitem__(self, key, value):
@@ -1117,6 +1316,168 @@ class Settings(dict):
         return ret
 
 
+class FilterIndex:
+    """Search keys of a list of items, prepared once for repeated filtering.
+
+    Pass an instance to :meth:`Workflow.filter` or
+    :meth:`Workflow.filter_prefixes` in place of ``items`` to filter many
+    queries against the same items. Lowercased and ASCII-folded keys,
+    capitals, atoms and initials are worked out when the index is built,
+    and only items containing every character of a query (and, where
+    the match rules require ``query`` to be a substring of the key,
+    every three-letter run of it) are scored. Results are exactly those
+    of filtering the items themselves.
+
+    Usually created with :meth:`Workflow.filter_index`. The keys of an
+    item can also be worked out ahead of time with :meth:`prepare` and
+    stored, say as JSON, for an index to be built from with ``prepared``.
+
+    :param items: items to filter
+    :type items: ``list`` or ``tuple``
+    :param key: function to get comparison key from ``items``.
+        Must return ``str``.
+    :type key: ``callable``
+    :param prepared: function to get the result of :meth:`prepare` for
+        the comparison key of an item from ``items``, in place of ``key``
+    :type prepared: ``callable``
+    :param postings: look candidates up by character and trigram. Building
+        the lookup tables costs more than a query or two, so pass ``False``
+        for an index that is only filtered a few times, and candidates are
+        found by checking each key instead
+    :type postings: ``Boolean``
+
+    """
+
+    #: Rules that only match if ``query`` is a substring of the key
+    SUBSTRING_RULES = MATCH_STARTSWITH | MATCH_ATOM | MATCH_SUBSTRING
+
+    def __init__(self, items, key=lambda x: x, prepared=None, postings=True):
+        """Create new :class:`FilterIndex` object."""
+        self.items = list(items)
+        self.postings = postings
+        # one ``(item, sort key, plain keys, folded keys)`` per item
+        # with a non-empty search key
+        self.entries = []
+        self._postings = {}
+
+        for item in self.items:
+            stored = prepared(item) if prepared else self.prepare(key(item))
+
+            if stored is None:
+                continue
+
+            plain, folded = stored
+            keys = self._load(plain)
+            folded_keys = keys if folded is None else self._load(folded)
+            self.entries.append((item, keys[1], keys, folded_keys))
+
+    @classmethod
+    def prepare(cls, value):
+        """Everything an index needs of search key ``value``.
+
+        :param value: comparison key of an item
+        :type value: ``str``
+        :returns: plain and ASCII-folded keys as lists and strings that
+            can be stored as JSON, the folded ones ``None`` if folding
+            changes nothing, or ``None`` if ``value`` is empty
+        :rtype: ``list``
+
+        """
+        value = value.strip()
+
+        if value == "":
+            return None
+
+        folded = Workflow.fold_to_ascii(value)
+        return [
+            cls._dump(cls._keys(value)),
+            None if folded == value else cls._dump(cls._keys(folded)),
+        ]
+
+    @staticmethod
+    def _dump(keys):
+        value, lower, capitals, atoms, initials = keys
+        return [value, lower, capitals, sorted(atoms), initials]
+
+    @staticmethod
+    def _load(keys):
+        value, lower, capitals, atoms, initials = keys
+        return (value, lower, capitals, frozenset(atoms), initials)
+
+    def __len__(self):
+        """Number of items in the index."""
+        return len(self.items)
+
+    @staticmethod
+    def _keys(value):
+        """Everything :meth:`Workflow.filter` derives from a search key."""
+        atoms = [s.lower() for s in split_on_delimiters(value)]
+        return (
+            value,
+            value.lower(),
+            "".join([c for c in value if c in INITIALS]).lower(),
+            frozenset(atoms),
+            "".join([s[0] for s in atoms if s]),
+        )
+
+    def _posting(self, kind, folded):
+        """Map of character or trigram to the entries whose key contains it.
+
+        Built the first time it is needed.
+        """
+        if (kind, folded) not in self._postings:
+            postings = {}
+            size = 1 if kind == "chars" else 3
+
+            for i, entry in enumerate(self.entries):
+                lower = entry[3 if folded else 2][1]
+                grams = {lower[j : j + size] for j in range(len(lower) - size + 1)}
+
+                for gram in grams:
+                    postings.setdefault(gram, set()).add(i)
+
+            self._postings[(kind, folded)] = postings
+
+        return self._postings[(kind, folded)]
+
+    def candidates(self, query, folded, match_on):
+        """Indexes of the entries that may match lowercase ``query``.
+
+        :param folded: look in ASCII-folded keys
+        :type folded: ``Boolean``
+        :returns: ``set`` of indexes into :attr:`entries`
+
+        """
+        substring = len(query) >= 3 and not match_on & ~self.SUBSTRING_RULES
+
+        if not self.postings:
+            keys = 3 if folded else 2
+
+            if substring:
+                return {i for i, entry in enumerate(self.entries) if query in entry[keys][1]}
+
+            chars = set(query)
+            return {i for i, entry in enumerate(self.entries) if chars.issubset(entry[keys][1])}
+
+        postings = self._posting("chars", folded)
+        grams = set(query)
+
+        if substring:
+            postings = self._posting("trigrams", folded)
+            grams = {query[j : j + 3] for j in range(len(query) - 2)}
+
+        matches = []
+
+        for gram in grams:
+            if gram not in postings:
+                return set()
+
+            matches.append(postings[gram])
+
+        matches.sort(key=len)
+        return matches[0].intersection(*matches[1:])
+
+
 class Workflow:
     """The ``Workflow`` object is the main interface to Alfred-Workflow.
     It provides APIs for accessing the Alfred/workflow environment,
@@ -2079,7 +2440,26 @@ class Workflow:
         If ``query`` contains non-ASCII characters, search keys will not be
         altered.
 
+        **Indexed filtering**
+
+        ``items`` may also be a :class:`FilterIndex` (see
+        :meth:`filter_index`), in which case ``key`` is ignored. Results
+        are the same, but much cheaper to get when filtering the same
+        large list of items repeatedly.
+
         """
+        if isinstance(items, FilterIndex):
+            return self.filter_prefixes(
+                (query or "").split(" "),
+                items,
+                ascending=ascending,
+                include_score=include_score,
+                min_score=min_score,
+                max_results=max_results,
+                match_on=match_on,
+                fold_diacritics=fold_diacritics,
+            )[0]
+
         if not query:
             return items
 
@@ -2144,6 +2524,223 @@ class Workflow:
         # just return list of items
         return [result[0] for result in results]
 
+    def filter_prefixes(
+        self,
+        words,
+        items,
+        key=lambda x: x,
+        drop=(0,),
+        ascending=False,
+        include_score=False,
+        min_score=0,
+        max_results=0,
+        match_on=MATCH_ALL,
+        fold_diacritics=True,
+    ):
+        """Filter ``items`` against several leading parts of a query at once.
+
+        Returns one result list per entry in ``drop``. The list for ``n``
+        is exactly what :meth:`filter` returns for the query made of all
+        but the last ``n`` of ``words``, but every item's key is computed
+        and scored against each word only once, walking the words in
+        order and stopping at the first word the item does not match.
+
+        This is useful for working out where one part of a query ends and
+        the next begins, e.g. a name followed by a command.
+
+        :param words: words of the query, in order
+        :type words: ``list``
+        :param drop: numbers of trailing words to leave out
+        :type drop: ``tuple``
+
+        All other arguments are as for :meth:`filter`, and ``items`` may
+        likewise be a :class:`FilterIndex`.
+
+        :returns: ``list`` of result lists, one for each entry of ``drop``
+        :rtype: ``list``
+
+        """
+        words = [word.strip() for word in words]
+        words = [word for word in words if word]
+        lengths = [len(words) - n for n in drop]
+        longest = max(lengths) if lengths else 0
+
+        if isinstance(items, FilterIndex):
+            index, items = items, items.items
+
+        else:
+            index = None
+
+        if longest <= 0:
+            return [items for length in lengths]
+
+        # Use user override if there is one
+        fold_diacritics = self.settings.get(
+            "__workflow_diacritic_folding", fold_diacritics
+        )
+
+        matches = {length: [] for length in lengths if length > 0}
+
+        if index is not None:
+            self._filter_index_entries(
+                index, words[:longest], matches, match_on, fold_diacritics
+            )
+
+        for item in items if index is None else ():
+            value = key(item).strip()
+
+            if value == "":
+                continue
+
+            score = 0
+
+            for i, word in enumerate(words[:longest]):
+                score_, rule = self._filter_item(value, word, match_on, fold_diacritics)
+
+                if not score_:  # no longer query will match either
+                    break
+
+                score += score_
+
+                if i + 1 in matches and score:
+                    matches[i + 1].append(
+                        ((100.0 / score, value.lower(), score), (item, score, rule))
+                    )
+
+        results = []
+
+        for length in lengths:
+            if length <= 0:
+                results.append(items)
+                continue
+
+            result = sorted(matches[length], key=lambda x: x[0], reverse=ascending)
+            result = [r[1] for r in result]
+
+            if min_score:
+                result = [r for r in result if r[1] > min_score]
+
+            if max_results and len(result) > max_results:
+                result = result[:max_results]
+
+            if not include_score:
+                result = [r[0] for r in result]
+
+            results.append(result)
+
+        return results
+
+    def filter_index(self, items, key=lambda x: x, prepared=None, postings=True):
+        """Prepare ``items`` for repeated filtering.
+
+        The returned :class:`FilterIndex` can be passed to :meth:`filter`
+        and :meth:`filter_prefixes` in place of ``items``. Build it once
+        and keep it for as long as ``items`` don't change.
+
+        :param items: items to filter
+        :type items: ``list`` or ``tuple``
+        :param key: function to get comparison key from ``items``.
+            Must return ``str``. The default simply returns
+            the item.
+        :type key: ``callable``
+        :param prepared: function to get the keys of an item stored from
+            :meth:`FilterIndex.prepare`, used in place of ``key`` so that
+            they needn't be worked out again
+        :type prepared: ``callable``
+        :param postings: see :class:`FilterIndex`
+        :type postings: ``Boolean``
+        :returns: index of ``items``
+        :rtype: :class:`FilterIndex`
+
+        """
+        return FilterIndex(items, key, prepared, postings)
+
+    def _filter_index_entries(self, index, words, matches, match_on, fold_diacritics):
+        """Score the entries of ``index`` against ``words``.
+
+        Adds matches to ``matches`` the same way :meth:`filter_prefixes`
+        does for plain items.
+
+        """
+        queries = [word.lower() for word in words]
+        folded = [fold_diacritics and isascii(query) for query in queries]
+
+        # entries that may match the first 1, 2, ... words
+        candidates = []
+
+        for query, fold in zip(queries, folded):
+            ids = index.candidates(query, fold, match_on)
+
+            if candidates:
+                ids &= candidates[-1]
+
+            if not ids:
+                break
+
+            candidates.append(ids)
+
+        if not candidates:
+            return
+
+        for i in sorted(candidates[0]):
+            item, lower, keys, folded_keys = index.entries[i]
+            score = 0
+
+            for n, query in enumerate(queries[: len(candidates)]):
+                if i not in candidates[n]:
+                    break
+
+                score_, rule = self._filter_keys(
+                    folded_keys if folded[n] else keys, query, match_on
+                )
+
+                if not score_:  # no longer query will match either
+                    break
+
+                score += score_
+
+                if n + 1 in matches and score:
+                    matches[n + 1].append(
+                        ((100.0 / score, lower, score), (item, score, rule))
+                    )
+
+    def _filter_keys(self, keys, query, match_on):
+        """Filter prepared ``keys`` of a :class:`FilterIndex` entry.
+
+        Applies the same rules as :meth:`_filter_item` to a lowercase
+        ``query`` that has passed the character pre-filter.
+
+        :returns: ``(score, rule)``
+
+        """
+        value, lower, capitals, atoms, initials = keys
+
+        if match_on & MATCH_STARTSWITH and lower.startswith(query):
+            return (100.0 - (len(value) / len(query)), MATCH_STARTSWITH)
+
+        if match_on & MATCH_CAPITALS and capitals.startswith(query):
+            return (100.0 - (len(capitals) / len(query)), MATCH_CAPITALS)
+
+        if match_on & MATCH_ATOM and query in atoms:
+            return (100.0 - (len(value) / len(query)), MATCH_ATOM)
+
+        if match_on & MATCH_INITIALS_STARTSWITH and initials.startswith(query):
+            return (100.0 - (len(initials) / len(query)), MATCH_INITIALS_STARTSWITH)
+
+        if match_on & MATCH_INITIALS_CONTAIN and query in initials:
+            return (95.0 - (len(initials) / len(query)), MATCH_INITIALS_CONTAIN)
+
+        if match_on & MATCH_SUBSTRING and query in lower:
+            return (90.0 - (len(value) / len(query)), MATCH_SUBSTRING)
+
+        if match_on & MATCH_ALLCHARS:
+            match = self._search_for_query(query)(value)
+            if match:
+                score = 100.0 / ((1 + match.start()) * (match.end() - match.start() + 1))
+                return (score, MATCH_ALLCHARS)
+
+        return (0, None)
+
     def _filter_item(self, value, query, match_on, fold_diacritics):
         """Filter ``value`` against ``query`` using rules ``match_on``.
 
@@ -2260,7 +2857,9 @@ class Workflow:
         ``func`` will be called with :class:`Workflow` instance as first
         argument.
 
-        ``func`` should be the main entry point to your workflow.
+        ``func`` should be the main entry point to your workflow. It may
+        also be a coroutine function (``async def``), in which case it is
+        run to completion on a new :mod:`asyncio` event loop.
 
         Any exceptions raised will be logged and an error message will be
         output to Alfred.
@@ -2289,7 +2888,14 @@ class Workflow:
                 self.check_update()
 
             # Run workflow's entry function/method
-            func(self)
+            result = func(self)
+
+            # a coroutine function's coroutine: run it on an event loop
+            # (asyncio is only imported by workflows that need it)
+            if hasattr(result, "__await__"):
+                import asyncio
+
+                asyncio.run(result)
 
             # Set last version run to current version after a successful
             # run
@@ -2351,6 +2957,8 @@ class Workflow:
 
         """
         if not self._session_id:
+            from uuid import uuid4
+
             self._session_id = uuid4().hex
             self.setvar("_WF_SESSION_ID", self._session_id)
 
@@ -2480,8 +3088,10 @@ class Workflow:
             quicklookurl,
         )
 
-        # Add variables to child item
-        item.variables.update(self.variables)
+        # Add variables to child item - only if there are any, as most
+        # workflows set none
+        if self.variables:
+            item.variables.update(self.variables)
 
         self._items.append(item)
         return item
@@ -2533,14 +3143,50 @@ class Workflow:
         icon = icon or ICON_ERROR
         return self.add_item(title, subtitle, icon=icon)
 
+    def _json(self):
+        """Feedback as JSON, the same as ``json.dumps(self.obj)``.
+
+        Items are encoded straight to JSON text, without first building
+        the nested dicts of :attr:`obj`.
+
+        Returns:
+            str: Alfred feedback.
+
+        """
+        items = [
+            item._json()
+            if type(item).obj is Item.obj
+            else json.dumps(item.obj)
+            for item in self._items
+        ]
+        parts = ['{"items": [', ", ".join(items), "]"]
+
+        if self.variables:
+            parts.append(', "variables": ')
+            parts.append(json.dumps(self.variables))
+
+        if self.rerun:
+            parts.append(', "rerun": ')
+            parts.append(json.dumps(self.rerun))
+
+        parts.append("}")
+        return "".join(parts)
+
     def send_feedback(self):
-        """Print stored items to console/Alfred as JSON."""
+        """Print stored items to console/Alfred as JSON.
+
+        Returns:
+            str: The JSON printed.
+
+        """
         if self.debugging:
-            json.dump(self.obj, sys.stdout, indent=2, separators=(",", ": "))
+            feedback = json.dumps(self.obj, indent=2, separators=(",", ": "))
         else:
-            json.dump(self.obj, sys.stdout)
+            feedback = self._json()
 
+        sys.stdout.write(feedback)
         sys.stdout.flush()
+        return feedback
 
     ####################################################################
     # Updating methods
@@ -2782,6 +3428,8 @@ class Workflow:
             password = groups.get("pw")
 
             if hex_:
+                import binascii
+
                 password = str(binascii.unhexlify(hex_), "utf-8")
 
         self.logger.debug("got password : %s:%s", service, account)
@@ -2971,28 +3619,40 @@ class Workflow:
 
     def open_log(self):
         """Open :attr:`logfile` in default app (usually Console.app)."""
+        import subprocess
+
         subprocess.run(["/usr/bin/open", self.logfile], check=True)
 
     def open_cachedir(self):
         """Open the workflow's :attr:`cachedir` in Finder."""
+        import subprocess
+
         subprocess.run(["/usr/bin/open", self.cachedir], check=True)
 
     def open_datadir(self):
         """Open the workflow's :attr:`datadir` in Finder."""
+        import subprocess
+
         subprocess.run(["/usr/bin/open", self.datadir], check=True)
 
     def open_workflowdir(self):
         """Open the workflow's :attr:`workflowdir` in Finder."""
+        import subprocess
+
         subprocess.run(["/usr/bin/open", self.workflowdir], check=True)
 
     def open_terminal(self):
         """Open a Terminal window at workflow's :attr:`workflowdir`."""
+        import subprocess
+
         subprocess.run(
             ["/usr/bin/open", "-a", "Terminal", self.workflowdir], check=True
         )
 
     def open_help(self):
         """Open :attr:`help_url` in default browser."""
+        import subprocess
+
         subprocess.run(["/usr/bin/open", self.help_url], check=True)
 
         return "Opening workflow help URL in browser"
@@ -3080,6 +3740,8 @@ class Workflow:
                 path = os.path.join(dirpath, filename)
 
                 if os.path.isdir(path):
+                    import shutil
+
                     shutil.rmtree(path)
                 else:
                     os.unlink(path)
@@ -3088,6 +3750,8 @@ class Workflow:
 
     def _load_info_plist(self):
         """Load workflow info from ``info.plist``."""
+        import plistlib
+
         # info.plist should be in the directory above this one
         with open(self.workflowfile("info.plist"), "rb") as file_obj:
             self._info = plistlib.load(file_obj)
@@ -3127,6 +3791,8 @@ class Workflow:
         :returns: Data from stdout.
         :rtype: ``str``
         """
+        import subprocess
+
         cmd = ["security", action, "-s", service, "-a", account] + list(args)
         with subprocess.Popen(
             cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT